@@ -1,5 +1,7 @@
 from . import models
+from . import wizard
+from . import controllers
 from . import hooks
 
-# Import post_init_hook function to make it accessible for __manifest__.py
-from .hooks import post_init_update_balances
+# Import post_init_hook / uninstall_hook functions to make them accessible for __manifest__.py
+from .hooks import post_init_update_balances, uninstall_remove_balance_triggers
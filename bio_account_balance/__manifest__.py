@@ -15,11 +15,14 @@
     ],
     'data': [
         'security/ir.model.access.csv',
+        'data/ir_cron.xml',
         'views/account_move_line_views.xml',
         'views/account_move_line_balance_views.xml',
+        'wizard/account_move_line_balance_export_views.xml',
     ],
     'installable': True,
     'application': False,
     'auto_install': False,
     'post_init_hook': 'post_init_update_balances',
+    'uninstall_hook': 'uninstall_remove_balance_triggers',
 }
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарки bio_account_balance (ODOO-834).
+
+Не імпортуються модулем - запускаються з odoo shell на тестовій базі:
+
+    $ odoo-bin shell -d bench_db
+    >>> from odoo.addons.bio_account_balance.benchmarks import backends
+    >>> backends.run(env, moves=500)
+    >>> from odoo.addons.bio_account_balance.benchmarks import ledger
+    >>> ledger.run(env, lines=1000000, partners=20000, output='/tmp/ledger.json')
+"""
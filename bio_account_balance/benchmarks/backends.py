@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Порівняння бекендів підтримки балансів: 'python' (ORM-хуки + pre-commit черга)
+і 'trigger' (statement-level PL/pgSQL тригери). ODOO-834
+
+Для кожного бекенду в межах savepoint-а (все відкочується):
+- post: створення та проведення `moves` записів по одному партнеру
+- backdate: зміна дати першого рядка на рік назад (перерахунок всього хвоста)
+- draft: повернення половини записів в чернетку
+
+Використання (odoo shell):
+    >>> from odoo.addons.bio_account_balance.benchmarks import backends
+    >>> backends.run(env, moves=500, output='/tmp/backends.json')
+"""
+import json
+import logging
+import time
+from datetime import timedelta
+
+from odoo import fields
+
+_logger = logging.getLogger(__name__)
+
+BACKENDS = ('python', 'trigger')
+
+
+def _flush(env):
+    """Довести відкладені перерахунки до кінця (для python-бекенду вони виконуються на commit)."""
+    env.flush_all()
+    env['bio.account.move.line.balance']._flush_dirty_partitions()
+
+
+def _timed(env, func):
+    started = time.perf_counter()
+    func()
+    _flush(env)
+    return time.perf_counter() - started
+
+
+def _prepare(env):
+    company = env.company
+    journal = env['account.journal'].search([('type', '=', 'general'), ('company_id', '=', company.id)], limit=1)
+    receivable = env['account.account'].search([
+        ('account_type', '=', 'asset_receivable'), ('company_id', '=', company.id)], limit=1)
+    income = env['account.account'].search([
+        ('account_type', '=', 'income'), ('company_id', '=', company.id)], limit=1)
+    partner = env['res.partner'].create({'name': 'bio_account_balance benchmark'})
+    return journal, receivable, income, partner
+
+
+def _bench_backend(env, backend, moves):
+    balance_model = env['bio.account.move.line.balance']
+    balance_model.set_balance_backend(backend)
+    journal, receivable, income, partner = _prepare(env)
+    today = fields.Date.context_today(balance_model)
+
+    vals_list = [{
+        'move_type': 'entry',
+        'journal_id': journal.id,
+        'date': today,
+        'line_ids': [
+            (0, 0, {'account_id': receivable.id, 'partner_id': partner.id, 'debit': 100.0 + i, 'credit': 0.0}),
+            (0, 0, {'account_id': income.id, 'partner_id': partner.id, 'debit': 0.0, 'credit': 100.0 + i}),
+        ],
+    } for i in range(moves)]
+
+    result = {'backend': backend, 'moves': moves}
+    result['post'] = _timed(env, lambda: env['account.move'].create(vals_list).action_post())
+    posted = env['account.move'].search([('partner_id', '=', partner.id), ('state', '=', 'posted')])
+    first_line = posted[:1].line_ids.filtered(lambda l: l.account_id == receivable)
+    result['backdate'] = _timed(env, lambda: first_line.write({'date': today - timedelta(days=365)}))
+    result['draft'] = _timed(env, lambda: posted[:moves // 2].button_draft())
+    return result
+
+
+def run(env, moves=200, output=None):
+    """
+    Запускає бенчмарк обох бекендів, повертає список результатів (секунди)
+    і за потреби записує їх у JSON-файл output.
+    """
+    results = []
+    for backend in BACKENDS:
+        env.cr.execute("SAVEPOINT bio_balance_benchmark")
+        try:
+            results.append(_bench_backend(env, backend, moves))
+        finally:
+            env.cr.execute("ROLLBACK TO SAVEPOINT bio_balance_benchmark")
+            env.invalidate_all()
+            env.registry.clear_caches()
+        _logger.info("bio_account_balance benchmark: %s", results[-1])
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
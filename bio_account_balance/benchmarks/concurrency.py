@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Стрес-тест конкурентного проведення (ODOO-834).
+
+N потоків, кожен на власному курсорі, паралельно створюють і проводять записи:
+- shared: всі потоки пишуть в одну партицію (один партнер)
+- disjoint: кожен потік пише в свою партицію (свій партнер)
+Кожна транзакція комітиться. Рахуються deadlock-и та serialization failures,
+після завершення баланси задіяних партицій перевіряються
+bio.account.move.line.balance.check._find_drifted(). Створені дані видаляються.
+Кожен потік проводить у власний журнал: нумерація записів одного журналу
+конфліктувала б незалежно від балансів.
+
+Сценарій shared має завершитись без serialization failures і без розбіжностей:
+перерахунок з застарілим snapshot-ом віддає партицію post-commit проходу,
+а не повторює транзакцію (AssertionError інакше).
+
+УВАГА: комітить дані - лише для тестової бази.
+
+Використання (odoo shell):
+    >>> from odoo.addons.bio_account_balance.benchmarks import concurrency
+    >>> concurrency.run(env, workers=8, moves_per_worker=50, output='/tmp/concurrency.json')
+"""
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2 import errorcodes, OperationalError
+
+from odoo import api, fields, SUPERUSER_ID
+
+_logger = logging.getLogger(__name__)
+
+CONCURRENCY_ERRORS = {
+    errorcodes.DEADLOCK_DETECTED: 'deadlocks',
+    errorcodes.SERIALIZATION_FAILURE: 'serialization_failures',
+    errorcodes.LOCK_NOT_AVAILABLE: 'lock_timeouts',
+}
+
+
+def _worker(registry, journal_id, receivable_id, income_id, partner_id, moves, stats, lock):
+    for i in range(moves):
+        with registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            try:
+                env['account.move'].create({
+                    'move_type': 'entry',
+                    'journal_id': journal_id,
+                    'date': fields.Date.today(),
+                    'line_ids': [
+                        (0, 0, {'account_id': receivable_id, 'partner_id': partner_id, 'debit': 10.0 + i, 'credit': 0.0}),
+                        (0, 0, {'account_id': income_id, 'partner_id': partner_id, 'debit': 0.0, 'credit': 10.0 + i}),
+                    ],
+                }).action_post()
+                cr.commit()
+                key = 'committed'
+            except OperationalError as e:
+                cr.rollback()
+                key = CONCURRENCY_ERRORS.get(e.pgcode)
+                if not key:
+                    raise
+        with lock:
+            stats[key] = stats.get(key, 0) + 1
+
+
+def _scenario(env, name, workers, moves_per_worker, shared):
+    company = env.company
+    journals = env['account.journal'].create([{
+        'name': 'bio_account_balance stress %s %s' % (name, i),
+        'code': 'BS%s%s' % (name[0].upper(), i),
+        'type': 'general',
+        'company_id': company.id,
+    } for i in range(workers)])
+    receivable = env['account.account'].search([
+        ('account_type', '=', 'asset_receivable'), ('company_id', '=', company.id)], limit=1)
+    income = env['account.account'].search([('account_type', '=', 'income'), ('company_id', '=', company.id)], limit=1)
+    partners = env['res.partner'].create([
+        {'name': 'bio_account_balance stress %s %s' % (name, i)} for i in range(1 if shared else workers)])
+    env.cr.commit()
+
+    stats = {'committed': 0}
+    lock = threading.Lock()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(
+            _worker, env.registry, journals[i].id, receivable.id, income.id,
+            partners[0 if shared else i].id, moves_per_worker, stats, lock,
+        ) for i in range(workers)]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    # Перевірка балансів задіяних партицій: пачка з однієї партиції, починаючи з ключа
+    env.invalidate_all()
+    check = env['bio.account.move.line.balance.check']
+    drifted = []
+    for account_id in sorted((receivable | income).ids):
+        for partner_id in sorted(partners.ids):
+            rows = check._find_drifted((account_id, partner_id - 1), 1)
+            if rows and rows[0] == [(account_id, partner_id)]:
+                drifted.extend(rows[1])
+
+    # Прибирання
+    moves = env['account.move'].search([('line_ids.partner_id', 'in', partners.ids)])
+    moves.button_draft()
+    moves.unlink()
+    partners.unlink()
+    journals.unlink()
+    env.cr.commit()
+
+    return dict(stats, scenario=name, workers=workers, moves_per_worker=moves_per_worker,
+                seconds=elapsed, drifted_partitions=len(drifted))
+
+
+def run(env, workers=8, moves_per_worker=50, output=None):
+    """
+    Запускає сценарії shared і disjoint, повертає список результатів
+    і за потреби записує їх у JSON-файл output.
+    """
+    results = [
+        _scenario(env, 'shared', workers, moves_per_worker, shared=True),
+        _scenario(env, 'disjoint', workers, moves_per_worker, shared=False),
+    ]
+    for result in results:
+        _logger.info("bio_account_balance concurrency: %s", result)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    shared = results[0]
+    assert not shared.get('serialization_failures'), \
+        "shared partition run: %s serialization failures" % shared['serialization_failures']
+    assert not shared['drifted_partitions'], \
+        "shared partition run: %s drifted partitions" % shared['drifted_partitions']
+    return results
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Генератор синтетичної книги та набір бенчмарків bio_account_balance (ODOO-834).
+
+generate() одним SQL запитом створює проведені записи (2 рядки на запис) заданого розміру:
+- lines / partners / accounts - розмір книги
+- hot_partners + hot_share - перекіс: частка рядків (hot_share) припадає на кількох
+  "гарячих" партнерів з дуже довгою історією
+Рядки вставляються сирим SQL (без ORM-хуків і тригерів), баланси потім рахує full_rebuild.
+
+run() в межах savepoint-а (все відкочується) генерує книгу і вимірює сценарії:
+- full_rebuild: reset_and_update_balances() послідовно в поточній транзакції
+- pivot:<domain>:<groupby>: read_group з opening/closing на кількох групуваннях
+- single_post: один запис по гарячому партнеру
+- batch_post: batch записів по випадкових партнерах
+- backdated_edit: перенесення останнього рядка гарячого партнера на початок історії
+Для кожного сценарію: секунди, кількість SQL запитів курсора, кількість вставлених /
+оновлених / видалених рядків по таблицях (pg_stat_xact_user_tables).
+
+Використання (odoo shell, тестова база):
+    >>> from odoo.addons.bio_account_balance.benchmarks import ledger
+    >>> ledger.run(env, lines=1000000, partners=20000, hot_partners=5, output='/tmp/ledger.json')
+"""
+import json
+import logging
+import random
+import time
+from datetime import timedelta
+
+from odoo import fields
+
+from .backends import _flush
+
+_logger = logging.getLogger(__name__)
+
+# Таблиці, по яких рахуються змінені рядки
+TRACKED_TABLES = (
+    'account_move_line',
+    'bio_account_move_line_balance',
+    'bio_account_move_line_balance_checkpoint',
+)
+PIVOT_MEASURES = ['balance:sum', 'bio_opening_by_partner', 'bio_closing_by_partner']
+PIVOT_GROUPBYS = [
+    [],
+    ['partner_id'],
+    ['account_id', 'partner_id'],
+    ['date:month'],
+    ['partner_id', 'date:month'],
+]
+
+
+def _table_counters(env):
+    env.cr.execute("""
+        SELECT relname, n_tup_ins, n_tup_upd, n_tup_del
+        FROM pg_stat_xact_user_tables
+        WHERE relname IN %s
+    """, (TRACKED_TABLES,))
+    return {relname: (ins, upd, dele) for relname, ins, upd, dele in env.cr.fetchall()}
+
+
+def _measure(env, name, func):
+    """Виконує сценарій і повертає його метрики."""
+    counters = _table_counters(env)
+    queries = env.cr.sql_log_count
+    started = time.perf_counter()
+    func()
+    _flush(env)
+    seconds = time.perf_counter() - started
+    queries = env.cr.sql_log_count - queries
+    rows = {}
+    for relname, after in _table_counters(env).items():
+        before = counters.get(relname, (0, 0, 0))
+        rows[relname] = dict(zip(('inserted', 'updated', 'deleted'), (a - b for a, b in zip(after, before))))
+    result = {'scenario': name, 'seconds': seconds, 'queries': queries, 'rows': rows}
+    _logger.info("bio_account_balance ledger benchmark: %s", result)
+    return result
+
+
+def _pick_accounts(env, accounts):
+    company = env.company
+    Account = env['account.account']
+    counterpart = Account.search([('account_type', '=', 'income'), ('company_id', '=', company.id)], limit=1)
+    ledger_accounts = Account.search([
+        ('company_id', '=', company.id),
+        ('deprecated', '=', False),
+        ('account_type', 'not in', ('off_balance', 'income')),
+    ], limit=accounts)
+    return ledger_accounts, counterpart
+
+
+def generate(env, lines=100000, partners=1000, accounts=5, hot_partners=5, hot_share=0.3, days=730, seed=0.42):
+    """
+    Генерує синтетичну книгу: lines // 2 проведених записів за останні days днів.
+    Повертає опис згенерованих даних (партнери, рахунки, журнал).
+    """
+    company = env.company
+    journal = env['account.journal'].search([('type', '=', 'general'), ('company_id', '=', company.id)], limit=1)
+    ledger_accounts, counterpart = _pick_accounts(env, accounts)
+    partner_recs = env['res.partner'].create([
+        {'name': 'bio_account_balance ledger %s' % i} for i in range(partners)])
+    hot_ids = partner_recs[:hot_partners].ids
+    cold_ids = partner_recs[hot_partners:].ids or hot_ids
+    date_to = fields.Date.context_today(journal)
+
+    env.flush_all()
+    env.cr.execute("SELECT setseed(%s)", (seed,))
+    with env['bio.account.move.line.balance']._without_balance_triggers():
+        env.cr.execute("""
+            WITH moves AS (
+                INSERT INTO account_move
+                    (name, date, journal_id, company_id, currency_id, partner_id,
+                     state, move_type, auto_post, create_uid, write_uid, create_date, write_date)
+                SELECT
+                    'BIOBENCH/' || g,
+                    %(date_to)s::date - (random() * %(days)s)::int,
+                    %(journal_id)s, %(company_id)s, %(currency_id)s,
+                    CASE WHEN random() < %(hot_share)s
+                        THEN (%(hot_ids)s::int[])[1 + floor(random() * %(hot_count)s)::int]
+                        ELSE (%(cold_ids)s::int[])[1 + floor(random() * %(cold_count)s)::int]
+                    END,
+                    'posted', 'entry', 'no', %(uid)s, %(uid)s, now(), now()
+                FROM generate_series(1, %(moves)s) g
+                RETURNING id, name, date, partner_id
+            ),
+            amounts AS (
+                SELECT m.*,
+                       round((random() * 1000)::numeric, 2) + 0.01 AS amount,
+                       (%(account_ids)s::int[])[1 + floor(random() * %(account_count)s)::int] AS account_id
+                FROM moves m
+            )
+            INSERT INTO account_move_line
+                (move_id, move_name, name, date, journal_id, company_id, company_currency_id, currency_id,
+                 account_id, partner_id, display_type, parent_state,
+                 debit, credit, balance, amount_currency,
+                 create_uid, write_uid, create_date, write_date)
+            SELECT
+                a.id, a.name, a.name, a.date, %(journal_id)s, %(company_id)s, %(currency_id)s, %(currency_id)s,
+                CASE WHEN side.debit THEN a.account_id ELSE %(counterpart_id)s END,
+                a.partner_id, 'product', 'posted',
+                CASE WHEN side.debit THEN a.amount ELSE 0 END,
+                CASE WHEN side.debit THEN 0 ELSE a.amount END,
+                CASE WHEN side.debit THEN a.amount ELSE -a.amount END,
+                CASE WHEN side.debit THEN a.amount ELSE -a.amount END,
+                %(uid)s, %(uid)s, now(), now()
+            FROM amounts a
+            CROSS JOIN (VALUES (TRUE), (FALSE)) AS side(debit);
+        """, {
+            'moves': lines // 2,
+            'days': days,
+            'date_to': date_to,
+            'journal_id': journal.id,
+            'company_id': company.id,
+            'currency_id': company.currency_id.id,
+            'hot_share': hot_share if hot_ids else 0.0,
+            'hot_ids': hot_ids,
+            'hot_count': len(hot_ids),
+            'cold_ids': cold_ids,
+            'cold_count': len(cold_ids),
+            'account_ids': ledger_accounts.ids,
+            'account_count': len(ledger_accounts),
+            'counterpart_id': counterpart.id,
+            'uid': env.uid,
+        })
+    env.cr.execute("ANALYZE account_move_line")
+    env.invalidate_all()
+    return {
+        'journal': journal,
+        'accounts': ledger_accounts,
+        'counterpart': counterpart,
+        'hot_partners': partner_recs[:hot_partners],
+        'partners': partner_recs,
+        'date_from': date_to - timedelta(days=days),
+        'date_to': date_to,
+    }
+
+
+def _move_vals(ledger, partner, amount, date):
+    account = ledger['accounts'][0]
+    return {
+        'move_type': 'entry',
+        'journal_id': ledger['journal'].id,
+        'date': date,
+        'line_ids': [
+            (0, 0, {'account_id': account.id, 'partner_id': partner.id, 'debit': amount, 'credit': 0.0}),
+            (0, 0, {'account_id': ledger['counterpart'].id, 'partner_id': partner.id, 'debit': 0.0, 'credit': amount}),
+        ],
+    }
+
+
+def _scenarios(env, ledger, batch):
+    AML = env['account.move.line']
+    Move = env['account.move']
+    hot = ledger['hot_partners'][:1] or ledger['partners'][:1]
+    date_to = ledger['date_to']
+    middle = ledger['date_from'] + (date_to - ledger['date_from']) / 2
+    rng = random.Random(42)
+
+    results = [_measure(env, 'full_rebuild', lambda: env['bio.account.move.line.balance'].reset_and_update_balances())]
+
+    domains = {
+        'all': [],
+        'period': [('date', '>=', middle), ('date', '<=', date_to)],
+        'journal': [('journal_id', '=', ledger['journal'].id)],
+    }
+    for domain_name, domain in domains.items():
+        for groupby in PIVOT_GROUPBYS:
+            name = 'pivot:%s:%s' % (domain_name, ','.join(groupby) or '-')
+            results.append(_measure(env, name, lambda domain=domain, groupby=groupby: AML.read_group(
+                domain, PIVOT_MEASURES, groupby, lazy=False)))
+
+    results.append(_measure(env, 'single_post', lambda: Move.create(
+        _move_vals(ledger, hot, 10.0, date_to)).action_post()))
+
+    results.append(_measure(env, 'batch_post', lambda: Move.create([
+        _move_vals(ledger, rng.choice(ledger['partners']), 10.0 + i, date_to) for i in range(batch)
+    ]).action_post()))
+
+    last_line = AML.search([
+        ('partner_id', '=', hot.id),
+        ('account_id', '=', ledger['accounts'][0].id),
+        ('parent_state', '=', 'posted'),
+    ], order='date desc, id desc', limit=1)
+    results.append(_measure(env, 'backdated_edit', lambda: last_line.write({'date': ledger['date_from']})))
+    return results
+
+
+def run(env, lines=100000, partners=1000, accounts=5, hot_partners=5, hot_share=0.3,
+        days=730, batch=100, output=None):
+    """
+    Генерує книгу і вимірює сценарії в межах savepoint-а (все відкочується).
+    Повертає результат і за потреби записує його у JSON-файл output
+    для порівняння між версіями модуля.
+    """
+    module = env['ir.module.module'].search([('name', '=', 'bio_account_balance')], limit=1)
+    report = {
+        'module_version': module.latest_version,
+        'backend': env['bio.account.move.line.balance']._get_balance_backend(),
+        'params': {
+            'lines': lines, 'partners': partners, 'accounts': accounts,
+            'hot_partners': hot_partners, 'hot_share': hot_share, 'days': days, 'batch': batch,
+        },
+    }
+    env.cr.execute("SAVEPOINT bio_balance_ledger_benchmark")
+    try:
+        started = time.perf_counter()
+        ledger = generate(env, lines=lines, partners=partners, accounts=accounts,
+                          hot_partners=hot_partners, hot_share=hot_share, days=days)
+        report['generate_seconds'] = time.perf_counter() - started
+        report['scenarios'] = _scenarios(env, ledger, batch)
+    finally:
+        env.cr.execute("ROLLBACK TO SAVEPOINT bio_balance_ledger_benchmark")
+        env.invalidate_all()
+        env.registry.clear_caches()
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from werkzeug.exceptions import NotFound
+
+from odoo import api, http
+from odoo.http import request, content_disposition
+from odoo.modules.registry import Registry
+
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+class LedgerExportController(http.Controller):
+
+    @http.route('/bio_account_balance/ledger_export/<int:wizard_id>', type='http', auth='user')
+    def ledger_export(self, wizard_id, **kwargs):
+        """
+        Потокова віддача файлу вивантаження (ODOO-834).
+        Курсор запиту закривається після повернення відповіді, тому генератор
+        відкриває власний курсор і читає рядки named cursor-ом пачками.
+        """
+        wizard = request.env['bio.account.move.line.balance.export'].browse(wizard_id).exists()
+        if not wizard or wizard.create_uid != request.env.user:
+            raise NotFound()
+        request.env['account.move.line'].check_access_rights('read')
+
+        domain = wizard._get_domain()
+        file_format = wizard.file_format
+        dbname, uid, context = request.env.cr.dbname, request.env.uid, dict(request.env.context)
+
+        def stream():
+            with Registry(dbname).cursor() as cr:
+                env = api.Environment(cr, uid, context)
+                yield from env['account.move.line']._ledger_export_stream(domain, file_format)
+
+        return http.Response(stream(), headers=[
+            ('Content-Type', EXPORT_CONTENT_TYPES[file_format]),
+            ('Content-Disposition', content_disposition(wizard._get_filename())),
+        ], direct_passthrough=True)
+
+    @http.route('/bio_account_balance/ledger', type='json', auth='user')
+    def ledger_page(self, account_id, partner_id=False, date_from=None, date_to=None, limit=None, cursor=None):
+        """
+        Сторінка книги партнера з keyset-пагінацією (ODOO-834),
+        див. account.move.line.get_ledger_page.
+        """
+        return request.env['account.move.line'].get_ledger_page(
+            account_id, partner_id=partner_id, date_from=date_from, date_to=date_to,
+            limit=limit, cursor=cursor)
+
+    @http.route('/bio_account_balance/status', type='json', auth='user')
+    def balance_status(self):
+        """
+        Стан балансів (ODOO-834): 'ready' або 'initializing' з прогресом
+        початкового заповнення, див. account.move.line.get_balance_status.
+        """
+        return request.env['account.move.line'].get_balance_status()
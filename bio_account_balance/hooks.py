@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 from odoo import api, SUPERUSER_ID
 import logging
+
+from .models.account_move_line_balance_cache import LEDGER_VERSION_TABLE
+from .models.account_move_line_balance_guard import GUARD_FUNCTION, GUARD_TABLE
+
 _logger = logging.getLogger(__name__)
 
 
@@ -9,10 +13,12 @@ def post_init_update_balances(cr, registry):
     Post-install hook для початкового заповнення балансів.
     Викликається один раз після встановлення/оновлення модуля.
 
-    Виконує:
-    1. TRUNCATE таблиці bio_account_move_line_balance
-    2. Розрахунок балансів через SQL window function
-    3. UPDATE основної таблиці account_move_line для синхронізації
+    Планує повну перебудову через bio.account.move.line.balance.rebuild
+    (chunk-и по компанії + діапазону рахунків). Якщо рядків не більше
+    bio_account_balance.init_inline_threshold - chunk-и обробляються одразу,
+    послідовно в транзакції встановлення. Інакше встановлення завершується
+    без заповнення, chunk-и обробляє cron Account Balance: Initialize Balances
+    (кожен chunk - окремий commit), стан - account.move.line.get_balance_status().
 
     ODOO-834
     """
@@ -20,11 +26,28 @@ def post_init_update_balances(cr, registry):
         _logger.info(">>> bio_account_balance: post_init_update_balances START <<<")
         env = api.Environment(cr, SUPERUSER_ID, {'install_mode': True})
 
-        result = env['bio.account.move.line.balance'].reset_and_update_balances()
+        result = env['bio.account.move.line.balance.rebuild']._schedule_initial_fill()
 
         if result:
             _logger.info(">>> bio_account_balance: post_init_update_balances END (SUCCESS) <<<")
+        elif env['bio.account.move.line.balance.rebuild']._initial_fill().state == 'running':
+            _logger.info(">>> bio_account_balance: post_init_update_balances END (DEFERRED to cron) <<<")
         else:
-            _logger.warning(">>> bio_account_balance: post_init_update_balances END (FAILED - see reset_and_update_balances errors) <<<")
+            _logger.warning(">>> bio_account_balance: post_init_update_balances END (FAILED - see rebuild chunk errors) <<<")
     except Exception as e:
         _logger.error(">>> bio_account_balance: post_init_update_balances FAIL: %s <<<", str(e), exc_info=True)
+
+
+def uninstall_remove_balance_triggers(cr, registry):
+    """
+    Uninstall hook: видаляє тригери та функції trigger-бекенду з account_move_line,
+    щоб після видалення модуля вони не посилались на видалені таблиці,
+    таблицю-охоронця партицій з її функцією і журнал версій книги
+    (створені в init(), ORM про них не знає).
+    ODOO-834
+    """
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['bio.account.move.line.balance']._uninstall_balance_triggers()
+    cr.execute(f"DROP FUNCTION IF EXISTS {GUARD_FUNCTION}(int[], int[])")
+    cr.execute(f"DROP TABLE IF EXISTS {GUARD_TABLE}")
+    cr.execute(f"DROP TABLE IF EXISTS {LEDGER_VERSION_TABLE}")
@@ -1,2 +1,20 @@
 from . import account_move_line_balance
+from . import account_move_line_balance_guard
+from . import account_move_line_balance_backend
+from . import account_move_line_balance_plan
+from . import account_move_line_balance_cache
+from . import account_move_line_balance_stat
+from . import account_move_line_balance_queue
+from . import account_move_line_balance_checkpoint
+from . import account_move_line_balance_anchor
+from . import account_move_line_balance_compaction
+from . import account_move_line_balance_rebuild
+from . import account_move_line_balance_check
+from . import account_move_line_balance_open
 from . import account_move_line
+from . import account_move_line_export
+from . import account_move_line_ledger
+from . import account_move_line_balance_at
+from . import account_move
+from . import account_partial_reconcile
+from . import res_company
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+
+
+class AccountMove(models.Model):
+    _inherit = 'account.move'
+
+    def write(self, vals):
+        """
+        parent_state на account.move.line - related stored поле, його зміна при
+        action_post() / button_draft() / button_cancel() не проходить через
+        AccountMoveLine.write(). Тому партиції рядків переміщених записів
+        позначаються брудними тут, одним викликом на весь recordset:
+        при проведенні 5000 рахунків - один перерахунок на кожну партицію.
+        Враховуються лише переходи в/з 'posted'; при виході з 'posted' партиції
+        рядків зчитуються до зміни стану (після неї рядки вже не проведені).
+        ODOO-834
+        """
+        if 'state' not in vals or self.env['account.move.line']._skip_balance_hooks():
+            return super().write(vals)
+
+        to_post = vals['state'] == 'posted'
+        moves = self.filtered(lambda m: (m.state == 'posted') != to_post)
+        # Рядки записів, що виходять з проведених: їх партиції - до зміни стану
+        old_partitions = {} if to_post else moves.line_ids._get_balance_partitions(posted_only=True)
+        res = super().write(vals)
+        if moves:
+            moves.line_ids.with_context(bio_balance_caller='move_state')._schedule_balance_update(
+                old_partitions, unposted=not to_post)
+        return res
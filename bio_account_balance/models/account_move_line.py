@@ -1,12 +1,47 @@
 # -*- coding: utf-8 -*-
-from odoo import api, fields, models
+import logging
+from contextlib import closing, contextmanager
+from datetime import timedelta
+
+from odoo import api, fields, models, sql_db
+from odoo.osv import expression
+
+from .account_move_line_balance_cache import FIELD_SCOPE_PREFIX, LEDGER_SCOPE, OPEN_SCOPE
+
+_logger = logging.getLogger(__name__)
+
+# Поля, зміна яких впливає на running balance (ODOO-834)
+BALANCE_DEPENDENT_FIELDS = frozenset({
+    'debit', 'credit', 'balance', 'date', 'account_id', 'partner_id', 'parent_state',
+    'amount_currency', 'currency_id',
+})
+# Поля звірки: змінюють лише відкритий баланс (його версію піднімає перерахунок bio_open_balance)
+RECONCILE_FIELDS = frozenset({
+    'amount_residual', 'amount_residual_currency', 'reconciled', 'full_reconcile_id', 'matching_number',
+})
+# Поля, зміна яких переносить рядок в іншу партицію / іншу позицію в партиції
+PARTITION_FIELDS = frozenset({'account_id', 'partner_id', 'date'})
+# Поля домену, які можна перенести на bio.account.move.line.balance.checkpoint
+CHECKPOINT_DOMAIN_FIELDS = frozenset({'company_id', 'account_id', 'partner_id'})
+# Типи рядків без рахунку і сум: їх виключення з домену не змінює балансів (домен Journal Items)
+NON_BALANCE_DISPLAY_TYPES = frozenset({'line_section', 'line_note'})
+# Ключ стану bulk-режиму в cr.precommit.data (див. _bulk_balance_mode)
+BULK_MODE_KEY = 'bio_account_balance.bulk_mode'
+# Покриваючий індекс проведених рядків по партиції (див. _auto_init).
+# INCLUDE - лише колонки, які не змінюються після проведення: UPDATE балансів і звірок лишаються HOT
+BALANCE_INDEX_NAME = 'bio_aml_balance_partition_idx'
+BALANCE_INDEX_NEW_NAME = 'bio_aml_balance_partition_idx_new'
+BALANCE_INDEX_INCLUDE = [
+    'partner_id', 'company_id', 'company_currency_id', 'debit', 'credit',
+    'currency_id', 'amount_currency',
+]
 
 
 class AccountMoveLine(models.Model):
     _inherit = 'account.move.line'
 
     # Stored balance fields (зберігаються в БД)
-    # Заповнюються через SQL в _update_balances_incremental() або reset_and_update_balances()
+    # Заповнюються через SQL в _schedule_balance_update() (pre-commit) або reset_and_update_balances()
     # НЕ використовуються в pivot view - для pivot є динамічні поля bio_opening/closing_by_partner
     bio_initial_balance = fields.Monetary(
         string="Initial Balance",
@@ -14,7 +49,7 @@ class AccountMoveLine(models.Model):
         readonly=True,
         help="Balance BEFORE the current line (excluding current transaction). "
              "Calculated using SQL window functions with PARTITION BY account+partner. "
-             "Updated automatically via _update_balances_incremental() or manually via 'Reset and Update Balances'. "
+             "Updated automatically on commit of changed lines or manually via 'Reset and Update Balances'. "
              "Not available as pivot measure - use bio_opening_by_partner instead."
     )  # ODOO-834
 
@@ -24,10 +59,39 @@ class AccountMoveLine(models.Model):
         readonly=True,
         help="Balance AFTER the current line (including current transaction). "
              "Calculated using SQL window functions with PARTITION BY account+partner. "
-             "Updated automatically via _update_balances_incremental() or manually via 'Reset and Update Balances'. "
+             "Updated automatically on commit of changed lines or manually via 'Reset and Update Balances'. "
              "Not available as pivot measure - use bio_closing_by_partner instead."
     )  # ODOO-834
 
+    # Running balance у валюті операції (amount_currency), партиція account + partner + currency_id.
+    # Рахується тим же проходом window function, що й bio_initial/end_balance
+    bio_initial_balance_currency = fields.Monetary(
+        string="Initial Balance in Currency",
+        currency_field="currency_id",
+        readonly=True,
+        help="Balance in the transaction currency BEFORE the current line, "
+             "per account + partner + currency."
+    )  # ODOO-834
+
+    bio_end_balance_currency = fields.Monetary(
+        string="End Balance in Currency",
+        currency_field="currency_id",
+        readonly=True,
+        help="Balance in the transaction currency AFTER the current line, "
+             "per account + partner + currency."
+    )  # ODOO-834
+
+    # Відкритий running balance: сума amount_residual рахунків дебіторів / кредиторів,
+    # партиція account + partner (див. bio.account.move.line.balance._open_partitions_sql)
+    bio_open_balance = fields.Monetary(
+        string="Open Balance",
+        currency_field="company_currency_id",
+        readonly=True,
+        help="Running total of the amounts still open (residual) on receivable/payable accounts "
+             "up to and including this line, per account + partner. "
+             "Updated when lines are posted or changed and when reconciliations change."
+    )  # ODOO-834
+
     # Dynamic balance fields (НЕ зберігаються, розраховуються в read_group)
     # Використовуються в pivot view для коректного відображення балансів з урахуванням фільтрів
     bio_opening_by_partner = fields.Monetary(
@@ -52,6 +116,90 @@ class AccountMoveLine(models.Model):
              "Formula: bio_opening_by_partner + sum(balance) = bio_closing_by_partner"
     )  # ODOO-834
 
+    bio_open_by_partner = fields.Monetary(
+        string="Open Balance",
+        currency_field="company_currency_id",
+        store=False,  # Не зберігається в БД, розраховується динамічно
+        readonly=True,
+        help="Dynamic open balance based on pivot filters: amounts of the receivable/payable "
+             "items up to the END of the filtered period that are still open today. "
+             "Calculated in read_group() method."
+    )  # ODOO-834
+
+    def _auto_init(self):
+        """
+        Покриваючий частковий індекс під пошук першого рядка партиції (anchor), хвоста партиції
+        в _recompute_partitions() та DISTINCT ON в _calc_balances_by_groups():
+        ключ (account_id, partner, date, id), INCLUDE - незмінні колонки, які читають ці запити
+        (debit, credit, валюти); баланси читаються з heap лише для знайдених рядків.
+        Відсутній індекс створюється одразу. Індекс іншого формату не перестворюється
+        в транзакції оновлення модуля (CREATE INDEX блокує запис в account_move_line,
+        а CONCURRENTLY неможливий в транзакції) - лише попередження, перебудова -
+        _rebuild_balance_index() (server action Rebuild Partition Index).
+        ODOO-834
+        """
+        res = super()._auto_init()
+        outdated = self._balance_index_outdated()
+        if outdated is None:
+            self._cr.execute(self._balance_index_sql(BALANCE_INDEX_NAME))
+            _logger.info("bio_account_balance: index %s created", BALANCE_INDEX_NAME)
+        elif outdated:
+            _logger.warning("bio_account_balance: index %s has an outdated format, "
+                            "run 'Rebuild Partition Index' to rebuild it concurrently", BALANCE_INDEX_NAME)
+        return res
+
+    @api.model
+    def _balance_index_sql(self, name, concurrently=False):
+        return f"""
+            CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}{name}
+            ON {self._table} (account_id, (COALESCE(partner_id, 0)), date, id)
+            INCLUDE ({", ".join(BALANCE_INDEX_INCLUDE)})
+            WHERE parent_state = 'posted'
+        """
+
+    @api.model
+    def _balance_index_outdated(self):
+        """
+        None - індексу немає, True - формат INCLUDE відрізняється від BALANCE_INDEX_INCLUDE,
+        False - індекс актуальний.
+        ODOO-834
+        """
+        self._cr.execute("SELECT indexdef FROM pg_indexes WHERE indexname = %s", (BALANCE_INDEX_NAME,))
+        row = self._cr.fetchone()
+        if not row:
+            return None
+        return "INCLUDE (%s)" % ", ".join(BALANCE_INDEX_INCLUDE) not in row[0]
+
+    @api.model
+    def _rebuild_balance_index(self):
+        """
+        Перебудова індексу без блокування запису: CREATE INDEX CONCURRENTLY під
+        BALANCE_INDEX_NEW_NAME, DROP INDEX CONCURRENTLY старого, RENAME нового.
+        Поки новий індекс будується, запити використовують старий.
+
+        CONCURRENTLY виконується лише поза транзакцією і чекає завершення всіх
+        транзакцій зі старшим snapshot-ом, тому поточна транзакція комітиться,
+        а DDL виконується окремим з'єднанням в autocommit. Не викликати з cron
+        (транзакція блокування cron-задачі тримає snapshot - CREATE INDEX чекатиме її вічно).
+        Повертає True, якщо індекс перебудовано.
+        ODOO-834
+        """
+        if self._balance_index_outdated() is False:
+            return False
+        self.env.cr.commit()
+        with closing(sql_db.db_connect(self.env.cr.dbname).cursor()) as cr:
+            cr._cnx.autocommit = True
+            try:
+                # Невалідний залишок перерваної перебудови
+                cr.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {BALANCE_INDEX_NEW_NAME}")
+                cr.execute(self._balance_index_sql(BALANCE_INDEX_NEW_NAME, concurrently=True))
+                cr.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {BALANCE_INDEX_NAME}")
+                cr.execute(f"ALTER INDEX {BALANCE_INDEX_NEW_NAME} RENAME TO {BALANCE_INDEX_NAME}")
+            finally:
+                cr._cnx.autocommit = False
+        _logger.info("bio_account_balance: index %s rebuilt concurrently", BALANCE_INDEX_NAME)
+        return True
+
     @api.model
     def read_group(self, domain, fields, groupby, offset=0, limit=None, orderby=False, lazy=True):
         """
@@ -67,7 +215,7 @@ class AccountMoveLine(models.Model):
         ODOO-834
         """
         # Список полів які треба розрахувати динамічно
-        dynamic_fields = ['bio_opening_by_partner', 'bio_closing_by_partner']
+        dynamic_fields = ['bio_opening_by_partner', 'bio_closing_by_partner', 'bio_open_by_partner']
 
         # Перевіряємо чи запитують хоча б одне динамічне поле
         requested_dynamic_fields = [f for f in fields if any(df in f for df in dynamic_fields)]
@@ -76,243 +224,474 @@ class AccountMoveLine(models.Model):
             # Якщо не запитують динамічні поля - викликаємо стандартний read_group
             return super().read_group(domain, fields, groupby, offset, limit, orderby, lazy)
 
+        # Відкладені перерахунки поточної транзакції мають бути застосовані до читання
+        self.env['bio.account.move.line.balance']._flush_dirty_partitions()
+
         # Викликаємо стандартний read_group для всіх інших полів
         other_fields = [f for f in fields if not any(df in f for df in dynamic_fields)]
         result = super().read_group(domain, other_fields, groupby, offset, limit, orderby, lazy)
 
-        # Для кожної групи розраховуємо динамічні поля
+        if not result:
+            return result
+
+        # Один SQL запит рахує opening/closing для всіх груп одразу
+        groupby_list = [groupby] if isinstance(groupby, str) else list(groupby or [])
+        if lazy:
+            groupby_list = groupby_list[:1]
+        requested_names = {f.split(':')[0] for f in requested_dynamic_fields}
+        with_open = 'bio_open_by_partner' in requested_names
+        balances = self.env['bio.account.move.line.balance']._cached_group_balances(
+            domain, groupby_list, lambda: self._calc_balances_by_groups(domain, groupby_list, with_open),
+            scopes=self._balance_version_scopes(domain, groupby_list, with_open))
+
         for group in result:
-            # Створюємо domain для цієї конкретної групи
-            group_domain = domain.copy() if domain else []
+            opening, closing, open_total = balances.get(self._balance_group_key(group, groupby_list), (0.0, 0.0, 0.0))
+            if 'bio_opening_by_partner' in requested_names:
+                group['bio_opening_by_partner'] = opening
+            if 'bio_closing_by_partner' in requested_names:
+                group['bio_closing_by_partner'] = closing
+            if 'bio_open_by_partner' in requested_names:
+                group['bio_open_by_partner'] = open_total
 
-            # Додаємо умови групування до domain
-            if groupby and '__domain' in group:
-                group_domain = group_domain + group['__domain']
+        return result
 
-            # Розраховуємо кожне запитане динамічне поле
-            for field_spec in requested_dynamic_fields:
-                field_name = field_spec.split(':')[0]  # Видаляємо агрегацію якщо є
+    @api.model
+    def _balance_version_scopes(self, domain, groupby_list, with_open=False):
+        """
+        Області версії книги, від яких залежить результат pivot (ключ кешу):
+        ledger, open (with_open=True) і field.<поле> для полів домену і групування
+        поза BALANCE_DEPENDENT_FIELDS - їх зміну write() позначає окремо.
+        ODOO-834
+        """
+        scopes = {LEDGER_SCOPE}
+        if with_open:
+            scopes.add(OPEN_SCOPE)
+        names = [gb.split(':')[0] for gb in groupby_list]
+        names += [leaf[0].split('.')[0] for leaf in expression.normalize_domain(domain or [])
+                  if isinstance(leaf, (list, tuple)) and len(leaf) == 3 and isinstance(leaf[0], str)]
+        scopes.update(FIELD_SCOPE_PREFIX + name for name in names if name not in BALANCE_DEPENDENT_FIELDS)
+        return tuple(sorted(scopes))
 
-                if field_name == 'bio_opening_by_partner':
-                    group[field_name] = self._calc_opening_by_partner(group_domain)
-                elif field_name == 'bio_closing_by_partner':
-                    group[field_name] = self._calc_closing_by_partner(group_domain)
+    @api.model
+    def _calc_balances_by_groups(self, domain, groupby_list, with_open=False):
+        """
+        Opening і closing balance для всіх груп read_group() одним SQL запитом.
 
-        return result
+        Домен лише по даті та партиції і групування лише по company_id / account_id / partner_id
+        (без відкритого балансу, with_open=False) - через помісячні checkpoint-и
+        (_calc_balances_by_checkpoints), вартість не залежить від довжини історії.
 
-    def _calc_opening_by_partner(self, domain):
+        Інакше групи рахуються по рядках тими ж виразами, що й стандартний read_group
+        (_read_group_process_groupby), включно з гранулярністю дат (date:month тощо).
+        В межах кожної групи:
+        - opening = сума bio_initial_balance ПЕРШИХ рядків кожного account+partner
+        - closing = сума bio_end_balance ОСТАННІХ рядків кожного account+partner
+        - open = сума bio_open_balance ОСТАННІХ рядків кожного account+partner
+
+        Повертає {group_key: (opening, closing, open)}, ключ будується так само,
+        як в _balance_group_key().
+        ODOO-834
         """
-        Розрахунок opening balance для групування по partner
-        з урахуванням фільтрів (особливо по даті).
-        Оптимізований - використовує прямий SQL без search().
+        if not with_open:
+            balances = self._calc_balances_by_checkpoints(domain, groupby_list)
+            if balances is not None:
+                return balances
 
-        Логіка:
-        1. Конвертуємо Odoo domain в SQL WHERE clause
-        2. Знаходимо ПЕРШІ рядки для кожного account+partner в межах фільтру
-        3. Сумуємо їх bio_initial_balance
+        query, params, annotated = self._balances_by_groups_sql(domain, groupby_list)
+        self.env.cr.execute(query, params)
 
+        balances = {}
+        for row in self.env.cr.fetchall():
+            key = tuple(self._normalize_group_value(value, gb) for value, gb in zip(row[:-3], annotated))
+            balances[key] = tuple(row[-3:])
+        return balances
+
+    @api.model
+    def _balances_by_groups_sql(self, domain, groupby_list):
+        """
+        SQL розрахунку балансів груп по рядках (див. _calc_balances_by_groups):
+        (query, params, annotated groupby). DISTINCT ON збігається з ключем індексу
+        bio_aml_balance_partition_idx. Використовується також перевіркою планів (_check_query_plans).
         ODOO-834
         """
-        # Конвертуємо Odoo domain в SQL WHERE clause
         query_obj = self._where_calc(domain)
+        annotated = [self._read_group_process_groupby(gb, query_obj) for gb in groupby_list]
         from_clause, where_clause, where_params = query_obj.get_sql()
 
         # Якщо немає WHERE умов - значить немає фільтрів
         if not where_clause:
             where_clause = "1=1"
 
-        # SQL запит який знаходить перші рядки по кожному account+partner і сумує їх opening balance
+        group_exprs = []
+        for gb in annotated:
+            expr = gb['qualified_field']
+            if gb['type'] in ('date', 'datetime'):
+                expr = f"({expr})::date"
+            group_exprs.append(expr)
+        group_cols = [f"g{i}" for i in range(len(group_exprs))]
+
+        select_groups = "".join(f"{expr} AS {col}, " for expr, col in zip(group_exprs, group_cols))
+        cols = "".join(f"{col}, " for col in group_cols)
+        join_on = " AND ".join(f"o.{col} IS NOT DISTINCT FROM c.{col}" for col in group_cols) or "TRUE"
+        result_cols = "".join(f"o.{col}, " for col in group_cols)
+        group_by = f"GROUP BY {', '.join(group_cols)}" if group_cols else ""
+
         query = f"""
             WITH filtered_lines AS (
                 SELECT
-                    account_id,
-                    partner_id,
-                    bio_initial_balance,
-                    date,
-                    id
+                    {select_groups}
+                    "{self._table}".account_id AS account_id,
+                    COALESCE("{self._table}".partner_id, 0) AS partner_key,
+                    "{self._table}".partner_id AS partner_id,
+                    "{self._table}".currency_id AS currency_id,
+                    "{self._table}".bio_initial_balance AS bio_initial_balance,
+                    "{self._table}".bio_end_balance AS bio_end_balance,
+                    "{self._table}".bio_open_balance AS bio_open_balance,
+                    "{self._table}".date AS date,
+                    "{self._table}".id AS id
                 FROM {from_clause}
-                WHERE parent_state='posted' AND ({where_clause})
+                WHERE "{self._table}".parent_state='posted' AND ({where_clause})
+            ),
+            -- Стиснені рядки (закриті роки) - баланс на вимогу, лише для вибраних рядків
+            first_lines AS (
+                SELECT DISTINCT ON ({cols}account_id, partner_key)
+                    {cols}{self._balance_column_sql('f', 'bio_initial_balance')} AS bio_initial_balance
+                FROM filtered_lines f
+                ORDER BY {cols}account_id, partner_key, date ASC, id ASC
             ),
-            first_lines_per_account AS (
-                SELECT DISTINCT ON (account_id, COALESCE(partner_id,0))
-                    bio_initial_balance
-                FROM filtered_lines
-                ORDER BY account_id, COALESCE(partner_id,0), date ASC, id ASC
+            last_lines AS (
+                SELECT DISTINCT ON ({cols}account_id, partner_key)
+                    {cols}{self._balance_column_sql('f', 'bio_end_balance')} AS bio_end_balance, bio_open_balance
+                FROM filtered_lines f
+                ORDER BY {cols}account_id, partner_key, date DESC, id DESC
+            ),
+            opening AS (
+                SELECT {cols}COALESCE(SUM(bio_initial_balance), 0) AS total
+                FROM first_lines
+                {group_by}
+            ),
+            closing AS (
+                SELECT {cols}COALESCE(SUM(bio_end_balance), 0) AS total,
+                       COALESCE(SUM(bio_open_balance), 0) AS open_total
+                FROM last_lines
+                {group_by}
             )
-            SELECT COALESCE(SUM(bio_initial_balance), 0) as total
-            FROM first_lines_per_account;
+            SELECT {result_cols}o.total, c.total, c.open_total
+            FROM opening o
+            JOIN closing c ON {join_on};
         """
+        return query, where_params, annotated
 
-        self.env.cr.execute(query, where_params)
-        result = self.env.cr.fetchone()
-        return result[0] if result else 0.0
-
-    def _calc_closing_by_partner(self, domain):
+    @api.model
+    def _calc_balances_by_checkpoints(self, domain, groupby_list):
         """
-        Розрахунок closing balance для групування по partner
-        з урахуванням фільтрів (особливо по даті).
-        Оптимізований - використовує прямий SQL без search().
-
-        Логіка:
-        1. Конвертуємо Odoo domain в SQL WHERE clause
-        2. Знаходимо ОСТАННІ рядки для кожного account+partner в межах фільтру
-        3. Сумуємо їх bio_end_balance
+        Баланси груп через checkpoint-и (bio.account.move.line.balance.checkpoint._sum_balances_by_groups),
+        якщо домен розкладається _split_checkpoint_domain(), а групування - лише поля партиції
+        (company_id / account_id / partner_id). Інакше None - рахуємо по рядках.
+        Відкритий баланс checkpoint-и не зберігають - open = 0.0.
+        ODOO-834
+        """
+        if any(gb not in CHECKPOINT_DOMAIN_FIELDS for gb in groupby_list):
+            return None
+        checkpoint_scope = self._split_checkpoint_domain(domain)
+        if checkpoint_scope is None:
+            return None
+        partition_domain, date_from, date_to = checkpoint_scope
+        balances = self.env['bio.account.move.line.balance.checkpoint']._sum_balances_by_groups(
+            partition_domain, groupby_list, date_from, date_to)
+        return {key: (opening, closing, 0.0) for key, (opening, closing) in balances.items()}
 
+    @api.model
+    def _balance_group_key(self, group, groupby_list):
+        """
+        Ключ групи read_group() для зіставлення з _calc_balances_by_groups().
         ODOO-834
         """
-        # Конвертуємо Odoo domain в SQL WHERE clause
-        query_obj = self._where_calc(domain)
-        from_clause, where_clause, where_params = query_obj.get_sql()
+        key = []
+        for gb in groupby_list:
+            field_name = gb.split(':')[0]
+            field = self._fields[field_name]
+            if field.type in ('date', 'datetime'):
+                # Для дат значення групи - підпис ("January 2024"), початок періоду в __range
+                value = (group.get('__range') or {}).get(gb)
+                value = value and value.get('from')
+            else:
+                value = group.get(gb, group.get(field_name))
+            key.append(self._normalize_group_value(value, {'type': field.type}))
+        return tuple(key)
 
-        # Якщо немає WHERE умов - значить немає фільтрів
-        if not where_clause:
-            where_clause = "1=1"
+    @api.model
+    def _normalize_group_value(self, value, gb):
+        """
+        Приводить значення групи (з SQL або з результату read_group) до спільного вигляду:
+        many2one -> id, дата -> date, порожнє -> None.
+        ODOO-834
+        """
+        if gb['type'] == 'boolean':
+            return bool(value)
+        if value is None or value is False:
+            return None
+        if gb['type'] == 'many2one' and isinstance(value, (list, tuple)):
+            return value[0]
+        if gb['type'] in ('date', 'datetime'):
+            return fields.Date.to_date(value)
+        return value
 
-        # SQL запит який знаходить останні рядки по кожному account+partner і сумує їх closing balance
-        query = f"""
-            WITH filtered_lines AS (
-                SELECT
-                    account_id,
-                    partner_id,
-                    bio_end_balance,
-                    date,
-                    id
-                FROM {from_clause}
-                WHERE parent_state='posted' AND ({where_clause})
-            ),
-            last_lines_per_account AS (
-                SELECT DISTINCT ON (account_id, COALESCE(partner_id,0))
-                    bio_end_balance
-                FROM filtered_lines
-                ORDER BY account_id, COALESCE(partner_id,0), date DESC, id DESC
-            )
-            SELECT COALESCE(SUM(bio_end_balance), 0) as total
-            FROM last_lines_per_account;
+    @api.model
+    def _split_checkpoint_domain(self, domain):
+        """
+        Розбирає домен на (partition_domain, date_from, date_to), якщо він складається
+        лише з AND-умов по даті (>=, >, <=, <, =) та по company_id / account_id / partner_id
+        (плюс умови без впливу на баланс, див. _is_checkpoint_noop_leaf).
+        Для такого домену opening/closing = баланс партиції на дату, і його можна
+        взяти з checkpoint-ів. Інакше повертає None (рахуємо по рядках).
+        ODOO-834
         """
+        date_from = date_to = None
+        partition_domain = []
+        for leaf in expression.normalize_domain(domain or []):
+            if leaf == expression.AND_OPERATOR or leaf == expression.TRUE_LEAF:
+                continue
+            if not isinstance(leaf, (list, tuple)) or len(leaf) != 3:
+                # '|', '!' та інші конструкції - не підтримуються
+                return None
+            field_path, operator, value = leaf
+            root = field_path.split('.')[0]
+            if self._is_checkpoint_noop_leaf(field_path, operator, value):
+                continue
+            if root in CHECKPOINT_DOMAIN_FIELDS:
+                partition_domain.append(tuple(leaf))
+                continue
+            if field_path != 'date' or operator not in ('>=', '>', '<=', '<', '='):
+                return None
+            try:
+                value = fields.Date.to_date(value)
+            except (TypeError, ValueError):
+                return None
+            if not value:
+                return None
+            if operator in ('>', '<'):
+                value += timedelta(days=1 if operator == '>' else -1)
+            if operator in ('>=', '>', '='):
+                date_from = max(date_from, value) if date_from else value
+            if operator in ('<=', '<', '='):
+                date_to = min(date_to, value) if date_to else value
+        return partition_domain, date_from, date_to
 
-        self.env.cr.execute(query, where_params)
-        result = self.env.cr.fetchone()
-        return result[0] if result else 0.0
+    @api.model
+    def _is_checkpoint_noop_leaf(self, field_path, operator, value):
+        """
+        Умова, яка не змінює балансів партицій: checkpoint-и і так рахують лише
+        проведені рядки, а рядки-розділи і нотатки не мають рахунку і сум.
+        Стандартний pivot Journal Items додає обидві:
+        ('display_type', 'not in', ('line_section', 'line_note')) і ('parent_state', '=', 'posted').
+        ODOO-834
+        """
+        values = set(value) if isinstance(value, (list, tuple)) else {value}
+        if field_path == 'parent_state':
+            return operator in ('=', 'in') and values == {'posted'}
+        if field_path == 'display_type':
+            return operator in ('!=', 'not in') and bool(values) and values <= NON_BALANCE_DISPLAY_TYPES
+        return False
 
     @api.model_create_multi
     def create(self, vals_list):
         """
         Hook для автоматичного оновлення балансів при створенні нових рядків.
+        Партиції лише позначаються брудними - перерахунок один раз на commit.
         Пропускає оновлення під час встановлення модуля для швидкості.
         ODOO-834
         """
         lines = super().create(vals_list)
         # Skip balance update during module installation
-        if not self.env.context.get('install_mode'):
-            lines._update_balances_incremental()
+        if not self._skip_balance_hooks():
+            lines.with_context(bio_balance_caller='create')._schedule_balance_update()
         return lines
 
     def write(self, vals):
         """
         Hook для автоматичного оновлення балансів при зміні рядків.
+        Перерахунок лише якщо змінюються поля, від яких залежить баланс
+        (BALANCE_DEPENDENT_FIELDS) - запис name, аналітики чи reconcile балансів не чіпає.
+        При зміні account_id / partner_id / date перераховується і стара партиція
+        (значення зчитуються ДО super().write()).
         Пропускає оновлення під час встановлення модуля для швидкості.
         ODOO-834
         """
-        res = super().write(vals)
         # Skip balance update during module installation
-        if not self.env.context.get('install_mode'):
-            self._update_balances_incremental()
+        if self._skip_balance_hooks():
+            return super().write(vals)
+        if not BALANCE_DEPENDENT_FIELDS.intersection(vals):
+            # Інші поля (аналітика, підписи...) змінюють склад груп pivot лише при групуванні
+            # або фільтрі по них: версія лише цих полів і лише рахунків проведених рядків;
+            # поля звірки - версія відкритого балансу (її піднімає перерахунок bio_open_balance)
+            res = super().write(vals)
+            scopes = [FIELD_SCOPE_PREFIX + name for name in vals if name not in RECONCILE_FIELDS]
+            if scopes and self.ids:
+                self.flush_recordset(['account_id', 'parent_state'])
+                self.env.cr.execute("""
+                    SELECT DISTINCT account_id FROM account_move_line
+                    WHERE id IN %s AND parent_state = 'posted' AND account_id IS NOT NULL
+                """, (tuple(self.ids),))
+                self.env['bio.account.move.line.balance']._bump_ledger_version(
+                    account_ids=[row[0] for row in self.env.cr.fetchall()], scopes=scopes)
+            return res
+
+        old_partitions = {}
+        unposted = 'parent_state' in vals
+        if unposted or PARTITION_FIELDS.intersection(vals):
+            old_partitions = self._get_balance_partitions(posted_only=True)
+
+        res = super().write(vals)
+        self.with_context(bio_balance_caller='write')._schedule_balance_update(old_partitions, unposted=unposted)
         return res
 
     def unlink(self):
         """
-        Hook для видалення балансів перед видаленням рядків.
+        Hook для перерахунку балансів при видаленні рядків.
+        Партиції та найраніші дати проведених рядків зчитуються ДО видалення,
+        після видалення хвости цих партицій перераховуються (відкладено, разом
+        з іншими змінами транзакції). Рядки bio_account_move_line_balance
+        видаляються через ondelete='cascade'.
         Пропускає під час встановлення модуля для швидкості.
         ODOO-834
         """
-        # Skip balance cleanup during module installation
-        if not self.env.context.get('install_mode'):
-            self.env['bio.account.move.line.balance'].search([('move_line_id', 'in', self.ids)]).unlink()
-        return super().unlink()
-
-    def _update_balances_incremental(self):
-        """
-        Інкрементальне оновлення балансів для рядків self та всіх наступних рядків
-        в тих же партиціях (account_id + partner_id).
+        # Skip balance update during module installation
+        if self._skip_balance_hooks():
+            return super().unlink()
 
-        Використовує SQL window function для ефективного перерахунку.
+        partitions = self._get_balance_partitions(posted_only=True)
+        res = super().unlink()
+        if partitions:
+            self.browse().with_context(bio_balance_caller='unlink')._schedule_balance_update(partitions)
+        return res
 
-        Алгоритм:
-        1. Визначаємо унікальні партиції (account_id, partner_id) та мінімальну дату в кожній
-        2. Знаходимо ВСІ рядки від min_date в кожній партиції (бо всі наступні потребують перерахунку)
-        3. Виконуємо SQL window function для перерахунку балансів
+    @api.model
+    def _skip_balance_hooks(self):
+        """
+        ORM-хуки балансів не працюють під час встановлення модуля
+        та з trigger-бекендом (баланси підтримують тригери PostgreSQL).
+        ODOO-834
+        """
+        return bool(self.env.context.get('install_mode')) \
+            or self.env['bio.account.move.line.balance']._use_trigger_backend()
 
+    def _schedule_balance_update(self, extra_partitions=None, unposted=False):
+        """
+        Інкрементальне оновлення балансів: партиції проведених рядків (з найранішою датою)
+        додаються в буфер транзакції, хвости партицій перераховуються в pre-commit hook
+        (bio.account.move.line.balance._flush_dirty_partitions) від bio_end_balance
+        останнього рядка ДО min_date, а не з нуля. Чернетки балансів не мають
+        і нічого не позначають.
+
+        extra_partitions - проведені партиції рядків до зміни (старі account/partner/date
+        до write(), рядки записів, що виходять з проведених).
+        unposted=True - частина рядків могла вийти з проведених: їх збережені баланси
+        очищуються одразу.
         ODOO-834
         """
-        if not self:
+        if not self and not extra_partitions:
+            return
+        balance_model = self.env['bio.account.move.line.balance']
+
+        # Bulk-режим: лише запам'ятовуємо id рядків, перерахунок - при виході з режиму
+        bulk = self.env.cr.precommit.data.get(BULK_MODE_KEY)
+        if bulk is not None:
+            bulk['line_ids'].update(self.ids)
+            if extra_partitions:
+                balance_model._merge_partitions(bulk['partitions'], extra_partitions)
             return
 
-        # Збираємо унікальні партиції та мінімальні дати
-        partitions = {}  # {(account_id, partner_id): min_date}
-        for line in self:
-            key = (line.account_id.id, line.partner_id.id if line.partner_id else False)
-            if key not in partitions or line.date < partitions[key]:
-                partitions[key] = line.date
-
-        # Будуємо domain для пошуку всіх рядків які потрібно оновити
-        domain_parts = []
-        for (account_id, partner_id), min_date in partitions.items():
-            domain_parts.append([
-                ('account_id', '=', account_id),
-                ('partner_id', '=', partner_id),
-                ('date', '>=', min_date),
-                ('parent_state', '=', 'posted'),
-            ])
-
-        if not domain_parts:
+        if unposted:
+            balance_model._clear_balances(self.filtered(lambda l: l.parent_state != 'posted').ids)
+        partitions = self._get_balance_partitions(posted_only=True)
+        if extra_partitions:
+            balance_model._merge_partitions(partitions, extra_partitions)
+        if not partitions:
             return
+        balance_model._enqueue_partitions(partitions)
+        # Змінились проведені рядки книги (сума, дата, партиція), навіть якщо баланси хвоста ті самі
+        balance_model._bump_ledger_version(account_ids={key[0] for key in partitions})
 
-        # Об'єднуємо всі domain через OR
-        lines_to_update = self.env['account.move.line']
-        for domain in domain_parts:
-            lines_to_update |= self.env['account.move.line'].search(domain)
+    def _schedule_open_balance_update(self):
+        """
+        Зміна звірок рядків self (account.partial.reconcile): змінюється лише
+        amount_residual, тому партиції позначаються тільки для перерахунку
+        bio_open_balance (bio.account.move.line.balance._enqueue_open_partitions).
+        ODOO-834
+        """
+        if self._skip_balance_hooks():
+            return
+        self.env['bio.account.move.line.balance']._enqueue_open_partitions(
+            self._get_balance_partitions(posted_only=True))
 
-        if not lines_to_update:
+    @contextmanager
+    def _bulk_balance_mode(self):
+        """
+        Bulk-режим для міграцій, імпорту виписок, масового створення рахунків:
+        поки режим активний, create()/write() не виконують жодної роботи з балансами,
+        а лише збирають id змінених рядків (і старі партиції при зміні account/partner/date).
+        При виході - один set-based перерахунок усіх зібраних партицій.
+
+        Використання:
+            with self.env['account.move.line']._bulk_balance_mode():
+                self.env['account.move'].create(big_vals_list)._post()
+
+        Вкладені виклики об'єднуються з зовнішнім. При винятку перерахунок не виконується
+        (транзакція відкочується разом зі змінами). Режим не повинен охоплювати cr.commit():
+        після commit-у хуки повертаються до відкладеного перерахунку.
+        ODOO-834
+        """
+        data = self.env.cr.precommit.data
+        if data.get(BULK_MODE_KEY) is not None:
+            yield
             return
 
-        # Виконуємо оновлення через SQL window function
-        query = """
-            INSERT INTO bio_account_move_line_balance (move_line_id, bio_initial_balance, bio_end_balance, company_currency_id)
-            SELECT
-                aml.id,
-                COALESCE(
-                    SUM(aml.debit - aml.credit) OVER (
-                        PARTITION BY aml.account_id, COALESCE(aml.partner_id,0)
-                        ORDER BY aml.date, aml.id
-                        ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
-                    ), 0
-                ) AS initial_balance,
-                COALESCE(
-                    SUM(aml.debit - aml.credit) OVER (
-                        PARTITION BY aml.account_id, COALESCE(aml.partner_id,0)
-                        ORDER BY aml.date, aml.id
-                        ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
-                    ), 0
-                ) AS end_balance,
-                aml.company_currency_id
-            FROM account_move_line aml
-            WHERE aml.parent_state='posted' AND aml.id IN %s
-            ON CONFLICT (move_line_id) DO UPDATE
-            SET bio_initial_balance = EXCLUDED.bio_initial_balance,
-                bio_end_balance = EXCLUDED.bio_end_balance,
-                company_currency_id = EXCLUDED.company_currency_id;
-            """
-        self.env.cr.execute(query, (tuple(lines_to_update.ids),))
-
-        # Синхронізація розрахованих балансів назад в account_move_line
+        state = data[BULK_MODE_KEY] = {'line_ids': set(), 'partitions': {}}
+        try:
+            yield
+        finally:
+            if data.get(BULK_MODE_KEY) is state:
+                del data[BULK_MODE_KEY]
+        self.browse(state['line_ids']).with_context(bio_balance_caller='bulk')._update_balances_bulk(state['partitions'])
+
+    def _update_balances_bulk(self, extra_partitions=None):
+        """
+        Перерахунок після bulk-режиму: партиції та непроведені рядки визначаються
+        SQL запитами по всіх зібраних id одразу, далі один _recompute_partitions().
+        ODOO-834
+        """
+        balance_model = self.env['bio.account.move.line.balance']
+        partitions = self._get_balance_partitions(posted_only=True)
+        if extra_partitions:
+            balance_model._merge_partitions(partitions, extra_partitions)
+        if self.ids:
+            # Лише рядки, що вийшли з проведених (мають збережені баланси)
+            self.env.cr.execute("""
+                SELECT id FROM account_move_line
+                WHERE id IN %s AND parent_state != 'posted' AND bio_end_balance IS NOT NULL
+            """, (tuple(self.ids),))
+            balance_model._clear_balances([row[0] for row in self.env.cr.fetchall()])
+        balance_model._recompute_partitions(balance_model._defer_unfilled_partitions(partitions))
+        balance_model._bump_ledger_version(account_ids={key[0] for key in partitions})
+
+    def _get_balance_partitions(self, posted_only=False):
+        """
+        Повертає партиції рядків self з мінімальною датою:
+        {(account_id, partner_key): min_date}, де partner_key = partner_id або 0.
+        posted_only=True - лише проведені рядки (напр. перед unlink(): видалення
+        непроведених рядків на баланси не впливає).
+        ODOO-834
+        """
+        if not self.ids:
+            return {}
+        self.flush_recordset(['account_id', 'partner_id', 'date', 'parent_state'])
         self.env.cr.execute("""
-            UPDATE account_move_line aml
-            SET bio_initial_balance = bal.bio_initial_balance,
-                bio_end_balance     = bal.bio_end_balance
-            FROM bio_account_move_line_balance bal
-            WHERE bal.move_line_id = aml.id
-              AND aml.id IN %s;
-        """, (tuple(lines_to_update.ids),))
-
-        # Інвалідуємо кеш щоб Odoo перечитав нові значення
-        lines_to_update.invalidate_recordset(['bio_initial_balance', 'bio_end_balance'])
+            SELECT account_id, COALESCE(partner_id, 0), MIN(date)
+            FROM account_move_line
+            WHERE id IN %s AND account_id IS NOT NULL
+              AND (NOT %s OR parent_state = 'posted')
+            GROUP BY account_id, COALESCE(partner_id, 0)
+        """, (tuple(self.ids), posted_only))
+        return {(account_id, partner_key): min_date
+                for account_id, partner_key, min_date in self.env.cr.fetchall()}
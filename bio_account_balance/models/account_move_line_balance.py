@@ -1,4 +1,27 @@
-from odoo import models, fields, api
+import datetime
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from odoo import models, fields, api, SUPERUSER_ID
+from odoo.service.model import PG_CONCURRENCY_ERRORS_TO_RETRY
+
+from .account_move_line_balance_guard import GUARD_TABLE
+
+# Ключ буфера брудних партицій в cr.precommit.data (ODOO-834)
+DIRTY_PARTITIONS_KEY = 'bio_account_balance.dirty_partitions'
+# Хто позначив партиції брудними (для статистики), cr.precommit.data
+DIRTY_CALLERS_KEY = 'bio_account_balance.dirty_callers'
+# Поріг кількості партицій, після якого перерахунок віддається cron-у
+QUEUE_THRESHOLD_PARAM = 'bio_account_balance.queue_threshold'
+QUEUE_THRESHOLD_DEFAULT = 1000
+# Спроби транзакції заміни shadow-таблиці (deadlock / lock timeout з конкурентними записами)
+SHADOW_SWAP_ATTEMPTS = 5
+# Збережені баланси, дзеркальовані в account_move_line
+BALANCE_FIELDS = [
+    'bio_initial_balance', 'bio_end_balance', 'bio_initial_balance_currency', 'bio_end_balance_currency',
+]
 
 
 class AccountMoveLineBalance(models.Model):
@@ -29,24 +52,46 @@ class AccountMoveLineBalance(models.Model):
         readonly=True,
         store=True,
     )
+    # Running balance у валюті операції: партиція account + partner + currency_id
+    currency_id = fields.Many2one(
+        comodel_name='res.currency',
+        string='Transaction Currency',
+    )
+    bio_initial_balance_currency = fields.Monetary(
+        string='Initial Balance in Currency',
+        currency_field='currency_id',
+        readonly=True,
+    )
+    bio_end_balance_currency = fields.Monetary(
+        string='End Balance in Currency',
+        currency_field='currency_id',
+        readonly=True,
+    )
 
     _sql_constraints = [
         ('move_line_unique', 'unique(move_line_id)', 'Move line must be unique!'),
     ]
 
     @api.model
-    def update_balances_sql(self):
-        query = """
-        INSERT INTO bio_account_move_line_balance (
-            move_line_id,
-            bio_initial_balance,
-            bio_end_balance,
-            company_currency_id
-        )
+    def _window_select_sql(self):
+        """
+        SELECT повного розрахунку балансів через SQL window function.
+        Один прохід по рядках дає обидві міри: debit - credit у валюті компанії
+        (партиція account + partner) та amount_currency (партиція account + partner + currency_id).
+        Колонки: move_line_id, bio_initial_balance, bio_end_balance, company_currency_id,
+        bio_initial_balance_currency, bio_end_balance_currency, currency_id.
+        Параметри: %(company_id)s, %(account_from)s, %(account_to)s (None - без обмеження).
+        Спільний для upsert (update_balances_sql) і shadow-таблиці (_rebuild_shadow).
+
+        Рядки до межі якорів компанії (res_company.bio_balance_anchor_date) не вибираються:
+        running sum стартує від якоря bio.account.move.line.balance.anchor.
+        ODOO-834
+        """
+        return """
         SELECT
             aml.id AS move_line_id,
 
-            COALESCE(
+            COALESCE(pa.balance, 0) + COALESCE(
                 SUM(aml.debit - aml.credit) OVER (
                     PARTITION BY aml.account_id, COALESCE(aml.partner_id,0)
                     ORDER BY aml.date, aml.id
@@ -54,7 +99,7 @@ class AccountMoveLineBalance(models.Model):
                 ), 0
             ) AS bio_initial_balance,
 
-            COALESCE(
+            COALESCE(pa.balance, 0) + COALESCE(
                 SUM(aml.debit - aml.credit) OVER (
                     PARTITION BY aml.account_id, COALESCE(aml.partner_id,0)
                     ORDER BY aml.date, aml.id
@@ -62,53 +107,779 @@ class AccountMoveLineBalance(models.Model):
                 ), 0
             ) AS bio_end_balance,
 
-            aml.company_currency_id
+            aml.company_currency_id,
+
+            COALESCE(ca.amount_currency, 0) + COALESCE(
+                SUM(aml.amount_currency) OVER (
+                    PARTITION BY aml.account_id, COALESCE(aml.partner_id,0), aml.currency_id
+                    ORDER BY aml.date, aml.id
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                ), 0
+            ) AS bio_initial_balance_currency,
+
+            COALESCE(ca.amount_currency, 0) + COALESCE(
+                SUM(aml.amount_currency) OVER (
+                    PARTITION BY aml.account_id, COALESCE(aml.partner_id,0), aml.currency_id
+                    ORDER BY aml.date, aml.id
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+                ), 0
+            ) AS bio_end_balance_currency,
+
+            aml.currency_id
         FROM account_move_line aml
+        JOIN res_company rc ON rc.id = aml.company_id
+        LEFT JOIN (
+            SELECT account_id, COALESCE(partner_id, 0) AS partner_key, SUM(balance) AS balance
+            FROM bio_account_move_line_balance_anchor
+            WHERE (%(company_id)s::int IS NULL OR company_id = %(company_id)s)
+            GROUP BY account_id, COALESCE(partner_id, 0)
+        ) pa ON pa.account_id = aml.account_id AND pa.partner_key = COALESCE(aml.partner_id, 0)
+        LEFT JOIN bio_account_move_line_balance_anchor ca
+          ON ca.account_id = aml.account_id
+         AND COALESCE(ca.partner_id, 0) = COALESCE(aml.partner_id, 0)
+         AND ca.currency_id = aml.currency_id
         WHERE aml.parent_state = 'posted'
+          AND (rc.bio_balance_anchor_date IS NULL OR aml.date > rc.bio_balance_anchor_date)
+          AND (%(company_id)s::int IS NULL OR aml.company_id = %(company_id)s)
+          AND (%(account_from)s::int IS NULL OR aml.account_id >= %(account_from)s)
+          AND (%(account_to)s::int IS NULL OR aml.account_id <= %(account_to)s)
+        """
+
+    @api.model
+    def _frozen_select_sql(self):
+        """
+        SELECT збережених балансів рядків до межі якорів (заблокована історія)
+        з тими ж колонками, що й _window_select_sql: shadow-таблиця копіює їх як є.
+        ODOO-834
+        """
+        return """
+        SELECT
+            bal.move_line_id,
+            bal.bio_initial_balance,
+            bal.bio_end_balance,
+            bal.company_currency_id,
+            bal.bio_initial_balance_currency,
+            bal.bio_end_balance_currency,
+            bal.currency_id
+        FROM bio_account_move_line_balance bal
+        JOIN account_move_line aml ON aml.id = bal.move_line_id
+        JOIN res_company rc ON rc.id = aml.company_id
+        WHERE aml.parent_state = 'posted'
+          AND aml.date <= rc.bio_balance_anchor_date
+        """
+
+    @api.model
+    def update_balances_sql(self, company_id=None, account_from=None, account_to=None):
+        """
+        Розрахунок балансів через SQL window function.
+        Без параметрів - по всіх проведених рядках, з параметрами - лише по компанії
+        та діапазону рахунків (chunk повної перебудови, див. bio.account.move.line.balance.rebuild).
+        Партиції (account_id + partner_id) не перетинають межі діапазону рахунків.
+        Заблокована історія (до res_company.bio_balance_anchor_date) не переписується.
+        ODOO-834
+        """
+        query = f"""
+        INSERT INTO bio_account_move_line_balance (
+            move_line_id,
+            bio_initial_balance,
+            bio_end_balance,
+            company_currency_id,
+            bio_initial_balance_currency,
+            bio_end_balance_currency,
+            currency_id
+        )
+        {self._window_select_sql()}
         ON CONFLICT (move_line_id) DO UPDATE
         SET
             bio_initial_balance = EXCLUDED.bio_initial_balance,
             bio_end_balance = EXCLUDED.bio_end_balance,
-            company_currency_id = EXCLUDED.company_currency_id;
+            company_currency_id = EXCLUDED.company_currency_id,
+            bio_initial_balance_currency = EXCLUDED.bio_initial_balance_currency,
+            bio_end_balance_currency = EXCLUDED.bio_end_balance_currency,
+            currency_id = EXCLUDED.currency_id;
         """
-        self.env.cr.execute(query)
+        self.env.cr.execute(query, {
+            'company_id': company_id,
+            'account_from': account_from,
+            'account_to': account_to,
+        })
 
     @api.model
-    def reset_and_update_balances(self):
+    def _rebuild_chunk(self, company_id, account_from, account_to):
         """
-        Повне перерахування балансів для всіх проводок.
-        1. Очищує таблицю bio_account_move_line_balance
-        2. Розраховує баланси через SQL window function
-        3. Синхронізує дані в основну таблицю account_move_line
+        Повна перебудова балансів одного chunk-а (компанія + діапазон рахунків):
+        1. Видаляє баланси рядків chunk-а, які більше не проведені
+        2. Розраховує баланси через SQL window function (upsert, без TRUNCATE)
+        3. Синхронізує в account_move_line лише рядки, значення яких змінились
+        4. Перебудовує помісячні checkpoint-и діапазону
+        Кроки 2-4 - лише після межі якорів компанії (bio_balance_anchor_date).
+        Спершу - ексклюзивні lock-и рахунків діапазону (_lock_accounts): перерахунки
+        партицій цих рахунків чекають завершення chunk-а.
+        Повертає кількість змінених рядків account_move_line.
         ODOO-834
         """
-        import logging
-        _logger = logging.getLogger(__name__)
+        started = time.perf_counter()
+        self._lock_accounts(company_id, account_from, account_to)
+        self.env.cr.execute("SELECT bio_balance_anchor_date FROM res_company WHERE id = %s", (company_id,))
+        boundary = self.env.cr.fetchone()[0]
+        params = {'company_id': company_id, 'account_from': account_from, 'account_to': account_to,
+                  'boundary': boundary}
+        self.env.cr.execute("""
+            DELETE FROM bio_account_move_line_balance bal
+            USING account_move_line aml
+            WHERE bal.move_line_id = aml.id
+              AND aml.company_id = %(company_id)s
+              AND aml.account_id BETWEEN %(account_from)s AND %(account_to)s
+              AND aml.parent_state != 'posted';
+        """, params)
+        self.update_balances_sql(company_id, account_from, account_to)
+        with self._without_balance_triggers():
+            self.env.cr.execute("""
+                UPDATE account_move_line aml
+                SET bio_initial_balance          = bal.bio_initial_balance,
+                    bio_end_balance              = bal.bio_end_balance,
+                    bio_initial_balance_currency = bal.bio_initial_balance_currency,
+                    bio_end_balance_currency     = bal.bio_end_balance_currency
+                FROM bio_account_move_line_balance bal
+                WHERE bal.move_line_id = aml.id
+                  AND aml.company_id = %(company_id)s
+                  AND aml.account_id BETWEEN %(account_from)s AND %(account_to)s
+                  AND (%(boundary)s::date IS NULL OR aml.date > %(boundary)s)
+                  AND (aml.bio_initial_balance, aml.bio_end_balance,
+                       aml.bio_initial_balance_currency, aml.bio_end_balance_currency)
+                      IS DISTINCT FROM
+                      (bal.bio_initial_balance, bal.bio_end_balance,
+                       bal.bio_initial_balance_currency, bal.bio_end_balance_currency);
+            """, params)
+            line_count = self.env.cr.rowcount
+        self.env['bio.account.move.line.balance.checkpoint']._rebuild_all(
+            company_id, account_from, account_to, date_from=boundary and boundary + datetime.timedelta(days=1))
+        self.env.invalidate_all()
+        self._bump_ledger_version(company_ids=[company_id])
+        # Весь chunk - SQL, час SQL = загальний час
+        self._record_balance_stat('rebuild_chunk', started, time.perf_counter() - started, row_count=line_count)
+        return line_count
+
+    @api.model
+    def _recompute_partitions(self, partitions):
+        """
+        Set-based перерахунок хвостів партицій одним SQL запитом.
+
+        partitions: {(account_id, partner_key): min_date}, partner_key = partner_id або 0.
+
+        Для кожної партиції:
+        1. anchor - bio_end_balance останнього проведеного рядка з date < min_date
+           (LATERAL + LIMIT 1 по індексу bio_aml_balance_partition_idx)
+        2. running sum по рядках з date >= min_date стартує від anchor;
+           для amount_currency - окремий anchor по кожній валюті рядків хвоста
+        3. upsert в bio_account_move_line_balance і синхронізація в account_move_line
+           в тому ж запиті (data-modifying CTE)
+
+        min_date не раніше дня після межі якорів компанії (res_company.bio_balance_anchor_date):
+        якщо до min_date після межі немає рядків, anchor - якір bio.account.move.line.balance.anchor.
+
+        Перед перерахунком береться transaction-scoped advisory lock на кожну партицію
+        (pg_advisory_xact_lock(account_id, partner_key)) у відсортованому порядку:
+        конкурентні транзакції по одній партиції чекають одна одну замість deadlock-ів
+        на upsert, транзакції по різних партиціях не блокуються.
+        Партиції, попередній перерахунок яких закомічено після snapshot-у транзакції,
+        тут не перераховуються - їх перераховує post-commit прохід з новим snapshot-ом
+        (_guard_partitions).
 
+        Рядки до min_date і заблокована історія не переписуються.
+        Повертає список id account.move.line, баланси яких змінились
+        (версія книги піднімається лише якщо такі є).
+        ODOO-834
+        """
+        if not partitions:
+            return []
+        started = time.perf_counter()
+
+        # Відсортовані партиції - advisory lock-и беруться в однаковому порядку всіма воркерами
+        account_ids, partner_keys, dates = [], [], []
+        for (account_id, partner_key), min_date in sorted(partitions.items(), key=lambda item: (item[0][0], item[0][1] or 0)):
+            account_ids.append(account_id)
+            partner_keys.append(partner_key or 0)
+            dates.append(min_date)
+        params = {'account_ids': account_ids, 'partner_keys': partner_keys, 'dates': dates}
+
+        self.env['account.move.line'].flush_model([
+            'account_id', 'partner_id', 'date', 'debit', 'credit',
+            'parent_state', 'company_currency_id', 'amount_currency', 'currency_id',
+        ])
+
+        sql_started = time.perf_counter()
+        # Серіалізація конкурентних перерахунків тієї ж партиції (до кінця транзакції);
+        # партиції, попередній перерахунок яких snapshot не бачить, - після commit-у (_guard_partitions).
+        # bio_balance_guard_locked - викликач тримає lock guard-таблиці (_swap_shadow)
+        if not self.env.context.get('bio_balance_guard_locked'):
+            self.env.cr.execute("SELECT " + self._lock_partitions_sql(), params)
+        partitions, params = self._guard_partitions(partitions, params)
+
+        with self._without_balance_triggers():
+            self.env.cr.execute(
+                self._recompute_partitions_sql() + "\nRETURNING aml.id, aml.account_id, COALESCE(aml.partner_id, 0);",
+                params)
+            rows = self.env.cr.fetchall()
+        line_ids = [row[0] for row in rows]
+        sql_time = time.perf_counter() - sql_started
+
+        # Інвалідуємо кеш щоб Odoo перечитав нові значення
+        self.env['account.move.line'].browse(line_ids).invalidate_recordset(BALANCE_FIELDS)
+        self.invalidate_model(BALANCE_FIELDS + ['company_currency_id', 'currency_id'])
+
+        # Помісячні checkpoint-и тих же партицій
+        sql_started = time.perf_counter()
+        self.env['bio.account.move.line.balance.checkpoint']._refresh_partitions(partitions)
+        sql_time += time.perf_counter() - sql_started
+        if line_ids:
+            self._bump_ledger_version(account_ids={row[1] for row in rows})
+
+        partition_rows = Counter((account_id, partner_key) for _id, account_id, partner_key in rows)
+        for key in partitions:
+            partition_rows.setdefault((key[0], key[1] or 0), 0)
+        self._record_balance_stat('recompute', started, sql_time, partition_rows, len(line_ids))
+        return line_ids
+
+    @api.model
+    def _lock_partitions_sql(self):
+        """
+        Вираз блокування партицій (без SELECT / PERFORM на початку - Python виконує
+        його як SELECT, PL/pgSQL функція trigger-бекенду - як PERFORM).
+        Спершу спільні lock-и рахунків (account_id, -1) - повна перебудова рахунку
+        (_lock_accounts) бере їх ексклюзивно, - потім ексклюзивні lock-и партицій.
+        Підзапит з ORDER BY ... OFFSET 0 гарантує порядок взяття lock-ів.
+        Параметри: %(account_ids)s, %(partner_keys)s.
+        ODOO-834
+        """
+        return """
+            CASE WHEN k.partner_key IS NULL
+                 THEN pg_advisory_xact_lock_shared(k.account_id, -1)
+                 ELSE pg_advisory_xact_lock(k.account_id, k.partner_key)
+            END
+            FROM (
+                SELECT account_id, partner_key
+                FROM (
+                    SELECT DISTINCT d.account_id, NULL::int AS partner_key, 0 AS phase
+                    FROM unnest(%(account_ids)s::int[]) AS d(account_id)
+                    UNION ALL
+                    SELECT d.account_id, d.partner_key, 1 AS phase
+                    FROM unnest(%(account_ids)s::int[], %(partner_keys)s::int[]) AS d(account_id, partner_key)
+                ) l
+                ORDER BY phase, account_id, partner_key
+                OFFSET 0
+            ) k
+        """
+
+    @api.model
+    def _recompute_partitions_sql(self):
+        """
+        SQL перерахунку хвостів партицій (див. _recompute_partitions).
+        Параметри: %(account_ids)s, %(partner_keys)s, %(dates)s - паралельні масиви партицій.
+        Той самий текст використовується в PL/pgSQL функції trigger-бекенду
+        (bio_aml_balance_recompute), тому без RETURNING і без інших символів '%'.
+        ODOO-834
+        """
+        return """
+            WITH dirty AS (
+                SELECT *
+                FROM unnest(%(account_ids)s::int[], %(partner_keys)s::int[], %(dates)s::date[]) AS d(account_id, partner_key, min_date)
+            ),
+            bounded AS (
+                -- Межа якорів компанії рахунку: рядки до неї не переписуються
+                SELECT d.account_id, d.partner_key, rc.bio_balance_anchor_date AS boundary,
+                       GREATEST(d.min_date, rc.bio_balance_anchor_date + 1) AS min_date
+                FROM dirty d
+                JOIN account_account acc ON acc.id = d.account_id
+                JOIN res_company rc ON rc.id = acc.company_id
+            ),
+            anchor AS (
+                SELECT b.account_id, b.partner_key, b.min_date, b.boundary,
+                       COALESCE(prev.bio_end_balance, pa.balance, 0) AS opening
+                FROM bounded b
+                LEFT JOIN LATERAL (
+                    SELECT aml.bio_end_balance
+                    FROM account_move_line aml
+                    WHERE aml.parent_state = 'posted'
+                      AND aml.account_id = b.account_id
+                      AND COALESCE(aml.partner_id, 0) = b.partner_key
+                      AND aml.date < b.min_date
+                      AND (b.boundary IS NULL OR aml.date > b.boundary)
+                    ORDER BY aml.date DESC, aml.id DESC
+                    LIMIT 1
+                ) prev ON TRUE
+                LEFT JOIN LATERAL (
+                    SELECT SUM(an.balance) AS balance
+                    FROM bio_account_move_line_balance_anchor an
+                    WHERE an.account_id = b.account_id
+                      AND COALESCE(an.partner_id, 0) = b.partner_key
+                ) pa ON TRUE
+            ),
+            tail AS (
+                SELECT
+                    aml.id,
+                    a.account_id,
+                    a.partner_key,
+                    a.min_date,
+                    a.boundary,
+                    aml.company_currency_id,
+                    aml.currency_id,
+                    aml.debit - aml.credit AS amount,
+                    aml.amount_currency,
+                    a.opening + SUM(aml.debit - aml.credit) OVER (
+                        PARTITION BY aml.account_id, COALESCE(aml.partner_id, 0)
+                        ORDER BY aml.date, aml.id
+                        ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+                    ) AS end_balance,
+                    SUM(aml.amount_currency) OVER (
+                        PARTITION BY aml.account_id, COALESCE(aml.partner_id, 0), aml.currency_id
+                        ORDER BY aml.date, aml.id
+                        ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+                    ) AS end_currency_delta
+                FROM anchor a
+                JOIN account_move_line aml
+                  ON aml.parent_state = 'posted'
+                 AND aml.account_id = a.account_id
+                 AND COALESCE(aml.partner_id, 0) = a.partner_key
+                 AND aml.date >= a.min_date
+            ),
+            currency_anchor AS (
+                SELECT c.account_id, c.partner_key, c.currency_id,
+                       COALESCE(prev.bio_end_balance_currency, an.amount_currency, 0) AS opening
+                FROM (SELECT DISTINCT account_id, partner_key, currency_id, min_date, boundary FROM tail) c
+                LEFT JOIN LATERAL (
+                    SELECT aml.bio_end_balance_currency
+                    FROM account_move_line aml
+                    WHERE aml.parent_state = 'posted'
+                      AND aml.account_id = c.account_id
+                      AND COALESCE(aml.partner_id, 0) = c.partner_key
+                      AND aml.currency_id = c.currency_id
+                      AND aml.date < c.min_date
+                      AND (c.boundary IS NULL OR aml.date > c.boundary)
+                    ORDER BY aml.date DESC, aml.id DESC
+                    LIMIT 1
+                ) prev ON TRUE
+                LEFT JOIN bio_account_move_line_balance_anchor an
+                  ON an.account_id = c.account_id
+                 AND COALESCE(an.partner_id, 0) = c.partner_key
+                 AND an.currency_id = c.currency_id
+            ),
+            upserted AS (
+                INSERT INTO bio_account_move_line_balance
+                    (move_line_id, bio_initial_balance, bio_end_balance, company_currency_id,
+                     bio_initial_balance_currency, bio_end_balance_currency, currency_id)
+                SELECT
+                    t.id, t.end_balance - t.amount, t.end_balance, t.company_currency_id,
+                    COALESCE(ca.opening, 0) + t.end_currency_delta - t.amount_currency,
+                    COALESCE(ca.opening, 0) + t.end_currency_delta,
+                    t.currency_id
+                FROM tail t
+                LEFT JOIN currency_anchor ca
+                  ON ca.account_id = t.account_id
+                 AND ca.partner_key = t.partner_key
+                 AND ca.currency_id = t.currency_id
+                ON CONFLICT (move_line_id) DO UPDATE
+                SET bio_initial_balance = EXCLUDED.bio_initial_balance,
+                    bio_end_balance = EXCLUDED.bio_end_balance,
+                    company_currency_id = EXCLUDED.company_currency_id,
+                    bio_initial_balance_currency = EXCLUDED.bio_initial_balance_currency,
+                    bio_end_balance_currency = EXCLUDED.bio_end_balance_currency,
+                    currency_id = EXCLUDED.currency_id
+                RETURNING move_line_id, bio_initial_balance, bio_end_balance,
+                          bio_initial_balance_currency, bio_end_balance_currency
+            )
+            UPDATE account_move_line aml
+            SET bio_initial_balance          = u.bio_initial_balance,
+                bio_end_balance              = u.bio_end_balance,
+                bio_initial_balance_currency = u.bio_initial_balance_currency,
+                bio_end_balance_currency     = u.bio_end_balance_currency
+            FROM upserted u
+            WHERE aml.id = u.move_line_id
+              AND (aml.bio_initial_balance, aml.bio_end_balance,
+                   aml.bio_initial_balance_currency, aml.bio_end_balance_currency)
+                  IS DISTINCT FROM
+                  (u.bio_initial_balance, u.bio_end_balance,
+                   u.bio_initial_balance_currency, u.bio_end_balance_currency)
+        """
+
+    @contextmanager
+    def _without_balance_triggers(self):
+        """
+        Вимикає тригери trigger-бекенду (bio_aml_balance_trg_*) в межах блоку:
+        Python-шляхи самі пишуть баланси в account_move_line, і ці UPDATE
+        не повинні повторно запускати перерахунок.
+        ODOO-834
+        """
+        self.env.cr.execute("SELECT set_config('bio_account_balance.skip_trigger', 'on', true);")
         try:
-            # Крок 1: Очищення таблиці балансів
-            _logger.info("Truncating bio_account_move_line_balance table...")
-            self.env.cr.execute("TRUNCATE TABLE bio_account_move_line_balance RESTART IDENTITY;")
-            self.env.invalidate_all()
-
-            # Крок 2: Розрахунок балансів через window function
-            _logger.info("Calculating balances via SQL window function...")
-            self.update_balances_sql()
-            self.env.invalidate_all()
-
-            # Крок 3: Синхронізація в основну таблицю
-            _logger.info("Synchronizing balances to account_move_line table...")
+            yield
+        finally:
+            self.env.cr.execute("SELECT set_config('bio_account_balance.skip_trigger', 'off', true);")
+
+    @api.model
+    def _merge_partitions(self, target, partitions):
+        """
+        Зливає partitions в target: одна партиція - одна найраніша дата.
+        ODOO-834
+        """
+        for key, min_date in partitions.items():
+            if key not in target or min_date < target[key]:
+                target[key] = min_date
+        return target
+
+    @api.model
+    def _enqueue_partitions(self, partitions):
+        """
+        Відкладений перерахунок: партиції накопичуються в буфері транзакції
+        (cr.precommit.data) і перераховуються один раз в pre-commit hook.
+        Багато create()/write() по одній партиції в транзакції = один перерахунок.
+        ODOO-834
+        """
+        if not partitions:
+            return
+        precommit = self.env.cr.precommit
+        if DIRTY_PARTITIONS_KEY not in precommit.data:
+            precommit.data[DIRTY_PARTITIONS_KEY] = {}
+            precommit.add(self.sudo()._flush_dirty_partitions)
+        self._merge_partitions(precommit.data[DIRTY_PARTITIONS_KEY], partitions)
+        precommit.data.setdefault(DIRTY_CALLERS_KEY, set()).add(self.env.context.get('bio_balance_caller') or 'direct')
+
+    @api.model
+    def _flush_dirty_partitions(self):
+        """
+        Перераховує накопичені в транзакції партиції.
+        Викликається в pre-commit hook, а також перед читанням балансів
+        (read_group), щоб бачити власні зміни транзакції.
+        Якщо партицій більше ніж bio_account_balance.queue_threshold -
+        вони віддаються в чергу bio.account.move.line.balance.queue (cron).
+        Партиції рахунків, які ще заповнює початкове заповнення, - теж в чергу.
+        ODOO-834
+        """
+        partitions = self.env.cr.precommit.data.pop(DIRTY_PARTITIONS_KEY, None)
+        callers = self.env.cr.precommit.data.pop(DIRTY_CALLERS_KEY, None)
+        partitions = self._defer_unfilled_partitions(partitions)
+        if not partitions:
+            return
+        threshold = int(self.env['ir.config_parameter'].sudo().get_param(
+            QUEUE_THRESHOLD_PARAM, QUEUE_THRESHOLD_DEFAULT))
+        if threshold and len(partitions) > threshold:
+            self.env['bio.account.move.line.balance.queue']._enqueue(partitions)
+        else:
+            # Статистика: всі операції транзакції, що позначили партиції (create, write, ...)
+            self.with_context(bio_balance_caller=','.join(sorted(callers or ())) or 'direct') \
+                ._recompute_partitions(partitions)
+
+    @api.model
+    def _clear_balances(self, line_ids):
+        """
+        Видаляє збережені баланси рядків, які вийшли з проведених
+        (draft/cancel), щоб у них не лишались застарілі значення.
+        ODOO-834
+        """
+        if not line_ids:
+            return
+        self.env.cr.execute("""
+            DELETE FROM bio_account_move_line_balance WHERE move_line_id IN %s;
+        """, (tuple(line_ids),))
+        with self._without_balance_triggers():
             self.env.cr.execute("""
-               UPDATE account_move_line aml
-               SET bio_initial_balance = bal.bio_initial_balance,
-                   bio_end_balance     = bal.bio_end_balance
-               FROM bio_account_move_line_balance bal
-               WHERE bal.move_line_id = aml.id;
+                UPDATE account_move_line
+                SET bio_initial_balance          = NULL,
+                    bio_end_balance              = NULL,
+                    bio_initial_balance_currency = NULL,
+                    bio_end_balance_currency     = NULL
+                WHERE id IN %s AND (bio_initial_balance IS NOT NULL OR bio_end_balance IS NOT NULL)
+                RETURNING account_id;
+            """, (tuple(line_ids),))
+            account_ids = {row[0] for row in self.env.cr.fetchall()}
+        self.env['account.move.line'].browse(line_ids).invalidate_recordset(BALANCE_FIELDS)
+        self.invalidate_model()
+        self._bump_ledger_version(account_ids=account_ids)
+
+    @api.model
+    def _rebuild_shadow(self, auto_commit=True):
+        """
+        Перебудова балансів через shadow-таблицю з атомарною заміною.
+        Живі дані не очищуються - читачі bio_initial_balance бачать старі значення
+        до моменту заміни.
+
+        1. CREATE TABLE ... AS SELECT (window function) - нова таблиця без індексів;
+           заблокована історія (до межі якорів) копіюється з живої таблиці як є
+        2. Первинний ключ, обмеження та індекси - після заповнення
+           (всі індекси живої таблиці, крім індексів обмежень, відтворюються з pg_get_indexdef)
+        3. Валідація: кількість рядків і контрольна сума проти account_move_line
+        4. Коротка транзакція: lock-и bio_account_move_line_balance_guard і живої таблиці,
+           заміна таблиць (DROP + RENAME), перейменування обмежень та індексів;
+           партиції, перераховані після snapshot-у заповнення (txid в guard невидимий
+           в ньому), перераховуються знову вже в заміненій таблиці
+        5. Синхронізація в account_move_line лише рядків зі зміненими значеннями
+           (в транзакції заміни - конкурентні перерахунки чекають її commit-у)
+        6. Перебудова помісячних checkpoint-ів
+
+        auto_commit=True - кроки 1-3 і 4-5 комітяться окремо (короткий lock на заміну);
+        транзакція заміни, що впала на deadlock / lock timeout, повторюється.
+        Повертає True якщо таблиця замінена.
+        ODOO-834
+        """
+        import logging
+        _logger = logging.getLogger(__name__)
+
+        started = time.perf_counter()
+        cr = self.env.cr
+        table = self._table
+        shadow = f"{table}_shadow"
+        sequence = f"{table}_id_seq"
+        self.env['account.move.line'].flush_model()
+
+        # Крок 1: Заповнення shadow-таблиці
+        _logger.info("Building shadow table %s...", shadow)
+        # Snapshot заповнення (REPEATABLE READ - той самий для всіх запитів транзакції)
+        cr.execute("SELECT txid_current_snapshot()::text, txid_current();")
+        fill_snapshot, fill_txid = cr.fetchone()
+        cr.execute(f"DROP TABLE IF EXISTS {shadow};")
+        cr.execute(f"""
+            CREATE TABLE {shadow} AS
+            SELECT
+                nextval('{sequence}')::int AS id,
+                w.move_line_id,
+                w.company_currency_id,
+                w.bio_initial_balance,
+                w.bio_end_balance,
+                w.currency_id,
+                w.bio_initial_balance_currency,
+                w.bio_end_balance_currency,
+                {SUPERUSER_ID}::int AS create_uid,
+                (now() AT TIME ZONE 'UTC') AS create_date,
+                {SUPERUSER_ID}::int AS write_uid,
+                (now() AT TIME ZONE 'UTC') AS write_date
+            FROM ({self._window_select_sql()} UNION ALL {self._frozen_select_sql()}) w;
+        """, {'company_id': None, 'account_from': None, 'account_to': None})
+
+        # Крок 2: Обмеження та індекси (тимчасові імена, перейменовуються при заміні)
+        _logger.info("Indexing shadow table %s...", shadow)
+        cr.execute(f"""
+            ALTER TABLE {shadow}
+                ALTER COLUMN id SET NOT NULL,
+                ALTER COLUMN id SET DEFAULT nextval('{sequence}'),
+                ALTER COLUMN move_line_id SET NOT NULL,
+                ALTER COLUMN company_currency_id SET NOT NULL,
+                ADD CONSTRAINT {shadow}_pkey PRIMARY KEY (id),
+                ADD CONSTRAINT {shadow}_move_line_unique UNIQUE (move_line_id),
+                ADD CONSTRAINT {shadow}_move_line_id_fkey FOREIGN KEY (move_line_id)
+                    REFERENCES account_move_line (id) ON DELETE CASCADE,
+                ADD CONSTRAINT {shadow}_company_currency_id_fkey FOREIGN KEY (company_currency_id)
+                    REFERENCES res_currency (id) ON DELETE RESTRICT,
+                ADD CONSTRAINT {shadow}_currency_id_fkey FOREIGN KEY (currency_id)
+                    REFERENCES res_currency (id) ON DELETE SET NULL,
+                ADD CONSTRAINT {shadow}_create_uid_fkey FOREIGN KEY (create_uid)
+                    REFERENCES res_users (id) ON DELETE SET NULL,
+                ADD CONSTRAINT {shadow}_write_uid_fkey FOREIGN KEY (write_uid)
+                    REFERENCES res_users (id) ON DELETE SET NULL;
+        """)
+        # Індекси живої таблиці (ORM index=True, індекси інших модулів), крім індексів обмежень
+        cr.execute("""
+            SELECT i.relname, pg_get_indexdef(x.indexrelid)
+            FROM pg_index x
+            JOIN pg_class i ON i.oid = x.indexrelid
+            WHERE x.indrelid = %s::regclass
+              AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)
+            ORDER BY i.relname;
+        """, (table,))
+        indexes = {}
+        for index, definition in cr.fetchall():
+            shadow_index = f"{shadow}_index_{len(indexes)}"
+            definition, found = re.subn(
+                rf"^CREATE (UNIQUE )?INDEX \S+ ON (?:ONLY )?(?:\S+\.)?{re.escape(table)} ",
+                lambda match: f"CREATE {match.group(1) or ''}INDEX {shadow_index} ON {shadow} ",
+                definition)
+            if not found:
+                _logger.warning("Index %s of %s not recreated on the shadow table: %s", index, table, definition)
+                continue
+            cr.execute(definition)
+            indexes[shadow_index] = index
+
+        # Крок 3: Валідація
+        _logger.info("Validating shadow table %s...", shadow)
+        # Стиснені рядки (закриті роки) рядків у shadow-таблиці не мають;
+        # партиції, стиснені повністю, враховуються їх якорями
+        cr.execute(f"""
+            SELECT
+                (SELECT COUNT(*) FROM {shadow}),
+                (SELECT COUNT(*)
+                 FROM account_move_line aml
+                 JOIN res_company rc ON rc.id = aml.company_id
+                 WHERE aml.parent_state = 'posted'
+                   AND (rc.bio_balance_compacted_date IS NULL OR aml.date > rc.bio_balance_compacted_date)),
+                (SELECT COALESCE(SUM(last.bio_end_balance), 0) FROM (
+                    SELECT DISTINCT ON (aml.account_id, COALESCE(aml.partner_id, 0)) s.bio_end_balance
+                    FROM {shadow} s
+                    JOIN account_move_line aml ON aml.id = s.move_line_id
+                    ORDER BY aml.account_id, COALESCE(aml.partner_id, 0), aml.date DESC, aml.id DESC
+                ) last)
+                + (SELECT COALESCE(SUM(a.balance), 0)
+                   FROM bio_account_move_line_balance_anchor a
+                   JOIN res_company rc ON rc.id = a.company_id
+                   WHERE rc.bio_balance_compacted_date IS NOT NULL
+                     AND NOT EXISTS (
+                         SELECT 1
+                         FROM account_move_line aml
+                         WHERE aml.parent_state = 'posted'
+                           AND aml.account_id = a.account_id
+                           AND COALESCE(aml.partner_id, 0) = COALESCE(a.partner_id, 0)
+                           AND aml.date > rc.bio_balance_compacted_date
+                     )),
+                (SELECT COALESCE(SUM(debit - credit), 0) FROM account_move_line WHERE parent_state = 'posted');
+        """)
+        shadow_count, posted_count, shadow_total, ledger_total = cr.fetchone()
+        if shadow_count != posted_count or shadow_total != ledger_total:
+            _logger.error("Shadow table %s is inconsistent (rows %s vs %s, total %s vs %s), keeping live table",
+                          shadow, shadow_count, posted_count, shadow_total, ledger_total)
+            cr.execute(f"DROP TABLE {shadow};")
+            return False
+        if auto_commit:
+            cr.commit()
+
+        # Кроки 4-5: Атомарна заміна і синхронізація
+        for attempt in range(1, SHADOW_SWAP_ATTEMPTS + 1):
+            try:
+                line_count = self._swap_shadow(shadow, indexes, fill_snapshot, fill_txid)
+                break
+            except Exception as e:
+                if not auto_commit or attempt == SHADOW_SWAP_ATTEMPTS \
+                        or getattr(e, 'pgcode', None) not in PG_CONCURRENCY_ERRORS_TO_RETRY:
+                    raise
+                _logger.info("Swapping %s into %s conflicts with concurrent writers, retrying: %s", shadow, table, e)
+                cr.rollback()
+                time.sleep(attempt)
+        if auto_commit:
+            cr.commit()
+
+        # Крок 6: Помісячні checkpoint-и
+        self.env['bio.account.move.line.balance.checkpoint']._rebuild_all()
+        self.env['bio.account.move.line.balance.anchor']._sync_lock_dates()
+        self.env.invalidate_all()
+        self._bump_ledger_version(company_ids=self.env['res.company'].sudo().search([]).ids)
+        self._record_balance_stat('shadow', started, time.perf_counter() - started, row_count=line_count)
+        if auto_commit:
+            cr.commit()
+        _logger.info("Shadow rebuild of %s completed successfully!", table)
+        return True
+
+    @api.model
+    def _swap_shadow(self, shadow, indexes, fill_snapshot, fill_txid):
+        """
+        Кроки 4-5 _rebuild_shadow() в одній транзакції.
+        Lock-и беруться першими запитами транзакції, тому її snapshot бачить усі
+        перерахунки, закомічені до заміни. Перерахунки, закомічені після snapshot-у
+        заповнення (fill_snapshot), повторюються в заміненій таблиці - без advisory
+        lock-ів: транзакції, що їх тримають, чекають на lock guard-таблиці.
+        indexes: {тимчасова назва індексу shadow-таблиці: назва індексу живої таблиці}.
+        Повертає кількість змінених рядків account_move_line.
+        ODOO-834
+        """
+        import logging
+        _logger = logging.getLogger(__name__)
+
+        cr = self.env.cr
+        table = self._table
+        sequence = f"{table}_id_seq"
+        _logger.info("Swapping %s into %s...", shadow, table)
+        # Той самий порядок, що в перерахунку: guard, потім таблиця балансів
+        cr.execute(f"LOCK TABLE {GUARD_TABLE} IN EXCLUSIVE MODE;")
+        cr.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE;")
+        cr.execute(f"ALTER SEQUENCE {sequence} OWNED BY {shadow}.id;")
+        cr.execute(f"DROP TABLE {table};")
+        cr.execute(f"ALTER TABLE {shadow} RENAME TO {table};")
+        for suffix in ('pkey', 'move_line_unique', 'move_line_id_fkey', 'company_currency_id_fkey',
+                       'currency_id_fkey', 'create_uid_fkey', 'write_uid_fkey'):
+            cr.execute(f"ALTER TABLE {table} RENAME CONSTRAINT {shadow}_{suffix} TO {table}_{suffix};")
+        for shadow_index, index in indexes.items():
+            cr.execute(f"ALTER INDEX {shadow_index} RENAME TO {index};")
+
+        # Партиції, змінені після snapshot-у заповнення: проведення, розпроведення, chunk-и
+        cr.execute(f"""
+            SELECT g.account_id, g.partner_key
+            FROM {GUARD_TABLE} g
+            WHERE g.txid != %s
+              AND NOT txid_visible_in_snapshot(g.txid, %s::txid_snapshot);
+        """, (fill_txid, fill_snapshot))
+        replay = {(account_id, partner_key): datetime.date.min for account_id, partner_key in cr.fetchall()}
+        if replay:
+            _logger.info("Replaying %s partitions changed while %s was filled", len(replay), shadow)
+            # Рядки, що вийшли з проведених або видалені після заповнення
+            cr.execute(f"""
+                DELETE FROM {table} bal
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM account_move_line aml
+                    WHERE aml.id = bal.move_line_id AND aml.parent_state = 'posted'
+                );
             """)
-            self.env.invalidate_all()
+            self.with_context(bio_balance_guard_locked=True, bio_balance_caller='shadow')._recompute_partitions(replay)
 
-            _logger.info("Balance reset and update completed successfully!")
-            return True
+        _logger.info("Synchronizing changed balances to account_move_line table...")
+        with self._without_balance_triggers():
+            cr.execute(f"""
+                UPDATE account_move_line aml
+                SET bio_initial_balance          = bal.bio_initial_balance,
+                    bio_end_balance              = bal.bio_end_balance,
+                    bio_initial_balance_currency = bal.bio_initial_balance_currency,
+                    bio_end_balance_currency     = bal.bio_end_balance_currency
+                FROM {table} bal
+                WHERE bal.move_line_id = aml.id
+                  AND (aml.bio_initial_balance, aml.bio_end_balance,
+                       aml.bio_initial_balance_currency, aml.bio_end_balance_currency)
+                      IS DISTINCT FROM
+                      (bal.bio_initial_balance, bal.bio_end_balance,
+                       bal.bio_initial_balance_currency, bal.bio_end_balance_currency);
+            """)
+            line_count = cr.rowcount
+            _logger.info("%s journal items changed", line_count)
+            cr.execute(f"""
+                UPDATE account_move_line aml
+                SET bio_initial_balance          = NULL,
+                    bio_end_balance              = NULL,
+                    bio_initial_balance_currency = NULL,
+                    bio_end_balance_currency     = NULL
+                WHERE aml.bio_end_balance IS NOT NULL
+                  AND NOT EXISTS (SELECT 1 FROM {table} bal WHERE bal.move_line_id = aml.id);
+            """)
+        return line_count
+
+    @api.model
+    def reset_and_update_balances_shadow(self):
+        """
+        Server action: повна перебудова через shadow-таблицю (див. _rebuild_shadow).
+        ODOO-834
+        """
+        import logging
+        _logger = logging.getLogger(__name__)
+
+        try:
+            return self._rebuild_shadow(auto_commit=not self.env.registry.in_test_mode())
+        except Exception as e:
+            _logger.error("Failed to rebuild balances via shadow table: %s", str(e), exc_info=True)
+            return False
+
+    @api.model
+    def reset_and_update_balances(self, auto_commit=False):
+        """
+        Повне перерахування балансів для всіх проводок.
+        Делегує в bio.account.move.line.balance.rebuild:
+        робота ділиться на chunk-и (компанія + діапазон рахунків).
+        Перерваний запуск продовжується з незавершених chunk-ів.
+
+        auto_commit=False (типово) - chunk-и послідовно в поточній транзакції.
+        auto_commit=True - комітить транзакцію викликача, chunk-и виконуються
+        паралельно на окремих курсорах, кожен chunk комітиться окремо
+        (server action "Reset and Update").
+        ODOO-834
+        """
+        import logging
+        _logger = logging.getLogger(__name__)
+
+        try:
+            rebuild = self.env['bio.account.move.line.balance.rebuild']._get_or_create_run()
+            return rebuild._run(auto_commit=auto_commit)
 
         except Exception as e:
             _logger.error("Failed to reset and update balances: %s", str(e), exc_info=True)
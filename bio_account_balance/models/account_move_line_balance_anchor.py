@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+import datetime
+import logging
+
+from odoo import api, fields, models
+from odoo.tools import index_exists
+
+_logger = logging.getLogger(__name__)
+
+
+class AccountMoveLineBalanceAnchor(models.Model):
+    """
+    Якорі балансів на межі фіскального lock-у (ODOO-834).
+
+    Один запис = сума проведених рядків партиції (account, partner) у валюті операції
+    currency_id з датою <= res.company.bio_balance_anchor_date:
+    balance - debit - credit, amount_currency - сума amount_currency.
+    Якір партиції у валюті компанії = сума balance по всіх її валютах.
+
+    Рядки до межі змінитись не можуть (fiscalyear_lock_date), тому перерахунок
+    (_recompute_partitions) і повна перебудова (_rebuild_chunk, _rebuild_shadow)
+    стартують від якоря і не переписують заблоковану історію.
+    Межа переноситься на fiscalyear_lock_date при зміні lock-у компанії
+    (інкрементально - лише рядки між старою і новою межею)
+    і після успішної повної перебудови (_sync_lock_dates).
+    Стиснена історія (bio_balance_compacted_date) завжди не пізніше межі.
+    """
+    _name = 'bio.account.move.line.balance.anchor'
+    _description = 'Balance anchors at the fiscal lock date'
+    _order = 'account_id, partner_id, currency_id'
+
+    company_id = fields.Many2one(
+        comodel_name='res.company',
+        string='Company',
+        required=True,
+        ondelete='cascade',
+        index=True,
+    )
+    account_id = fields.Many2one(
+        comodel_name='account.account',
+        string='Account',
+        required=True,
+        ondelete='cascade',
+    )
+    partner_id = fields.Many2one(
+        comodel_name='res.partner',
+        string='Partner',
+        ondelete='cascade',
+    )
+    currency_id = fields.Many2one(
+        comodel_name='res.currency',
+        string='Transaction Currency',
+        required=True,
+    )
+    date = fields.Date(
+        string='Lock Date',
+        required=True,
+        help="Balance of all posted lines up to and including this date.",
+    )
+    company_currency_id = fields.Many2one(
+        comodel_name='res.currency',
+        string='Currency',
+        required=True,
+    )
+    balance = fields.Monetary(
+        string='Balance',
+        currency_field='company_currency_id',
+        readonly=True,
+    )
+    amount_currency = fields.Monetary(
+        string='Balance in Currency',
+        currency_field='currency_id',
+        readonly=True,
+    )
+
+    def _auto_init(self):
+        res = super()._auto_init()
+        # Пошук якоря партиції / валюти партиції при перерахунку
+        if not index_exists(self._cr, 'bio_aml_balance_anchor_partition_uniq'):
+            self._cr.execute("""
+                CREATE UNIQUE INDEX bio_aml_balance_anchor_partition_uniq
+                ON bio_account_move_line_balance_anchor (account_id, (COALESCE(partner_id, 0)), currency_id)
+            """)
+        return res
+
+    @api.model
+    def _refresh_companies(self, companies):
+        """
+        Переносить якорі компаній на їх поточний fiscalyear_lock_date
+        (без lock-у - якорі видаляються, перерахунок стартує з початку історії).
+        Якщо межа вже була - інкрементально: до якорів додаються (lock вперед)
+        або від них віднімаються (lock назад) лише рядки між старою і новою межею.
+        Повний GROUP BY по історії - лише коли межі ще не було.
+        Рядки account_move_line лише читаються, баланси не переписуються.
+        Під час початкового заповнення не виконується.
+        ODOO-834
+        """
+        if not companies:
+            return
+        if self.env['bio.account.move.line.balance.rebuild']._initial_fill():
+            # Рядки до lock-у ще не заповнені; межу перенесе _sync_lock_dates() після заповнення
+            return
+        self.env['account.move.line'].flush_model([
+            'company_id', 'account_id', 'partner_id', 'currency_id', 'date',
+            'debit', 'credit', 'amount_currency', 'parent_state',
+        ])
+        companies.flush_recordset(['fiscalyear_lock_date'])
+        cr = self.env.cr
+        for company in companies:
+            lock_date = company.fiscalyear_lock_date
+            old_date = company.bio_balance_anchor_date
+            if old_date == lock_date:
+                continue
+            compacted = company.bio_balance_compacted_date
+            if compacted and (not lock_date or lock_date < compacted):
+                # Історія до старої межі знову може змінюватись - потрібні збережені баланси
+                self.env['bio.account.move.line.balance']._restore_compacted(company)
+            params = {'company_id': company.id, 'lock_date': lock_date, 'uid': self.env.uid}
+            anchor_count = 0
+            if lock_date and old_date:
+                params.update(
+                    date_from=min(old_date, lock_date), date_to=max(old_date, lock_date),
+                    sign=1 if lock_date > old_date else -1)
+                cr.execute("""
+                    INSERT INTO bio_account_move_line_balance_anchor AS an
+                        (company_id, account_id, partner_id, currency_id, date, company_currency_id,
+                         balance, amount_currency, create_uid, write_uid, create_date, write_date)
+                    SELECT aml.company_id, aml.account_id, aml.partner_id, aml.currency_id, %(lock_date)s,
+                           MIN(aml.company_currency_id),
+                           %(sign)s * SUM(aml.debit - aml.credit), %(sign)s * SUM(aml.amount_currency),
+                           %(uid)s, %(uid)s, now() AT TIME ZONE 'UTC', now() AT TIME ZONE 'UTC'
+                    FROM account_move_line aml
+                    WHERE aml.parent_state = 'posted'
+                      AND aml.company_id = %(company_id)s
+                      AND aml.date > %(date_from)s
+                      AND aml.date <= %(date_to)s
+                    GROUP BY aml.company_id, aml.account_id, aml.partner_id, aml.currency_id
+                    ON CONFLICT (account_id, (COALESCE(partner_id, 0)), currency_id) DO UPDATE
+                    SET balance = an.balance + EXCLUDED.balance,
+                        amount_currency = an.amount_currency + EXCLUDED.amount_currency,
+                        write_uid = EXCLUDED.write_uid,
+                        write_date = EXCLUDED.write_date
+                """, params)
+                anchor_count = cr.rowcount
+                cr.execute("""
+                    UPDATE bio_account_move_line_balance_anchor SET date = %(lock_date)s
+                    WHERE company_id = %(company_id)s
+                """, params)
+                if lock_date < old_date:
+                    # Партиції, всі рядки яких тепер після межі - якір нульовий
+                    cr.execute("""
+                        DELETE FROM bio_account_move_line_balance_anchor
+                        WHERE company_id = %(company_id)s AND balance = 0 AND amount_currency = 0
+                    """, params)
+            else:
+                cr.execute("DELETE FROM bio_account_move_line_balance_anchor WHERE company_id = %(company_id)s",
+                           params)
+                if lock_date:
+                    cr.execute("""
+                        INSERT INTO bio_account_move_line_balance_anchor
+                            (company_id, account_id, partner_id, currency_id, date, company_currency_id,
+                             balance, amount_currency, create_uid, write_uid, create_date, write_date)
+                        SELECT aml.company_id, aml.account_id, aml.partner_id, aml.currency_id, %(lock_date)s,
+                               MIN(aml.company_currency_id),
+                               SUM(aml.debit - aml.credit), SUM(aml.amount_currency),
+                               %(uid)s, %(uid)s, now() AT TIME ZONE 'UTC', now() AT TIME ZONE 'UTC'
+                        FROM account_move_line aml
+                        WHERE aml.parent_state = 'posted'
+                          AND aml.company_id = %(company_id)s
+                          AND aml.date <= %(lock_date)s
+                        GROUP BY aml.company_id, aml.account_id, aml.partner_id, aml.currency_id
+                    """, params)
+                    anchor_count = cr.rowcount
+            # Сирим SQL - без повторного виклику res.company.write()
+            cr.execute("UPDATE res_company SET bio_balance_anchor_date = %s WHERE id = %s", (lock_date, company.id))
+            _logger.info("bio_account_balance: balance anchors of company %s moved from %s to %s (%s anchors changed)",
+                         company.id, old_date or '-', lock_date or '-', anchor_count)
+        companies.invalidate_recordset(['bio_balance_anchor_date'])
+        self.invalidate_model()
+
+    @api.model
+    def _repair_partitions(self, keys):
+        """
+        Перераховує якорі і заблоковану історію (рядки до межі якорів, крім стиснених)
+        партицій з розбіжністю: _recompute_partitions() стартує від якоря і рядки
+        до межі не виправляє - без цього перевірка знаходила б ту ж розбіжність щоразу.
+        keys: [(account_id, partner_key)]. Advisory lock-и - як у перерахунку партицій.
+        Повертає кількість змінених рядків account_move_line.
+        ODOO-834
+        """
+        if not keys:
+            return 0
+        balance_model = self.env['bio.account.move.line.balance']
+        keys = sorted((account_id, partner_key or 0) for account_id, partner_key in keys)
+        params = {
+            'account_ids': [key[0] for key in keys],
+            'partner_keys': [key[1] for key in keys],
+            'uid': self.env.uid,
+        }
+        self.env['account.move.line'].flush_model([
+            'company_id', 'account_id', 'partner_id', 'currency_id', 'date',
+            'debit', 'credit', 'amount_currency', 'parent_state', 'company_currency_id',
+        ])
+        cr = self.env.cr
+        cr.execute("SELECT " + balance_model._lock_partitions_sql(), params)
+        # Застарілі для snapshot-у партиції - лише хвіст після commit-у; якорі - наступною перевіркою
+        _partitions, params = balance_model._guard_partitions(dict.fromkeys(keys, datetime.date.min), params)
+        if not params['account_ids']:
+            return 0
+
+        cr.execute("""
+            DELETE FROM bio_account_move_line_balance_anchor an
+            USING unnest(%(account_ids)s::int[], %(partner_keys)s::int[]) AS d(account_id, partner_key)
+            WHERE an.account_id = d.account_id
+              AND COALESCE(an.partner_id, 0) = d.partner_key
+        """, params)
+        cr.execute("""
+            INSERT INTO bio_account_move_line_balance_anchor
+                (company_id, account_id, partner_id, currency_id, date, company_currency_id,
+                 balance, amount_currency, create_uid, write_uid, create_date, write_date)
+            SELECT aml.company_id, aml.account_id, aml.partner_id, aml.currency_id, rc.bio_balance_anchor_date,
+                   MIN(aml.company_currency_id),
+                   SUM(aml.debit - aml.credit), SUM(aml.amount_currency),
+                   %(uid)s, %(uid)s, now() AT TIME ZONE 'UTC', now() AT TIME ZONE 'UTC'
+            FROM unnest(%(account_ids)s::int[], %(partner_keys)s::int[]) AS d(account_id, partner_key)
+            JOIN account_move_line aml
+              ON aml.account_id = d.account_id
+             AND COALESCE(aml.partner_id, 0) = d.partner_key
+            JOIN res_company rc ON rc.id = aml.company_id
+            WHERE aml.parent_state = 'posted'
+              AND aml.date <= rc.bio_balance_anchor_date
+            GROUP BY aml.company_id, aml.account_id, aml.partner_id, aml.currency_id, rc.bio_balance_anchor_date
+        """, params)
+
+        # Баланси рядків до межі: window function з початку історії партиції,
+        # стиснені рядки входять в суми, але не зберігаються
+        cr.execute("""
+            INSERT INTO bio_account_move_line_balance
+                (move_line_id, bio_initial_balance, bio_end_balance, company_currency_id,
+                 bio_initial_balance_currency, bio_end_balance_currency, currency_id)
+            SELECT w.id, w.initial_balance, w.end_balance, w.company_currency_id,
+                   w.initial_balance_currency, w.end_balance_currency, w.currency_id
+            FROM (
+                SELECT
+                    aml.id,
+                    aml.date,
+                    rc.bio_balance_compacted_date AS compacted_date,
+                    COALESCE(SUM(aml.debit - aml.credit) OVER w_before, 0) AS initial_balance,
+                    SUM(aml.debit - aml.credit) OVER w_upto AS end_balance,
+                    aml.company_currency_id,
+                    COALESCE(SUM(aml.amount_currency) OVER wc_before, 0) AS initial_balance_currency,
+                    SUM(aml.amount_currency) OVER wc_upto AS end_balance_currency,
+                    aml.currency_id
+                FROM unnest(%(account_ids)s::int[], %(partner_keys)s::int[]) AS d(account_id, partner_key)
+                JOIN account_move_line aml
+                  ON aml.account_id = d.account_id
+                 AND COALESCE(aml.partner_id, 0) = d.partner_key
+                JOIN res_company rc ON rc.id = aml.company_id
+                WHERE aml.parent_state = 'posted'
+                  AND aml.date <= rc.bio_balance_anchor_date
+                WINDOW w AS (PARTITION BY aml.account_id, COALESCE(aml.partner_id, 0) ORDER BY aml.date, aml.id),
+                       w_before AS (w ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING),
+                       w_upto AS (w ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW),
+                       wc AS (PARTITION BY aml.account_id, COALESCE(aml.partner_id, 0), aml.currency_id
+                              ORDER BY aml.date, aml.id),
+                       wc_before AS (wc ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING),
+                       wc_upto AS (wc ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW)
+            ) w
+            WHERE w.compacted_date IS NULL OR w.date > w.compacted_date
+            ON CONFLICT (move_line_id) DO UPDATE
+            SET bio_initial_balance = EXCLUDED.bio_initial_balance,
+                bio_end_balance = EXCLUDED.bio_end_balance,
+                company_currency_id = EXCLUDED.company_currency_id,
+                bio_initial_balance_currency = EXCLUDED.bio_initial_balance_currency,
+                bio_end_balance_currency = EXCLUDED.bio_end_balance_currency,
+                currency_id = EXCLUDED.currency_id
+            WHERE (bio_account_move_line_balance.bio_initial_balance, bio_account_move_line_balance.bio_end_balance,
+                   bio_account_move_line_balance.bio_initial_balance_currency,
+                   bio_account_move_line_balance.bio_end_balance_currency)
+                  IS DISTINCT FROM
+                  (EXCLUDED.bio_initial_balance, EXCLUDED.bio_end_balance,
+                   EXCLUDED.bio_initial_balance_currency, EXCLUDED.bio_end_balance_currency)
+        """, params)
+        with balance_model._without_balance_triggers():
+            cr.execute("""
+                UPDATE account_move_line aml
+                SET bio_initial_balance          = bal.bio_initial_balance,
+                    bio_end_balance              = bal.bio_end_balance,
+                    bio_initial_balance_currency = bal.bio_initial_balance_currency,
+                    bio_end_balance_currency     = bal.bio_end_balance_currency
+                FROM unnest(%(account_ids)s::int[], %(partner_keys)s::int[]) AS d(account_id, partner_key),
+                     bio_account_move_line_balance bal,
+                     res_company rc
+                WHERE aml.account_id = d.account_id
+                  AND COALESCE(aml.partner_id, 0) = d.partner_key
+                  AND bal.move_line_id = aml.id
+                  AND rc.id = aml.company_id
+                  AND aml.date <= rc.bio_balance_anchor_date
+                  AND (aml.bio_initial_balance, aml.bio_end_balance,
+                       aml.bio_initial_balance_currency, aml.bio_end_balance_currency)
+                      IS DISTINCT FROM
+                      (bal.bio_initial_balance, bal.bio_end_balance,
+                       bal.bio_initial_balance_currency, bal.bio_end_balance_currency)
+            """, params)
+            line_count = cr.rowcount
+        self.invalidate_model()
+        balance_model.invalidate_model()
+        self.env['account.move.line'].invalidate_model([
+            'bio_initial_balance', 'bio_end_balance', 'bio_initial_balance_currency', 'bio_end_balance_currency',
+        ])
+        # Якорі входять в баланси pivot навіть без змінених рядків
+        balance_model._bump_ledger_version(account_ids=params['account_ids'])
+        return line_count
+
+    @api.model
+    def _sync_lock_dates(self):
+        """
+        Переносить межу якорів компаній, у яких вона відстала від fiscalyear_lock_date
+        (lock змінено до встановлення модуля або в обхід ORM).
+        ODOO-834
+        """
+        companies = self.env['res.company'].sudo().search([]).filtered(
+            lambda c: c.bio_balance_anchor_date != c.fiscalyear_lock_date)
+        self._refresh_companies(companies)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from odoo import api, fields, models
+
+
+class AccountMoveLine(models.Model):
+    """
+    Пакетний API балансів партицій на дату (ODOO-834).
+
+    Баланс партиції (account + partner) на кінець дня = найближчий помісячний checkpoint
+    (bio.account.move.line.balance.checkpoint) + сума проведених рядків між ним і датою:
+    seek по індексу checkpoint-ів і range-scan не довше місяця по bio_aml_balance_partition_idx
+    на пару (партиція, дата), всі пари - одним запитом.
+    """
+    _inherit = 'account.move.line'
+
+    @api.model
+    def get_balances_at(self, dates, keys=None, domain=None):
+        """
+        Баланси партицій на кінець дня кожної з дат.
+
+        dates - дата (date або рядок) або список дат;
+        keys - ітерація пар (account_id, partner_id), partner_id = False/None - рядки без партнера;
+        domain - домен account.move.line, партиції - ті, що мають рядки за доменом
+        (замість keys; правила доступу застосовуються як у search()).
+
+        Повертає для однієї дати {(account_id, partner_id): balance},
+        для списку дат {date: {(account_id, partner_id): balance}};
+        partner_id = False для рядків без партнера, партиції без рядків до дати - 0.0.
+        Ключі - tuple, тому метод призначений для виклику з Python (звіти, інші модулі).
+        ODOO-834
+        """
+        self.check_access_rights('read')
+        single = not isinstance(dates, (list, tuple, set))
+        as_of_dates = sorted({fields.Date.to_date(value) for value in ([dates] if single else dates)})
+        if not as_of_dates:
+            return {}
+
+        self.env['bio.account.move.line.balance']._flush_dirty_partitions()
+        self.flush_model()
+        if keys is not None:
+            keys_sql, params = self._balance_keys_sql(keys)
+        else:
+            keys_sql, params = self._balance_domain_keys_sql(domain or [])
+        if keys_sql is None:
+            return {} if single else {as_of: {} for as_of in as_of_dates}
+
+        self.env.cr.execute(self._balances_at_sql(keys_sql), params + [as_of_dates])
+
+        result = {as_of: {} for as_of in as_of_dates}
+        for account_id, partner_key, as_of, balance in self.env.cr.fetchall():
+            result[as_of][(account_id, partner_key or False)] = balance
+        return result[as_of_dates[0]] if single else result
+
+    @api.model
+    def _balances_at_sql(self, keys_sql):
+        """
+        SQL балансів пар (партиція з keys_sql, дата з масиву-параметра після параметрів keys_sql):
+        рядки (account_id, partner_key, as_of, balance).
+        Використовується також перевіркою планів (_check_query_plans).
+        ODOO-834
+        """
+        joins, balance = self.env['bio.account.move.line.balance.checkpoint']._balance_as_of_sql(
+            'k', 'd.as_of', 'bal')
+        return f"""
+            WITH keys AS ({keys_sql}),
+            dates AS (
+                SELECT unnest(%s::date[]) AS as_of
+            )
+            SELECT k.account_id, k.partner_key, d.as_of, {balance}
+            FROM keys k
+            CROSS JOIN dates d
+            {joins}
+        """
+
+    @api.model
+    def _balance_keys_sql(self, keys):
+        """
+        SELECT партицій з явного списку ключів, лише по рахунках, доступних користувачу
+        (правила доступу account.account): (query, params) або (None, None).
+        ODOO-834
+        """
+        keys = {(int(account_id), int(partner_id or 0)) for account_id, partner_id in keys}
+        allowed = set(self.env['account.account'].search([('id', 'in', list({key[0] for key in keys}))]).ids)
+        keys = sorted(key for key in keys if key[0] in allowed)
+        if not keys:
+            return None, None
+        return """
+            SELECT *
+            FROM unnest(%s::int[], %s::int[]) AS k(account_id, partner_key)
+        """, [[key[0] for key in keys], [key[1] for key in keys]]
+
+    @api.model
+    def _balance_domain_keys_sql(self, domain):
+        """
+        SELECT партицій проведених рядків за доменом (з правилами доступу): (query, params).
+        ODOO-834
+        """
+        query_obj = self._where_calc(domain)
+        self._apply_ir_rules(query_obj, 'read')
+        from_clause, where_clause, where_params = query_obj.get_sql()
+        return f"""
+            SELECT DISTINCT
+                "{self._table}".account_id AS account_id,
+                COALESCE("{self._table}".partner_id, 0) AS partner_key
+            FROM {from_clause}
+            WHERE "{self._table}".parent_state = 'posted' AND ({where_clause or '1=1'})
+        """, list(where_params)
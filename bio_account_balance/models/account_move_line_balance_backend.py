@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from odoo import api, models, _
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+# Бекенд підтримки балансів (ir.config_parameter): 'python' або 'trigger'
+BACKEND_PARAM = 'bio_account_balance.backend'
+BACKEND_PYTHON = 'python'
+BACKEND_TRIGGER = 'trigger'
+
+# Тригери на account_move_line: (назва, подія, REFERENCING, функція)
+BALANCE_TRIGGERS = [
+    ('bio_aml_balance_after_insert', 'INSERT', 'NEW TABLE AS new_rows', 'bio_aml_balance_trg_insert'),
+    ('bio_aml_balance_after_update', 'UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows', 'bio_aml_balance_trg_update'),
+    ('bio_aml_balance_after_delete', 'DELETE', 'OLD TABLE AS old_rows', 'bio_aml_balance_trg_delete'),
+]
+
+# Спільний початок тригерних функцій: вкладені виклики (UPDATE балансів з самого тригера)
+# та Python-шляхи з _without_balance_triggers() нічого не перераховують
+TRIGGER_GUARD = """
+    IF pg_trigger_depth() > 1
+       OR current_setting('bio_account_balance.skip_trigger', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+"""
+
+
+class AccountMoveLineBalance(models.Model):
+    """
+    Trigger-бекенд підтримки балансів (ODOO-834).
+
+    Замість ORM-хуків (create/write/unlink, account.move.write) баланси підтримуються
+    statement-level PL/pgSQL тригерами на account_move_line з transition tables:
+    один перерахунок на SQL statement, в тій же транзакції, включно зі змінами,
+    зробленими сирим SQL (flush обчислюваних полів, cr.execute інших модулів,
+    перерахунок parent_state).
+
+    Перерахунок виконує функція bio_aml_balance_recompute(), тіло якої генерується з
+    того ж SQL, що й Python-бекенд (_recompute_partitions_sql, _open_partitions_sql,
+    _refresh_partitions_sql). Рядки, в яких змінився лише amount_residual (звірка),
+    перераховує bio_aml_open_balance_recompute() - лише відкритий баланс.
+    Вибір бекенду: set_balance_backend('trigger' | 'python').
+    """
+    _inherit = 'bio.account.move.line.balance'
+
+    @api.model
+    def _get_balance_backend(self):
+        return self.env['ir.config_parameter'].sudo().get_param(BACKEND_PARAM, BACKEND_PYTHON)
+
+    @api.model
+    def _use_trigger_backend(self):
+        return self._get_balance_backend() == BACKEND_TRIGGER
+
+    @api.model
+    def set_balance_backend(self, backend):
+        """
+        Перемикає бекенд підтримки балансів і встановлює / видаляє тригери.
+        Відкладені перерахунки Python-бекенду виконуються до перемикання.
+        ODOO-834
+        """
+        if backend not in (BACKEND_PYTHON, BACKEND_TRIGGER):
+            raise UserError(_("Unknown balance backend: %s", backend))
+        self._flush_dirty_partitions()
+        self.env['ir.config_parameter'].sudo().set_param(BACKEND_PARAM, backend)
+        self._sync_balance_backend()
+        _logger.info("bio_account_balance: balance backend switched to '%s'", backend)
+        return True
+
+    def init(self):
+        # Оновлення модуля: тіло функцій генерується з SQL Python-бекенду - перестворюємо
+        res = super().init()
+        if self._use_trigger_backend():
+            self._install_balance_triggers()
+        return res
+
+    def _register_hook(self):
+        # Стан тригерів відповідає параметру bio_account_balance.backend
+        res = super()._register_hook()
+        self._sync_balance_backend()
+        return res
+
+    @api.model
+    def _sync_balance_backend(self):
+        installed = self._balance_triggers_installed()
+        if self._use_trigger_backend() and not installed:
+            self._install_balance_triggers()
+        elif not self._use_trigger_backend() and installed:
+            self._uninstall_balance_triggers()
+
+    @api.model
+    def _balance_triggers_installed(self):
+        self.env.cr.execute("""
+            SELECT COUNT(*) FROM pg_trigger
+            WHERE tgrelid = 'account_move_line'::regclass AND tgname IN %s
+        """, (tuple(name for name, _event, _ref, _func in BALANCE_TRIGGERS),))
+        return self.env.cr.fetchone()[0] == len(BALANCE_TRIGGERS)
+
+    @api.model
+    def _install_balance_triggers(self):
+        """
+        Створює PL/pgSQL функції та statement-level тригери на account_move_line.
+        ODOO-834
+        """
+        cr = self.env.cr
+        plpgsql_params = {'account_ids': 'p_account_ids', 'partner_keys': 'p_partner_keys', 'dates': 'p_dates'}
+        lock = ("PERFORM " + self._lock_partitions_sql()) % plpgsql_params
+        guard = self._guard_partitions_sql() % plpgsql_params
+        statements = [self._recompute_partitions_sql(), self._open_partitions_sql()]
+        statements += self.env['bio.account.move.line.balance.checkpoint']._refresh_partitions_sql()
+        body = ";\n".join(query % plpgsql_params for query in statements)
+        open_body = self._open_partitions_sql() % plpgsql_params
+        enqueue = self.env['bio.account.move.line.balance.queue']._enqueue_sql() % {
+            'account_ids': 'v_accounts', 'partner_keys': 'v_partners', 'dates': 'v_dates',
+        }
+        # Партиції рахунків, які ще заповнює початкове заповнення, - в чергу (_defer_unfilled_partitions)
+        defer = """
+            SELECT * INTO p_account_ids, p_partner_keys, p_dates
+            FROM bio_aml_balance_defer_unfilled(p_account_ids, p_partner_keys, p_dates);
+            IF p_account_ids IS NULL THEN
+                RETURN;
+            END IF;
+        """
+        # Після lock-ів: партиції, застарілі для snapshot-у транзакції, - в чергу (_guard_partitions)
+        stale = f"""
+            {lock};
+            SELECT * INTO p_account_ids, p_partner_keys, p_dates
+            FROM bio_aml_balance_defer_stale(p_account_ids, p_partner_keys, p_dates);
+            IF p_account_ids IS NULL THEN
+                RETURN;
+            END IF;
+        """
+
+        cr.execute(f"""
+            CREATE OR REPLACE FUNCTION bio_aml_balance_defer_unfilled(
+                INOUT p_account_ids int[], INOUT p_partner_keys int[], INOUT p_dates date[])
+            LANGUAGE plpgsql AS $fn$
+            DECLARE
+                v_accounts int[];
+                v_partners int[];
+                v_dates date[];
+            BEGIN
+                SELECT array_agg(d.account_id), array_agg(d.partner_key), array_agg(d.min_date)
+                INTO v_accounts, v_partners, v_dates
+                FROM unnest(p_account_ids, p_partner_keys, p_dates) AS d(account_id, partner_key, min_date)
+                WHERE {self._unfilled_accounts_sql('d')};
+                IF v_accounts IS NULL THEN
+                    RETURN;
+                END IF;
+                {enqueue};
+                SELECT array_agg(d.account_id), array_agg(d.partner_key), array_agg(d.min_date)
+                INTO p_account_ids, p_partner_keys, p_dates
+                FROM unnest(p_account_ids, p_partner_keys, p_dates) AS d(account_id, partner_key, min_date)
+                WHERE NOT {self._unfilled_accounts_sql('d')};
+            END;
+            $fn$;
+        """)
+
+        cr.execute(f"""
+            CREATE OR REPLACE FUNCTION bio_aml_balance_defer_stale(
+                INOUT p_account_ids int[], INOUT p_partner_keys int[], INOUT p_dates date[])
+            LANGUAGE plpgsql AS $fn$
+            DECLARE
+                v_stale_accounts int[];
+                v_stale_partners int[];
+                v_accounts int[];
+                v_partners int[];
+                v_dates date[];
+            BEGIN
+                SELECT array_agg(g.stale_account_id), array_agg(g.stale_partner_key)
+                INTO v_stale_accounts, v_stale_partners
+                FROM ({guard}) g;
+                IF v_stale_accounts IS NULL THEN
+                    RETURN;
+                END IF;
+                SELECT array_agg(d.account_id), array_agg(d.partner_key), array_agg(d.min_date)
+                INTO v_accounts, v_partners, v_dates
+                FROM unnest(p_account_ids, p_partner_keys, p_dates) AS d(account_id, partner_key, min_date)
+                WHERE (d.account_id, d.partner_key) IN (SELECT * FROM unnest(v_stale_accounts, v_stale_partners));
+                {enqueue};
+                SELECT array_agg(d.account_id), array_agg(d.partner_key), array_agg(d.min_date)
+                INTO p_account_ids, p_partner_keys, p_dates
+                FROM unnest(p_account_ids, p_partner_keys, p_dates) AS d(account_id, partner_key, min_date)
+                WHERE (d.account_id, d.partner_key) NOT IN (SELECT * FROM unnest(v_stale_accounts, v_stale_partners));
+            END;
+            $fn$;
+        """)
+
+        cr.execute(f"""
+            CREATE OR REPLACE FUNCTION bio_aml_balance_recompute(p_account_ids int[], p_partner_keys int[], p_dates date[])
+            RETURNS void LANGUAGE plpgsql AS $fn$
+            BEGIN
+                IF p_account_ids IS NULL OR cardinality(p_account_ids) = 0 THEN
+                    RETURN;
+                END IF;
+                {defer}
+                {stale}
+                {body};
+            END;
+            $fn$;
+        """)
+
+        cr.execute(f"""
+            CREATE OR REPLACE FUNCTION bio_aml_open_balance_recompute(p_account_ids int[], p_partner_keys int[], p_dates date[])
+            RETURNS void LANGUAGE plpgsql AS $fn$
+            BEGIN
+                IF p_account_ids IS NULL OR cardinality(p_account_ids) = 0 THEN
+                    RETURN;
+                END IF;
+                {defer}
+                {stale}
+                {open_body};
+            END;
+            $fn$;
+        """)
+
+        cr.execute(f"""
+            CREATE OR REPLACE FUNCTION bio_aml_balance_trg_insert()
+            RETURNS trigger LANGUAGE plpgsql AS $fn$
+            DECLARE
+                v_accounts int[];
+                v_partners int[];
+                v_dates date[];
+            BEGIN
+                {TRIGGER_GUARD}
+                SELECT array_agg(account_id), array_agg(partner_key), array_agg(min_date)
+                INTO v_accounts, v_partners, v_dates
+                FROM (
+                    SELECT account_id, COALESCE(partner_id, 0) AS partner_key, MIN(date) AS min_date
+                    FROM new_rows
+                    WHERE parent_state = 'posted' AND account_id IS NOT NULL
+                    GROUP BY account_id, COALESCE(partner_id, 0)
+                ) p;
+                PERFORM bio_aml_balance_recompute(v_accounts, v_partners, v_dates);
+                RETURN NULL;
+            END;
+            $fn$;
+        """)
+
+        cr.execute(f"""
+            CREATE OR REPLACE FUNCTION bio_aml_balance_trg_update()
+            RETURNS trigger LANGUAGE plpgsql AS $fn$
+            DECLARE
+                v_accounts int[];
+                v_partners int[];
+                v_dates date[];
+            BEGIN
+                {TRIGGER_GUARD}
+                -- changed: лише рядки, в яких змінилось щось, від чого залежить баланс;
+                -- cleared / nulled: рядки, що вийшли з проведених, - без збережених балансів
+                WITH changed AS (
+                    SELECT n.id,
+                           o.account_id AS old_account_id, COALESCE(o.partner_id, 0) AS old_partner_key,
+                           o.date AS old_date, COALESCE(o.parent_state = 'posted', FALSE) AS old_posted,
+                           n.account_id AS new_account_id, COALESCE(n.partner_id, 0) AS new_partner_key,
+                           n.date AS new_date, COALESCE(n.parent_state = 'posted', FALSE) AS new_posted
+                    FROM old_rows o
+                    JOIN new_rows n ON n.id = o.id
+                    WHERE (o.debit, o.credit, o.date, o.account_id, o.partner_id, o.parent_state,
+                           o.amount_currency, o.currency_id)
+                          IS DISTINCT FROM (n.debit, n.credit, n.date, n.account_id, n.partner_id, n.parent_state,
+                                            n.amount_currency, n.currency_id)
+                ),
+                cleared AS (
+                    DELETE FROM bio_account_move_line_balance bal
+                    USING changed c
+                    WHERE bal.move_line_id = c.id AND c.old_posted AND NOT c.new_posted
+                ),
+                nulled AS (
+                    UPDATE account_move_line aml
+                    SET bio_initial_balance = NULL, bio_end_balance = NULL,
+                        bio_initial_balance_currency = NULL, bio_end_balance_currency = NULL,
+                        bio_open_balance = NULL
+                    FROM changed c
+                    WHERE aml.id = c.id AND c.old_posted AND NOT c.new_posted
+                )
+                -- Стара і нова партиції змінених рядків
+                SELECT array_agg(account_id), array_agg(partner_key), array_agg(min_date)
+                INTO v_accounts, v_partners, v_dates
+                FROM (
+                    SELECT account_id, partner_key, MIN(min_date) AS min_date
+                    FROM (
+                        SELECT old_account_id AS account_id, old_partner_key AS partner_key, old_date AS min_date
+                        FROM changed
+                        WHERE old_posted AND old_account_id IS NOT NULL
+                        UNION ALL
+                        SELECT new_account_id, new_partner_key, new_date
+                        FROM changed
+                        WHERE new_posted AND new_account_id IS NOT NULL
+                    ) d
+                    GROUP BY account_id, partner_key
+                ) p;
+                PERFORM bio_aml_balance_recompute(v_accounts, v_partners, v_dates);
+
+                -- Змінився лише amount_residual (звірка): тільки відкритий баланс
+                SELECT array_agg(account_id), array_agg(partner_key), array_agg(min_date)
+                INTO v_accounts, v_partners, v_dates
+                FROM (
+                    SELECT n.account_id, COALESCE(n.partner_id, 0) AS partner_key, MIN(n.date) AS min_date
+                    FROM old_rows o
+                    JOIN new_rows n ON n.id = o.id
+                    WHERE n.parent_state = 'posted' AND n.account_id IS NOT NULL
+                      AND o.amount_residual IS DISTINCT FROM n.amount_residual
+                      AND (o.debit, o.credit, o.date, o.account_id, o.partner_id, o.parent_state,
+                           o.amount_currency, o.currency_id)
+                          IS NOT DISTINCT FROM (n.debit, n.credit, n.date, n.account_id, n.partner_id, n.parent_state,
+                                                n.amount_currency, n.currency_id)
+                    GROUP BY n.account_id, COALESCE(n.partner_id, 0)
+                ) p;
+                PERFORM bio_aml_open_balance_recompute(v_accounts, v_partners, v_dates);
+                RETURN NULL;
+            END;
+            $fn$;
+        """)
+
+        cr.execute(f"""
+            CREATE OR REPLACE FUNCTION bio_aml_balance_trg_delete()
+            RETURNS trigger LANGUAGE plpgsql AS $fn$
+            DECLARE
+                v_accounts int[];
+                v_partners int[];
+                v_dates date[];
+            BEGIN
+                {TRIGGER_GUARD}
+                SELECT array_agg(account_id), array_agg(partner_key), array_agg(min_date)
+                INTO v_accounts, v_partners, v_dates
+                FROM (
+                    SELECT account_id, COALESCE(partner_id, 0) AS partner_key, MIN(date) AS min_date
+                    FROM old_rows
+                    WHERE parent_state = 'posted' AND account_id IS NOT NULL
+                    GROUP BY account_id, COALESCE(partner_id, 0)
+                ) p;
+                PERFORM bio_aml_balance_recompute(v_accounts, v_partners, v_dates);
+                RETURN NULL;
+            END;
+            $fn$;
+        """)
+
+        for name, event, referencing, function in BALANCE_TRIGGERS:
+            cr.execute(f"DROP TRIGGER IF EXISTS {name} ON account_move_line;")
+            cr.execute(f"""
+                CREATE TRIGGER {name}
+                AFTER {event} ON account_move_line
+                REFERENCING {referencing}
+                FOR EACH STATEMENT EXECUTE FUNCTION {function}();
+            """)
+        _logger.info("bio_account_balance: balance triggers installed on account_move_line")
+
+    @api.model
+    def _uninstall_balance_triggers(self):
+        cr = self.env.cr
+        for name, _event, _referencing, function in BALANCE_TRIGGERS:
+            cr.execute(f"DROP TRIGGER IF EXISTS {name} ON account_move_line;")
+            cr.execute(f"DROP FUNCTION IF EXISTS {function}();")
+        cr.execute("DROP FUNCTION IF EXISTS bio_aml_balance_recompute(int[], int[], date[]);")
+        cr.execute("DROP FUNCTION IF EXISTS bio_aml_open_balance_recompute(int[], int[], date[]);")
+        cr.execute("DROP FUNCTION IF EXISTS bio_aml_balance_defer_unfilled(int[], int[], date[]);")
+        cr.execute("DROP FUNCTION IF EXISTS bio_aml_balance_defer_stale(int[], int[], date[]);")
+        _logger.info("bio_account_balance: balance triggers removed from account_move_line")
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from odoo import api, models, _
+from odoo.osv import expression
+from odoo.tools.lru import LRU
+
+_logger = logging.getLogger(__name__)
+
+# Розмір кешу opening/closing груп pivot (записів на процес, ir.config_parameter)
+PIVOT_CACHE_SIZE_PARAM = 'bio_account_balance.pivot_cache_size'
+PIVOT_CACHE_SIZE_DEFAULT = 256
+# Журнал версій книги: рядок (компанія, рахунок, область) на кожну транзакцію, що змінила дані.
+# Таблиця поза ORM (створюється в init(), видаляється uninstall hook-ом)
+LEDGER_VERSION_TABLE = 'bio_account_balance_version'
+# Області версії: баланси, відкритий баланс (звірки), інші поля проведених рядків ('field.<ім'я>')
+LEDGER_SCOPE = 'ledger'
+OPEN_SCOPE = 'open'
+FIELD_SCOPE_PREFIX = 'field.'
+# Ключ змін версії поточної транзакції в cr.precommit.data: {область: {'accounts': set, 'companies': set}}
+LEDGER_BUMP_KEY = 'bio_account_balance.ledger_bump'
+# Застарілі послідовності попередньої версії кешу (видаляються в init())
+LEGACY_VERSION_SEQUENCES = ('bio_account_balance_ledger_version', 'bio_account_balance_open_version')
+
+# Кеш процесу (спільний для всіх баз, база - частина ключа) та лічильники
+_pivot_cache = None
+_pivot_cache_stats = {'hits': 0, 'misses': 0, 'bypassed': 0}
+
+
+class AccountMoveLineBalance(models.Model):
+    """
+    LRU-кеш opening/closing груп read_group() (ODOO-834).
+
+    Ключ: база, користувач, компанії, нормалізований домен, групування і версії
+    рахунків домену. Версія - сума ваг рядків bio_account_balance_version
+    рахунків домену (рядок з account_id NULL - всі рахунки компанії) по областях:
+    - ledger - баланси проведених рядків (перерахунок, перебудова, якорі, стиснення);
+    - open - відкритий баланс (звірки), лише коли pivot запитує bio_open_by_partner;
+    - field.<поле> - інші поля проведених рядків, лише для полів домену і групування
+      (запис підпису не чіпає pivot, який не групує і не фільтрує по name).
+    Рядки журналу додає pre-commit hook транзакції, що змінила дані, - вони
+    транзакційні: запит бачить рівно ті версії, що й дані в його snapshot-і,
+    тому старіший snapshot не може закешувати старі дані під новою версією.
+    Рядки лише додаються (без UPDATE - немає конкуренції за рядок гарячого рахунку),
+    cron черги зливає їх (_compact_ledger_versions), сума ваг при цьому не змінюється.
+
+    Кеш не використовується, якщо поточна транзакція сама змінила дані областей
+    ключа (результат ще не закомічений) і при trigger-бекенді (перерахунок в SQL,
+    Python не знає про зміни).
+    """
+    _inherit = 'bio.account.move.line.balance'
+
+    def init(self):
+        res = super().init()
+        self.env.cr.execute(f"""
+            CREATE TABLE IF NOT EXISTS {LEDGER_VERSION_TABLE} (
+                company_id integer NOT NULL,
+                account_id integer,
+                scope varchar NOT NULL,
+                weight bigint NOT NULL DEFAULT 1
+            )
+        """)
+        self.env.cr.execute(f"""
+            CREATE INDEX IF NOT EXISTS {LEDGER_VERSION_TABLE}_scope_idx
+            ON {LEDGER_VERSION_TABLE} (company_id, scope, account_id)
+        """)
+        for sequence in LEGACY_VERSION_SEQUENCES:
+            self.env.cr.execute(f"DROP SEQUENCE IF EXISTS {sequence}")
+        return res
+
+    @api.model
+    def _bump_ledger_version(self, account_ids=None, company_ids=None, scopes=(LEDGER_SCOPE,)):
+        """
+        Позначає транзакцію як таку, що змінила дані областей scopes рахунків account_ids
+        (або всіх рахунків компаній company_ids). Рядки журналу версій додаються
+        один раз, в pre-commit hook (_flush_ledger_versions): в транзакції,
+        а не після commit-у, тому видимі разом зі зміненими даними.
+        ODOO-834
+        """
+        if not account_ids and not company_ids:
+            return
+        precommit = self.env.cr.precommit
+        if LEDGER_BUMP_KEY not in precommit.data:
+            precommit.data[LEDGER_BUMP_KEY] = {}
+            precommit.add(self.sudo()._flush_ledger_versions)
+        for scope in scopes:
+            bump = precommit.data[LEDGER_BUMP_KEY].setdefault(scope, {'accounts': set(), 'companies': set()})
+            bump['accounts'].update(account_ids or ())
+            bump['companies'].update(company_ids or ())
+
+    @api.model
+    def _flush_ledger_versions(self):
+        """
+        Pre-commit: рядки журналу версій для змін транзакції (див. _bump_ledger_version).
+        ODOO-834
+        """
+        bumps = self.env.cr.precommit.data.pop(LEDGER_BUMP_KEY, None)
+        for scope, bump in (bumps or {}).items():
+            self.env.cr.execute(f"""
+                INSERT INTO {LEDGER_VERSION_TABLE} (company_id, account_id, scope)
+                SELECT acc.company_id, acc.id, %(scope)s
+                FROM account_account acc
+                WHERE acc.id = ANY(%(account_ids)s)
+                  AND acc.company_id != ALL(%(company_ids)s)
+                UNION ALL
+                SELECT c.company_id, NULL, %(scope)s
+                FROM unnest(%(company_ids)s::int[]) AS c(company_id)
+            """, {'scope': scope, 'account_ids': list(bump['accounts']), 'company_ids': list(bump['companies'])})
+
+    @api.model
+    def _compact_ledger_versions(self):
+        """
+        Зливає рядки журналу версій кожної пари (рахунок, область) в один
+        з сумою ваг: версії, які бачать читачі, не змінюються.
+        Рядки незакомічених транзакцій невидимі і лишаються. Повертає кількість видалених рядків.
+        ODOO-834
+        """
+        self.env.cr.execute(f"""
+            WITH merged AS (
+                DELETE FROM {LEDGER_VERSION_TABLE} v
+                USING (
+                    SELECT company_id, account_id, scope
+                    FROM {LEDGER_VERSION_TABLE}
+                    GROUP BY company_id, account_id, scope
+                    HAVING COUNT(*) > 1
+                ) d
+                WHERE v.company_id = d.company_id
+                  AND v.account_id IS NOT DISTINCT FROM d.account_id
+                  AND v.scope = d.scope
+                RETURNING v.company_id, v.account_id, v.scope, v.weight
+            )
+            INSERT INTO {LEDGER_VERSION_TABLE} (company_id, account_id, scope, weight)
+            SELECT company_id, account_id, scope, SUM(weight)
+            FROM merged
+            GROUP BY company_id, account_id, scope
+        """)
+        return self.env.cr.rowcount
+
+    @api.model
+    def _ledger_version_accounts(self, domain):
+        """
+        Рахунки, якими домен обмежує рядки (AND-умови по account_id / account_id.<поле>),
+        або None - всі рахунки компаній.
+        ODOO-834
+        """
+        account_domain = []
+        for leaf in expression.normalize_domain(domain or []):
+            if leaf in (expression.NOT_OPERATOR, expression.OR_OPERATOR):
+                return None
+            if not isinstance(leaf, (list, tuple)) or len(leaf) != 3 or not isinstance(leaf[0], str):
+                continue
+            field_path, operator, value = leaf
+            if field_path.startswith('account_id.'):
+                account_domain.append((field_path[len('account_id.'):], operator, value))
+            elif field_path == 'account_id':
+                ids = [value] if isinstance(value, int) else value
+                if operator not in ('=', 'in') or not isinstance(ids, (list, tuple)) \
+                        or not all(isinstance(i, int) for i in ids):
+                    # Пошук по назві, child_of тощо - не розкладається
+                    return None
+                account_domain.append(('id', 'in', list(ids)))
+        if not account_domain:
+            return None
+        return self.env['account.account'].with_context(active_test=False).sudo().search(account_domain).ids
+
+    @api.model
+    def _get_ledger_version(self, scopes=(LEDGER_SCOPE,), account_ids=None):
+        """
+        Версії областей scopes для рахунків account_ids (None - всі рахунки)
+        компаній запиту: кортеж сум ваг в порядку scopes.
+        ODOO-834
+        """
+        self.env.cr.execute(f"""
+            SELECT s.scope, COALESCE(SUM(v.weight), 0)
+            FROM unnest(%(scopes)s::varchar[]) AS s(scope)
+            LEFT JOIN {LEDGER_VERSION_TABLE} v
+              ON v.scope = s.scope
+             AND v.company_id = ANY(%(company_ids)s)
+             AND (%(all_accounts)s OR v.account_id IS NULL OR v.account_id = ANY(%(account_ids)s))
+            GROUP BY s.scope
+        """, {
+            'scopes': list(scopes),
+            'company_ids': self.env.companies.ids,
+            'all_accounts': account_ids is None,
+            'account_ids': account_ids or [],
+        })
+        versions = dict(self.env.cr.fetchall())
+        return tuple(versions[scope] for scope in scopes)
+
+    @api.model
+    def _get_pivot_cache(self):
+        global _pivot_cache
+        if _pivot_cache is None:
+            size = int(self.env['ir.config_parameter'].sudo().get_param(
+                PIVOT_CACHE_SIZE_PARAM, PIVOT_CACHE_SIZE_DEFAULT)) or PIVOT_CACHE_SIZE_DEFAULT
+            _pivot_cache = LRU(size)
+        return _pivot_cache
+
+    @api.model
+    def _cached_group_balances(self, domain, groupby_list, compute, scopes=(LEDGER_SCOPE,)):
+        """
+        Результат compute() (opening/closing груп, див. _calc_balances_by_groups) з кешу
+        або обчислений і збережений в кеш.
+        scopes - області версії, від яких залежить результат
+        (account.move.line._balance_version_scopes).
+        ODOO-834
+        """
+        bumped = self.env.cr.precommit.data.get(LEDGER_BUMP_KEY) or {}
+        if any(scope in bumped for scope in scopes) or self._use_trigger_backend():
+            _pivot_cache_stats['bypassed'] += 1
+            return compute()
+        account_ids = self._ledger_version_accounts(domain)
+        key = (
+            self.env.cr.dbname,
+            self.env.uid,
+            tuple(self.env.companies.ids),
+            repr(expression.normalize_domain(domain or [])),
+            tuple(groupby_list),
+            tuple(scopes),
+            self._get_ledger_version(tuple(scopes), account_ids),
+        )
+        cache = self._get_pivot_cache()
+        balances = cache.get(key)
+        if balances is not None:
+            _pivot_cache_stats['hits'] += 1
+            return balances
+        _pivot_cache_stats['misses'] += 1
+        balances = compute()
+        cache[key] = balances
+        return balances
+
+    @api.model
+    def action_pivot_cache_stats(self):
+        """
+        Server action: лічильники кешу pivot поточного процесу.
+        ODOO-834
+        """
+        cache = self._get_pivot_cache()
+        stats = dict(_pivot_cache_stats, size=len(cache), version=self._get_ledger_version()[0])
+        lookups = stats['hits'] + stats['misses']
+        stats['ratio'] = 100.0 * stats['hits'] / lookups if lookups else 0.0
+        _logger.info("bio_account_balance: pivot cache %s", stats)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _("Pivot Balance Cache (this worker)"),
+                'message': _(
+                    "Hits: %(hits)s, misses: %(misses)s (hit ratio %(ratio).1f%%), bypassed: %(bypassed)s, "
+                    "entries: %(size)s, ledger version: %(version)s",
+                    **stats),
+                'type': 'info',
+                'sticky': True,
+            },
+        }
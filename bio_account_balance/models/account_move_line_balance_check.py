@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+import datetime
+import logging
+import time
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+# Параметри перевірки розбіжностей (ir.config_parameter)
+DRIFT_TIME_BUDGET_PARAM = 'bio_account_balance.drift_time_budget'
+DRIFT_TIME_BUDGET_DEFAULT = 300
+DRIFT_BATCH_SIZE_PARAM = 'bio_account_balance.drift_batch_size'
+DRIFT_BATCH_SIZE_DEFAULT = 1000
+# Позиція (account_id, partner_key), з якої продовжить наступний запуск
+DRIFT_CURSOR_PARAM = 'bio_account_balance.drift_cursor'
+
+
+class AccountMoveLineBalanceCheck(models.Model):
+    """
+    Перевірка розбіжностей балансів з точковим виправленням (ODOO-834).
+
+    Партиції (account_id + partner_id) перебираються пачками в порядку ключа (keyset),
+    для кожної порівнюється контрольна сума з проводками:
+    - кількість проведених рядків vs кількість збережених балансів
+    - сума debit - credit vs bio_end_balance останнього рядка
+    Лише партиції з розбіжністю перераховуються: якорі і заблокована історія
+    (_repair_partitions), далі хвіст інкрементальним механізмом (_recompute_partitions),
+    без повної перебудови.
+    Запуск обмежений бюджетом часу, наступний продовжує з місця зупинки.
+    """
+    _name = 'bio.account.move.line.balance.check'
+    _description = 'Balance drift check'
+    _order = 'id desc'
+
+    date_start = fields.Datetime(string='Started On', readonly=True)
+    duration = fields.Float(string='Duration (s)', readonly=True)
+    partition_count = fields.Integer(string='Partitions Checked', readonly=True)
+    drift_count = fields.Integer(string='Partitions Repaired', readonly=True)
+    completed_pass = fields.Boolean(
+        string='Full Pass Completed',
+        readonly=True,
+        help="The check reached the last partition; the next run starts from the beginning.",
+    )
+    repaired_partitions = fields.Text(string='Repaired Partitions', readonly=True)
+
+    @api.model
+    def _cron_check_balances(self):
+        """
+        Cron: перевірка розбіжностей в межах бюджету часу bio_account_balance.drift_time_budget.
+        ODOO-834
+        """
+        if self.env['bio.account.move.line.balance.rebuild']._initial_fill():
+            _logger.info("bio_account_balance: drift check skipped, initial fill in progress")
+            return False
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        time_budget = int(get_param(DRIFT_TIME_BUDGET_PARAM, DRIFT_TIME_BUDGET_DEFAULT))
+        batch_size = int(get_param(DRIFT_BATCH_SIZE_PARAM, DRIFT_BATCH_SIZE_DEFAULT)) or DRIFT_BATCH_SIZE_DEFAULT
+        return self._check_and_repair(time_budget=time_budget, batch_size=batch_size)
+
+    @api.model
+    def _check_and_repair(self, time_budget=None, batch_size=DRIFT_BATCH_SIZE_DEFAULT):
+        """
+        Перевіряє партиції пачками поки не вичерпано бюджет часу (секунди, None - без обмеження)
+        і виправляє розбіжні. Створює запис з результатом перевірки.
+        ODOO-834
+        """
+        started = time.time()
+        date_start = fields.Datetime.now()
+        config = self.env['ir.config_parameter'].sudo()
+        after_key = self._parse_cursor(config.get_param(DRIFT_CURSOR_PARAM))
+        self.env['bio.account.move.line.balance']._flush_dirty_partitions()
+
+        checked = 0
+        repaired = []
+        completed_pass = False
+        while True:
+            rows = self._find_drifted(after_key, batch_size)
+            if rows is None:
+                completed_pass = True
+                after_key = None
+                break
+            batch_keys, drifted = rows
+            checked += len(batch_keys)
+            after_key = batch_keys[-1]
+            if drifted:
+                # Спершу якорі і рядки до межі якорів - перерахунок хвоста стартує від них
+                self.env['bio.account.move.line.balance.anchor']._repair_partitions(drifted)
+                self.env['bio.account.move.line.balance'].with_context(bio_balance_caller='drift')._recompute_partitions(
+                    {key: datetime.date.min for key in drifted})
+                repaired.extend(drifted)
+            if time_budget and time.time() - started >= time_budget:
+                break
+
+        config.set_param(DRIFT_CURSOR_PARAM, after_key and '%s,%s' % after_key or '')
+        check = self.create({
+            'date_start': date_start,
+            'duration': time.time() - started,
+            'partition_count': checked,
+            'drift_count': len(repaired),
+            'completed_pass': completed_pass,
+            'repaired_partitions': '\n'.join(
+                'account %s, partner %s' % (account_id, partner_key or '-') for account_id, partner_key in repaired),
+        })
+        _logger.info("bio_account_balance: drift check %s: %s partitions checked, %s repaired%s",
+                     check.id, checked, len(repaired), ' (full pass completed)' if completed_pass else '')
+        return check
+
+    @api.model
+    def _parse_cursor(self, value):
+        if not value:
+            return None
+        try:
+            account_id, partner_key = value.split(',')
+            return int(account_id), int(partner_key)
+        except ValueError:
+            return None
+
+    @api.model
+    def _find_drifted(self, after_key, batch_size):
+        """
+        Контрольні суми наступної пачки партицій після after_key.
+        Спершу - batch_size ключів партицій після after_key (DISTINCT по індексу партицій
+        зупиняється на ліміті), потім агрегація лише рядків цих партицій.
+        Повертає (ключі пачки, ключі партицій з розбіжністю) або None, якщо партицій більше немає.
+        Стиснені рядки (закриті роки) не мають збережених балансів і не рахуються;
+        баланс останнього стисненого рядка - на вимогу (від checkpoint-ів).
+        Для рахунків дебіторів / кредиторів перевіряється і bio_open_balance останнього
+        рядка проти SUM(amount_residual) (інших рахунків - NULL проти NULL).
+        ODOO-834
+        """
+        account_after, partner_after = after_key or (0, -1)
+        last_balance = self.env['account.move.line']._balance_column_sql('last', 'bio_end_balance')
+        self.env.cr.execute(f"""
+            WITH keys AS (
+                SELECT DISTINCT aml.account_id, COALESCE(aml.partner_id, 0) AS partner_key
+                FROM account_move_line aml
+                WHERE aml.parent_state = 'posted'
+                  AND (aml.account_id, COALESCE(aml.partner_id, 0)) > (%s, %s)
+                ORDER BY aml.account_id, COALESCE(aml.partner_id, 0)
+                LIMIT %s
+            ),
+            ledger AS (
+                SELECT k.account_id, k.partner_key, s.*
+                FROM keys k
+                CROSS JOIN LATERAL (
+                    SELECT
+                        COUNT(*) FILTER (WHERE rc.bio_balance_compacted_date IS NULL
+                                            OR aml.date > rc.bio_balance_compacted_date) AS line_count,
+                        SUM(aml.debit - aml.credit) AS total,
+                        COUNT(bal.id) AS balance_count,
+                        SUM(aml.amount_residual) FILTER (
+                            WHERE acc.account_type IN ('asset_receivable', 'liability_payable')) AS open_total
+                    FROM account_move_line aml
+                    JOIN res_company rc ON rc.id = aml.company_id
+                    LEFT JOIN account_account acc ON acc.id = aml.account_id
+                    LEFT JOIN bio_account_move_line_balance bal ON bal.move_line_id = aml.id
+                    WHERE aml.parent_state = 'posted'
+                      AND aml.account_id = k.account_id
+                      AND COALESCE(aml.partner_id, 0) = k.partner_key
+                ) s
+            )
+            SELECT
+                l.account_id,
+                l.partner_key,
+                l.line_count != l.balance_count
+                    OR {last_balance} IS DISTINCT FROM l.total
+                    OR last.bio_open_balance IS DISTINCT FROM l.open_total AS drifted
+            FROM ledger l
+            LEFT JOIN LATERAL (
+                SELECT aml.account_id, aml.partner_id, aml.currency_id, aml.date, aml.id, aml.bio_end_balance,
+                       aml.bio_open_balance
+                FROM account_move_line aml
+                WHERE aml.parent_state = 'posted'
+                  AND aml.account_id = l.account_id
+                  AND COALESCE(aml.partner_id, 0) = l.partner_key
+                ORDER BY aml.date DESC, aml.id DESC
+                LIMIT 1
+            ) last ON TRUE
+            ORDER BY l.account_id, l.partner_key;
+        """, (account_after, partner_after, batch_size))
+        rows = self.env.cr.fetchall()
+        if not rows:
+            return None
+        batch_keys = [(account_id, partner_key) for account_id, partner_key, _drifted in rows]
+        drifted = [(account_id, partner_key) for account_id, partner_key, is_drifted in rows if is_drifted]
+        return batch_keys, drifted
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+import datetime
+import logging
+
+from odoo import api, fields, models
+from odoo.tools import index_exists
+
+_logger = logging.getLogger(__name__)
+
+
+class AccountMoveLineBalanceCheckpoint(models.Model):
+    """
+    Помісячні checkpoint-и балансів (ODOO-834).
+
+    Один запис = closing balance партиції (company, account, partner) на кінець місяця,
+    в якому є проведені рядки. Баланс на будь-яку дату =
+    найближчий checkpoint <= дати + сума рядків між checkpoint-ом і датою
+    (не більше одного місяця), замість сканування всієї історії партиції.
+
+    Підтримується тими ж шляхами, що й bio_end_balance:
+    _recompute_partitions() та повною перебудовою (_rebuild_chunk()).
+    """
+    _name = 'bio.account.move.line.balance.checkpoint'
+    _description = 'Monthly balance checkpoints'
+    _order = 'account_id, partner_id, date'
+
+    company_id = fields.Many2one(
+        comodel_name='res.company',
+        string='Company',
+        required=True,
+        ondelete='cascade',
+    )
+    account_id = fields.Many2one(
+        comodel_name='account.account',
+        string='Account',
+        required=True,
+        ondelete='cascade',
+    )
+    partner_id = fields.Many2one(
+        comodel_name='res.partner',
+        string='Partner',
+        ondelete='cascade',
+    )
+    date = fields.Date(
+        string='Month End',
+        required=True,
+        help="Last day of the month the checkpoint closes.",
+    )
+    company_currency_id = fields.Many2one(
+        comodel_name='res.currency',
+        string='Currency',
+        required=True,
+    )
+    balance = fields.Monetary(
+        string='Closing Balance',
+        currency_field='company_currency_id',
+        readonly=True,
+    )
+
+    def _auto_init(self):
+        res = super()._auto_init()
+        # Пошук найближчого checkpoint-а партиції: (account, partner, date DESC) LIMIT 1
+        if not index_exists(self._cr, 'bio_aml_balance_checkpoint_partition_uniq'):
+            self._cr.execute("""
+                CREATE UNIQUE INDEX bio_aml_balance_checkpoint_partition_uniq
+                ON bio_account_move_line_balance_checkpoint (account_id, (COALESCE(partner_id, 0)), date)
+            """)
+        return res
+
+    @api.model
+    def _refresh_partitions(self, partitions):
+        """
+        Перебудовує checkpoint-и партицій починаючи з місяця min_date.
+        Викликається після перерахунку bio_end_balance в _recompute_partitions().
+        partitions: {(account_id, partner_key): min_date}
+        ODOO-834
+        """
+        if not partitions:
+            return
+        account_ids, partner_keys, dates = [], [], []
+        for (account_id, partner_key), min_date in partitions.items():
+            account_ids.append(account_id)
+            partner_keys.append(partner_key or 0)
+            dates.append(min_date)
+        params = {'account_ids': account_ids, 'partner_keys': partner_keys, 'dates': dates}
+        for query in self._refresh_partitions_sql():
+            self.env.cr.execute(query, params)
+        self.invalidate_model()
+
+    @api.model
+    def _refresh_partitions_sql(self):
+        """
+        SQL оновлення checkpoint-ів партицій (див. _refresh_partitions).
+        Параметри: %(account_ids)s, %(partner_keys)s, %(dates)s.
+        Використовується також у PL/pgSQL функції trigger-бекенду.
+        min_date не раніше дня після межі якорів компанії: checkpoint-и заблокованої
+        (і стисненої) історії не перебудовуються.
+        ODOO-834
+        """
+        bounded = """(
+                SELECT d.account_id, d.partner_key,
+                       GREATEST(d.min_date, rc.bio_balance_anchor_date + 1) AS min_date
+                FROM unnest(%(account_ids)s::int[], %(partner_keys)s::int[], %(dates)s::date[]) AS d(account_id, partner_key, min_date)
+                JOIN account_account acc ON acc.id = d.account_id
+                JOIN res_company rc ON rc.id = acc.company_id
+            ) d"""
+        return [
+            f"""
+            DELETE FROM bio_account_move_line_balance_checkpoint c
+            USING {bounded}
+            WHERE c.account_id = d.account_id
+              AND COALESCE(c.partner_id, 0) = d.partner_key
+              AND c.date >= date_trunc('month', d.min_date)::date
+            """,
+            f"""
+            INSERT INTO bio_account_move_line_balance_checkpoint
+                (company_id, account_id, partner_id, date, company_currency_id, balance)
+            SELECT DISTINCT ON (aml.account_id, COALESCE(aml.partner_id, 0), date_trunc('month', aml.date))
+                aml.company_id,
+                aml.account_id,
+                aml.partner_id,
+                (date_trunc('month', aml.date) + interval '1 month - 1 day')::date,
+                aml.company_currency_id,
+                aml.bio_end_balance
+            FROM {bounded}
+            JOIN account_move_line aml
+              ON aml.parent_state = 'posted'
+             AND aml.account_id = d.account_id
+             AND COALESCE(aml.partner_id, 0) = d.partner_key
+             AND aml.date >= date_trunc('month', d.min_date)::date
+            ORDER BY aml.account_id, COALESCE(aml.partner_id, 0), date_trunc('month', aml.date),
+                     aml.date DESC, aml.id DESC
+            """,
+        ]
+
+    @api.model
+    def _rebuild_all(self, company_id=None, account_from=None, account_to=None, date_from=None):
+        """
+        Повна перебудова checkpoint-ів з bio_end_balance.
+        З параметрами - лише компанія + діапазон рахунків (chunk повної перебудови),
+        date_from - лише місяці, починаючи з місяця date_from (після межі якорів).
+        Checkpoint-и стиснених місяців (до res_company.bio_balance_compacted_date) зберігаються:
+        збережених балансів цих рядків немає, баланси на вимогу рахуються від checkpoint-ів.
+        ODOO-834
+        """
+        params = {'company_id': company_id, 'account_from': account_from, 'account_to': account_to,
+                  'date_from': date_from}
+        self.env.cr.execute("SELECT 1 FROM res_company WHERE bio_balance_compacted_date IS NOT NULL LIMIT 1")
+        compacted = bool(self.env.cr.fetchone())
+        if company_id is None and account_from is None and account_to is None and date_from is None \
+                and not compacted:
+            self.env.cr.execute("TRUNCATE TABLE bio_account_move_line_balance_checkpoint RESTART IDENTITY;")
+        else:
+            self.env.cr.execute("""
+                DELETE FROM bio_account_move_line_balance_checkpoint c
+                USING res_company rc
+                WHERE rc.id = c.company_id
+                  AND (rc.bio_balance_compacted_date IS NULL OR c.date > rc.bio_balance_compacted_date)
+                  AND (%(company_id)s::int IS NULL OR c.company_id = %(company_id)s)
+                  AND (%(account_from)s::int IS NULL OR c.account_id >= %(account_from)s)
+                  AND (%(account_to)s::int IS NULL OR c.account_id <= %(account_to)s)
+                  AND (%(date_from)s::date IS NULL OR c.date >= date_trunc('month', %(date_from)s::date)::date);
+            """, params)
+        self.env.cr.execute("""
+            INSERT INTO bio_account_move_line_balance_checkpoint
+                (company_id, account_id, partner_id, date, company_currency_id, balance)
+            SELECT DISTINCT ON (aml.account_id, COALESCE(aml.partner_id, 0), date_trunc('month', aml.date))
+                aml.company_id,
+                aml.account_id,
+                aml.partner_id,
+                (date_trunc('month', aml.date) + interval '1 month - 1 day')::date,
+                aml.company_currency_id,
+                aml.bio_end_balance
+            FROM account_move_line aml
+            JOIN res_company rc ON rc.id = aml.company_id
+            WHERE aml.parent_state = 'posted'
+              AND (rc.bio_balance_compacted_date IS NULL OR aml.date > rc.bio_balance_compacted_date)
+              AND (%(company_id)s::int IS NULL OR aml.company_id = %(company_id)s)
+              AND (%(account_from)s::int IS NULL OR aml.account_id >= %(account_from)s)
+              AND (%(account_to)s::int IS NULL OR aml.account_id <= %(account_to)s)
+              AND (%(date_from)s::date IS NULL OR aml.date >= date_trunc('month', %(date_from)s::date)::date)
+            ORDER BY aml.account_id, COALESCE(aml.partner_id, 0), date_trunc('month', aml.date),
+                     aml.date DESC, aml.id DESC;
+        """, params)
+        self.invalidate_model()
+
+    @api.model
+    def _balance_as_of_sql(self, keys_alias, as_of_sql, name):
+        """
+        Баланс партиції на кінець дня: найближчий checkpoint <= дати + сума проведених
+        рядків між checkpoint-ом і датою (не більше місяця; без checkpoint-ів - вся історія,
+        тому результат правильний і до заповнення checkpoint-ів).
+        keys_alias - псевдонім джерела з колонками account_id, partner_key;
+        as_of_sql - SQL вираз дати; name - префікс псевдонімів LATERAL-ів.
+        Повертає (joins, value_expr) для вставки в FROM / SELECT викликача.
+        ODOO-834
+        """
+        joins = f"""
+            LEFT JOIN LATERAL (
+                SELECT c.date, c.balance
+                FROM bio_account_move_line_balance_checkpoint c
+                WHERE c.account_id = {keys_alias}.account_id
+                  AND COALESCE(c.partner_id, 0) = {keys_alias}.partner_key
+                  AND c.date <= {as_of_sql}
+                ORDER BY c.date DESC
+                LIMIT 1
+            ) {name}_cp ON TRUE
+            LEFT JOIN LATERAL (
+                SELECT SUM(aml.debit - aml.credit) AS amount
+                FROM account_move_line aml
+                WHERE aml.parent_state = 'posted'
+                  AND aml.account_id = {keys_alias}.account_id
+                  AND COALESCE(aml.partner_id, 0) = {keys_alias}.partner_key
+                  AND ({name}_cp.date IS NULL OR aml.date > {name}_cp.date)
+                  AND aml.date <= {as_of_sql}
+            ) {name}_rng ON TRUE
+        """
+        return joins, f"(COALESCE({name}_cp.balance, 0) + COALESCE({name}_rng.amount, 0))"
+
+    @api.model
+    def _sum_balances_by_groups(self, partition_domain, group_fields, date_from=None, date_to=None):
+        """
+        Opening / closing партицій, які мають проведені рядки в [date_from, date_to]
+        і відповідають partition_domain (домен по company_id / account_id / partner_id),
+        просумовані по групах group_fields (підмножина company_id, account_id, partner_id).
+
+        closing - баланс на кінець date_to;
+        opening - баланс на кінець дня перед date_from, без date_from -
+        closing мінус сума рядків партиції до date_to (не 0: історія до якорів
+        і стиснені роки входять в checkpoint-и).
+
+        Еквівалентно DISTINCT ON по першому/останньому рядку партиції
+        в account.move.line._balances_by_groups_sql(), але не залежить
+        від довжини історії: checkpoint + range-sum не довше місяця.
+        Повертає {group_key: (opening, closing)}, group_key - tuple id (None - без партнера).
+        ODOO-834
+        """
+        query_obj = self._where_calc(partition_domain)
+        from_clause, where_clause, where_params = query_obj.get_sql()
+        if not where_clause:
+            where_clause = "1=1"
+
+        closing_joins, closing = self._balance_as_of_sql('s', '%s::date', 'closing')
+        if date_from:
+            opening_joins, opening = self._balance_as_of_sql('s', '%s::date', 'opening')
+            opening_params = [date_from - datetime.timedelta(days=1)] * 2
+        else:
+            opening_joins = """
+                LEFT JOIN LATERAL (
+                    SELECT SUM(aml.debit - aml.credit) AS amount
+                    FROM account_move_line aml
+                    WHERE aml.parent_state = 'posted'
+                      AND aml.account_id = s.account_id
+                      AND COALESCE(aml.partner_id, 0) = s.partner_key
+                      AND aml.date <= %s::date
+                ) period ON TRUE
+            """
+            opening = f"({closing} - COALESCE(period.amount, 0))"
+            opening_params = [date_to or datetime.date.max]
+        group_cols = {
+            'company_id': 's.company_id',
+            'account_id': 's.account_id',
+            'partner_id': 'NULLIF(s.partner_key, 0)',
+        }
+        select_groups = "".join(f"{group_cols[field]}, " for field in group_fields)
+        group_by = "GROUP BY %s" % ", ".join(str(i + 1) for i in range(len(group_fields))) if group_fields else ""
+
+        # Кандидати - партиції з checkpoint-ами в місяцях періоду (надмножина),
+        # точна перевірка наявності рядків - EXISTS по індексу bio_aml_balance_partition_idx
+        month_from = date_from and date_from.replace(day=1)
+        query = f"""
+            WITH scope AS (
+                SELECT DISTINCT
+                    "{self._table}".company_id AS company_id,
+                    "{self._table}".account_id AS account_id,
+                    COALESCE("{self._table}".partner_id, 0) AS partner_key
+                FROM {from_clause}
+                WHERE ({where_clause})
+                  AND (%s::date IS NULL OR "{self._table}".date >= %s::date)
+            ),
+            active AS (
+                SELECT s.company_id, s.account_id, s.partner_key
+                FROM scope s
+                WHERE EXISTS (
+                    SELECT 1
+                    FROM account_move_line aml
+                    WHERE aml.parent_state = 'posted'
+                      AND aml.account_id = s.account_id
+                      AND COALESCE(aml.partner_id, 0) = s.partner_key
+                      AND (%s::date IS NULL OR aml.date >= %s::date)
+                      AND (%s::date IS NULL OR aml.date <= %s::date)
+                )
+            )
+            SELECT {select_groups}COALESCE(SUM({opening}), 0), COALESCE(SUM({closing}), 0)
+            FROM active s
+            {closing_joins}
+            {opening_joins}
+            {group_by};
+        """
+        closing_as_of = date_to or datetime.date.max
+        params = list(where_params) + [
+            # scope: checkpoint-и місяця date_from і пізніше (date - кінець місяця)
+            month_from, month_from,
+            date_from, date_from,
+            date_to, date_to,
+            closing_as_of, closing_as_of,
+        ] + opening_params
+        self.env.cr.execute(query, params)
+        return {tuple(row[:-2]): (row[-2], row[-1]) for row in self.env.cr.fetchall()}
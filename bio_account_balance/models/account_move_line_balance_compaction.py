@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import api, models, _
+from odoo.tools import date_utils
+
+_logger = logging.getLogger(__name__)
+
+# Стискати історію закритих фіскальних років (ir.config_parameter, '1' - увімкнено)
+COMPACTION_ENABLED_PARAM = 'bio_account_balance.compaction_enabled'
+
+# Баланс стисненого рядка на вимогу: колонка -> (міра, порівняння (date, id) з рядком)
+BALANCE_ON_DEMAND = {
+    'bio_initial_balance': ('company', '<'),
+    'bio_end_balance': ('company', '<='),
+    'bio_initial_balance_currency': ('currency', '<'),
+    'bio_end_balance_currency': ('currency', '<='),
+}
+# Рядки між стисненим рядком і межею якорів: (date, id), що не входять в баланс рядка
+CURRENCY_ANCHOR_COMPLEMENT = {'<': '>=', '<=': '>'}
+
+
+class AccountMoveLineBalance(models.Model):
+    """
+    Стиснення історії закритих фіскальних років (ODOO-834).
+
+    Для рядків компанії з date <= res.company.bio_balance_compacted_date
+    (кінець останнього закритого фіскального року, не пізніше межі якорів)
+    рядки bio_account_move_line_balance видаляються, а bio_* колонки account_move_line
+    очищуються. Перерахунок і перебудова стартують від якоря
+    (bio.account.move.line.balance.anchor) і стиснені рядки не читають;
+    помісячні checkpoint-и стиснених місяців зберігаються.
+
+    Баланси стиснених рядків доступні на вимогу: account.move.line._balance_column_sql()
+    (checkpoint попереднього місяця + рядки місяця) і _restore_compacted().
+    """
+    _inherit = 'bio.account.move.line.balance'
+
+    @api.model
+    def _compaction_target(self, company):
+        """
+        Кінець останнього закритого фіскального року, покритого якорями компанії
+        (завжди кінець місяця), або None.
+        ODOO-834
+        """
+        boundary = company.bio_balance_anchor_date
+        if not boundary:
+            return None
+        fiscal_year = company.compute_fiscalyear_dates(boundary)
+        target = boundary if fiscal_year['date_to'] == boundary else fiscal_year['date_from'] - relativedelta(days=1)
+        if target != date_utils.end_of(target, 'month'):
+            target = date_utils.start_of(target, 'month') - relativedelta(days=1)
+        return target
+
+    @api.model
+    def _cron_compact_balances(self):
+        """
+        Cron: стиснення закритих років усіх компаній (якщо увімкнено
+        bio_account_balance.compaction_enabled).
+        ODOO-834
+        """
+        if not self.env['ir.config_parameter'].sudo().get_param(COMPACTION_ENABLED_PARAM):
+            return
+        auto_commit = not self.env.registry.in_test_mode()
+        for company in self.env['res.company'].sudo().search([]):
+            self._compact_company(company, auto_commit=auto_commit)
+
+    @api.model
+    def _compact_company(self, company, auto_commit=False):
+        """
+        Стискає історію компанії до _compaction_target() помісячно.
+        При auto_commit кожен місяць - окрема транзакція; bio_balance_compacted_date
+        просувається разом з ним, перерваний запуск продовжується з наступного місяця.
+        Повертає кількість стиснених рядків.
+        ODOO-834
+        """
+        if self.env['bio.account.move.line.balance.rebuild']._initial_fill():
+            # Стиснена історія спирається на збережені checkpoint-и, яких ще немає
+            return 0
+        target = self._compaction_target(company)
+        compacted = company.bio_balance_compacted_date
+        if not target or (compacted and compacted >= target):
+            return 0
+        if compacted:
+            month_start = compacted + relativedelta(days=1)
+        else:
+            self.env.cr.execute("""
+                SELECT MIN(date) FROM account_move_line
+                WHERE company_id = %s AND parent_state = 'posted'
+            """, (company.id,))
+            first_date = self.env.cr.fetchone()[0]
+            month_start = date_utils.start_of(first_date or target, 'month')
+
+        line_count = 0
+        while month_start <= target:
+            month_end = date_utils.end_of(month_start, 'month')
+            line_count += self._compact_period(company, month_start, month_end)
+            if auto_commit:
+                self.env.cr.commit()
+            month_start = month_end + relativedelta(days=1)
+        _logger.info("bio_account_balance: company %s compacted up to %s (%s journal items)",
+                     company.id, target, line_count)
+        return line_count
+
+    @api.model
+    def _compact_period(self, company, date_from, date_to):
+        """
+        Видаляє збережені баланси рядків компанії з date в [date_from, date_to]
+        і переносить bio_balance_compacted_date на date_to.
+        ODOO-834
+        """
+        params = {'company_id': company.id, 'date_from': date_from, 'date_to': date_to}
+        self.env.cr.execute("""
+            DELETE FROM bio_account_move_line_balance bal
+            USING account_move_line aml
+            WHERE bal.move_line_id = aml.id
+              AND aml.company_id = %(company_id)s
+              AND aml.date BETWEEN %(date_from)s AND %(date_to)s
+        """, params)
+        with self._without_balance_triggers():
+            self.env.cr.execute("""
+                UPDATE account_move_line
+                SET bio_initial_balance          = NULL,
+                    bio_end_balance              = NULL,
+                    bio_initial_balance_currency = NULL,
+                    bio_end_balance_currency     = NULL
+                WHERE company_id = %(company_id)s
+                  AND date BETWEEN %(date_from)s AND %(date_to)s
+                  AND (bio_initial_balance IS NOT NULL OR bio_end_balance IS NOT NULL
+                       OR bio_end_balance_currency IS NOT NULL)
+            """, params)
+            line_count = self.env.cr.rowcount
+        self.env.cr.execute("UPDATE res_company SET bio_balance_compacted_date = %(date_to)s WHERE id = %(company_id)s",
+                            params)
+        company.invalidate_recordset(['bio_balance_compacted_date'])
+        self.env['account.move.line'].invalidate_model(list(BALANCE_ON_DEMAND))
+        self.invalidate_model()
+        # Кеш pivot міг зберегти групи, пораховані до стиснення
+        self._bump_ledger_version(company_ids=[company.id])
+        return line_count
+
+    @api.model
+    def _restore_compacted(self, company):
+        """
+        Відновлює збережені баланси стиснених рядків компанії одним проходом
+        window function по стисненій історії (з її початку, без якорів)
+        і скидає bio_balance_compacted_date.
+        Викликається при перенесенні lock-у раніше за стиснену історію.
+        ODOO-834
+        """
+        compacted = company.bio_balance_compacted_date
+        if not compacted:
+            return 0
+        params = {'company_id': company.id, 'date_to': compacted}
+        self.env['account.move.line'].flush_model()
+        self._lock_accounts(company.id)
+        self.env.cr.execute("""
+            INSERT INTO bio_account_move_line_balance
+                (move_line_id, bio_initial_balance, bio_end_balance, company_currency_id,
+                 bio_initial_balance_currency, bio_end_balance_currency, currency_id)
+            SELECT
+                aml.id,
+                COALESCE(SUM(aml.debit - aml.credit) OVER w_before, 0),
+                SUM(aml.debit - aml.credit) OVER w_upto,
+                aml.company_currency_id,
+                COALESCE(SUM(aml.amount_currency) OVER wc_before, 0),
+                SUM(aml.amount_currency) OVER wc_upto,
+                aml.currency_id
+            FROM account_move_line aml
+            WHERE aml.parent_state = 'posted'
+              AND aml.company_id = %(company_id)s
+              AND aml.date <= %(date_to)s
+            WINDOW w AS (PARTITION BY aml.account_id, COALESCE(aml.partner_id, 0) ORDER BY aml.date, aml.id),
+                   w_before AS (w ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING),
+                   w_upto AS (w ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW),
+                   wc AS (PARTITION BY aml.account_id, COALESCE(aml.partner_id, 0), aml.currency_id
+                          ORDER BY aml.date, aml.id),
+                   wc_before AS (wc ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING),
+                   wc_upto AS (wc ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW)
+            ON CONFLICT (move_line_id) DO UPDATE
+            SET bio_initial_balance = EXCLUDED.bio_initial_balance,
+                bio_end_balance = EXCLUDED.bio_end_balance,
+                company_currency_id = EXCLUDED.company_currency_id,
+                bio_initial_balance_currency = EXCLUDED.bio_initial_balance_currency,
+                bio_end_balance_currency = EXCLUDED.bio_end_balance_currency,
+                currency_id = EXCLUDED.currency_id
+        """, params)
+        with self._without_balance_triggers():
+            self.env.cr.execute("""
+                UPDATE account_move_line aml
+                SET bio_initial_balance          = bal.bio_initial_balance,
+                    bio_end_balance              = bal.bio_end_balance,
+                    bio_initial_balance_currency = bal.bio_initial_balance_currency,
+                    bio_end_balance_currency     = bal.bio_end_balance_currency
+                FROM bio_account_move_line_balance bal
+                WHERE bal.move_line_id = aml.id
+                  AND aml.company_id = %(company_id)s
+                  AND aml.date <= %(date_to)s
+            """, params)
+            line_count = self.env.cr.rowcount
+        self.env.cr.execute("UPDATE res_company SET bio_balance_compacted_date = NULL WHERE id = %(company_id)s", params)
+        company.invalidate_recordset(['bio_balance_compacted_date'])
+        self.env.invalidate_all()
+        self._bump_ledger_version(company_ids=[company.id])
+        _logger.info("bio_account_balance: compacted balances of company %s restored (%s journal items)",
+                     company.id, line_count)
+        return line_count
+
+    @api.model
+    def action_compact_balances(self):
+        """
+        Server action: стиснення закритих років усіх компаній зараз
+        (незалежно від bio_account_balance.compaction_enabled).
+        ODOO-834
+        """
+        auto_commit = not self.env.registry.in_test_mode()
+        line_count = 0
+        for company in self.env['res.company'].sudo().search([]):
+            line_count += self._compact_company(company, auto_commit=auto_commit)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _("Compacted Balances"),
+                'message': _("%s journal items compacted", line_count),
+                'type': 'info',
+                'sticky': False,
+            },
+        }
+
+    @api.model
+    def action_restore_compacted_balances(self):
+        """
+        Server action: відновлює стиснені баланси всіх компаній (наприклад, для аудиту).
+        Наступний запуск cron-у стиснення знову стисне закриті роки, якщо стиснення увімкнено.
+        ODOO-834
+        """
+        line_count = 0
+        for company in self.env['res.company'].sudo().search([('bio_balance_compacted_date', '!=', False)]):
+            line_count += self._restore_compacted(company)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _("Compacted Balances"),
+                'message': _("%s journal items restored", line_count),
+                'type': 'info',
+                'sticky': False,
+            },
+        }
+
+
+class AccountMoveLine(models.Model):
+    _inherit = 'account.move.line'
+
+    @api.model
+    def _balance_on_demand_sql(self, alias, column):
+        """
+        SQL вираз збереженого балансу column рядка alias (колонки account_id, partner_id,
+        currency_id, date, id) без збережених значень - для стиснених рядків.
+        У валюті компанії: checkpoint попереднього місяця + рядки місяця до рядка (не більше місяця);
+        у валюті операції (checkpoint-ів немає): amount_currency якоря партиції валюти
+        (bio.account.move.line.balance.anchor) мінус рядки між рядком і межею якорів -
+        стиснені рядки лежать до межі, тож історія до рядка не читається;
+        без якорів - сума amount_currency партиції валюти до рядка.
+        Без параметрів і символів '%'.
+        ODOO-834
+        """
+        measure, compare = BALANCE_ON_DEMAND[column]
+        if measure == 'currency':
+            partition_sql = f"""
+                  AND p.account_id = {alias}.account_id
+                  AND COALESCE(p.partner_id, 0) = COALESCE({alias}.partner_id, 0)
+                  AND p.currency_id = {alias}.currency_id"""
+            return f"""(
+                SELECT CASE
+                    WHEN b.anchor_date IS NULL THEN COALESCE((
+                        SELECT SUM(p.amount_currency)
+                        FROM account_move_line p
+                        WHERE p.parent_state = 'posted'{partition_sql}
+                          AND (p.date, p.id) {compare} ({alias}.date, {alias}.id)
+                    ), 0)
+                    WHEN {alias}.date <= b.anchor_date THEN b.amount_currency - COALESCE((
+                        SELECT SUM(p.amount_currency)
+                        FROM account_move_line p
+                        WHERE p.parent_state = 'posted'{partition_sql}
+                          AND p.date <= b.anchor_date
+                          AND (p.date, p.id) {CURRENCY_ANCHOR_COMPLEMENT[compare]} ({alias}.date, {alias}.id)
+                    ), 0)
+                    ELSE b.amount_currency + COALESCE((
+                        SELECT SUM(p.amount_currency)
+                        FROM account_move_line p
+                        WHERE p.parent_state = 'posted'{partition_sql}
+                          AND p.date > b.anchor_date
+                          AND (p.date, p.id) {compare} ({alias}.date, {alias}.id)
+                    ), 0)
+                END
+                FROM (
+                    SELECT rc.bio_balance_anchor_date AS anchor_date, COALESCE((
+                        SELECT an.amount_currency
+                        FROM bio_account_move_line_balance_anchor an
+                        WHERE an.account_id = {alias}.account_id
+                          AND COALESCE(an.partner_id, 0) = COALESCE({alias}.partner_id, 0)
+                          AND an.currency_id = {alias}.currency_id
+                    ), 0) AS amount_currency
+                    FROM account_account acc
+                    JOIN res_company rc ON rc.id = acc.company_id
+                    WHERE acc.id = {alias}.account_id
+                ) b
+            )"""
+        return f"""(
+            COALESCE((
+                SELECT c.balance
+                FROM bio_account_move_line_balance_checkpoint c
+                WHERE c.account_id = {alias}.account_id
+                  AND COALESCE(c.partner_id, 0) = COALESCE({alias}.partner_id, 0)
+                  AND c.date < date_trunc('month', {alias}.date)::date
+                ORDER BY c.date DESC
+                LIMIT 1
+            ), 0) + COALESCE((
+                SELECT SUM(p.debit - p.credit)
+                FROM account_move_line p
+                WHERE p.parent_state = 'posted'
+                  AND p.account_id = {alias}.account_id
+                  AND COALESCE(p.partner_id, 0) = COALESCE({alias}.partner_id, 0)
+                  AND p.date >= date_trunc('month', {alias}.date)::date
+                  AND (p.date, p.id) {compare} ({alias}.date, {alias}.id)
+            ), 0)
+        )"""
+
+    @api.model
+    def _balance_column_sql(self, alias, column):
+        """
+        SQL вираз балансу column рядка alias: збережене значення, для стиснених рядків -
+        розраховане на вимогу (COALESCE обчислює підзапит лише для NULL).
+        ODOO-834
+        """
+        return f"COALESCE({alias}.{column}, {self._balance_on_demand_sql(alias, column)})"
+
+    def _get_line_balances(self):
+        """
+        Баланси рядків, у тому числі стиснених: {id: {колонка: значення}}.
+        ODOO-834
+        """
+        if not self:
+            return {}
+        self.env['bio.account.move.line.balance']._flush_dirty_partitions()
+        self.flush_recordset()
+        columns = list(BALANCE_ON_DEMAND)
+        self.env.cr.execute(f"""
+            SELECT aml.id, {', '.join(self._balance_column_sql('aml', column) for column in columns)}
+            FROM account_move_line aml
+            WHERE aml.id IN %s AND aml.parent_state = 'posted'
+        """, (tuple(self.ids),))
+        return {row[0]: dict(zip(columns, row[1:])) for row in self.env.cr.fetchall()}
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from odoo import api, models, SUPERUSER_ID
+
+_logger = logging.getLogger(__name__)
+
+# Таблиця-охоронець партицій: txid останньої транзакції, що перераховувала партицію
+GUARD_TABLE = 'bio_account_move_line_balance_guard'
+# PL/pgSQL функція: позначає партиції і повертає застарілі для snapshot-у транзакції
+GUARD_FUNCTION = 'bio_aml_balance_guard'
+# Ключ партицій, відданих перерахунку після commit-у, в cr.postcommit.data
+STALE_PARTITIONS_KEY = 'bio_account_balance.stale_partitions'
+
+
+class AccountMoveLineBalance(models.Model):
+    """
+    Захист перерахунку від застарілого snapshot-у (ODOO-834).
+
+    Odoo працює в REPEATABLE READ: snapshot транзакції фіксується першим запитом,
+    задовго до pre-commit перерахунку. Advisory lock партиції серіалізує перерахунки,
+    але друга транзакція, дочекавшись lock-у, все одно бачить партицію без рядків першої
+    і записала б баланси, які їх пропускають.
+
+    Тому одразу після advisory lock-ів перерахунок робить upsert рядків партицій
+    в bio_account_move_line_balance_guard (txid поточної транзакції) через
+    bio_aml_balance_guard(). Якщо рядок партиції закомітила транзакція, невидима
+    в нашому snapshot-і, PostgreSQL відхиляє upsert з serialization failure (40001);
+    функція перехоплює її по кожній партиції і повертає такі партиції як застарілі.
+    Застарілі партиції не перераховуються в цій транзакції: їх перераховує
+    post-commit прохід на новому курсорі в READ COMMITTED (_recompute_stale_partitions) -
+    кожен запит бачить усе закомічене, зокрема рядки цієї транзакції.
+    Запит не повторюється, тож гарячі партиції (банк, партнер 0) не перезапускають
+    проведення. Trigger-бекенд віддає застарілі партиції в чергу
+    bio.account.move.line.balance.queue.
+
+    Повна перебудова (chunk, відновлення стиснених балансів) бере ексклюзивні
+    advisory lock-и рахунків (account_id, -1); перерахунок партицій - спільні,
+    тому перерахунки різних партицій не блокують один одного. Після lock-ів
+    перебудова перевіряє, що жоден рядок охоронця її рахунків не закомічений
+    після її snapshot-у (інакше - serialization failure, chunk повторюється
+    пізніше), і позначає свої партиції власним txid.
+    """
+    _inherit = 'bio.account.move.line.balance'
+
+    def init(self):
+        res = super().init()
+        # Без FK: рядок видаленого рахунку / партнера лише зайвий, не хибний
+        self.env.cr.execute(f"""
+            CREATE TABLE IF NOT EXISTS {GUARD_TABLE} (
+                account_id integer NOT NULL,
+                partner_key integer NOT NULL,
+                txid bigint NOT NULL,
+                PRIMARY KEY (account_id, partner_key)
+            )
+        """)
+        # Спершу вся пачка одним upsert-ом; лише якщо він відхилений - по одній партиції
+        # (кожен EXCEPTION-блок - subtransaction)
+        self.env.cr.execute(f"""
+            CREATE OR REPLACE FUNCTION {GUARD_FUNCTION}(p_account_ids int[], p_partner_keys int[])
+            RETURNS TABLE (stale_account_id int, stale_partner_key int)
+            LANGUAGE plpgsql AS $fn$
+            DECLARE
+                v_account_id int;
+                v_partner_key int;
+            BEGIN
+                BEGIN
+                    INSERT INTO {GUARD_TABLE} (account_id, partner_key, txid)
+                    SELECT DISTINCT d.account_id, d.partner_key, txid_current()
+                    FROM unnest(p_account_ids, p_partner_keys) AS d(account_id, partner_key)
+                    ON CONFLICT (account_id, partner_key) DO UPDATE
+                    SET txid = EXCLUDED.txid;
+                    RETURN;
+                EXCEPTION WHEN serialization_failure THEN
+                    NULL;
+                END;
+                FOR v_account_id, v_partner_key IN
+                    SELECT DISTINCT d.account_id, d.partner_key
+                    FROM unnest(p_account_ids, p_partner_keys) AS d(account_id, partner_key)
+                    ORDER BY 1, 2
+                LOOP
+                    BEGIN
+                        INSERT INTO {GUARD_TABLE} (account_id, partner_key, txid)
+                        VALUES (v_account_id, v_partner_key, txid_current())
+                        ON CONFLICT (account_id, partner_key) DO UPDATE
+                        SET txid = EXCLUDED.txid;
+                    EXCEPTION WHEN serialization_failure THEN
+                        stale_account_id := v_account_id;
+                        stale_partner_key := v_partner_key;
+                        RETURN NEXT;
+                    END;
+                END LOOP;
+            END;
+            $fn$;
+        """)
+        return res
+
+    @api.model
+    def _guard_partitions_sql(self):
+        """
+        Позначає партиції txid-ом поточної транзакції і повертає застарілі
+        (stale_account_id, stale_partner_key), див. опис класу.
+        Виконується після _lock_partitions_sql(); той самий текст - в PL/pgSQL
+        функціях trigger-бекенду, тому без символів '%' крім параметрів.
+        Параметри: %(account_ids)s, %(partner_keys)s.
+        ODOO-834
+        """
+        return f"""
+            SELECT stale_account_id, stale_partner_key
+            FROM {GUARD_FUNCTION}(%(account_ids)s::int[], %(partner_keys)s::int[])
+        """
+
+    @api.model
+    def _guard_partitions(self, partitions, params, open_only=False):
+        """
+        Виконує _guard_partitions_sql() для params (паралельні масиви partitions)
+        і віддає застарілі партиції post-commit перерахунку (_defer_stale_partitions).
+        Повертає (partitions, params) без застарілих партицій.
+        ODOO-834
+        """
+        self.env.cr.execute(self._guard_partitions_sql(), params)
+        stale = set(self.env.cr.fetchall())
+        if not stale:
+            return partitions, params
+        stale_partitions = {key: min_date for key, min_date in partitions.items() if (key[0], key[1] or 0) in stale}
+        self._defer_stale_partitions(stale_partitions, open_only=open_only)
+        partitions = {key: min_date for key, min_date in partitions.items() if (key[0], key[1] or 0) not in stale}
+        fresh = [i for i, key in enumerate(zip(params['account_ids'], params['partner_keys'])) if key not in stale]
+        params = dict(params, **{
+            name: [values[i] for i in fresh]
+            for name, values in params.items() if isinstance(values, list)
+        })
+        return partitions, params
+
+    @api.model
+    def _defer_stale_partitions(self, partitions, open_only=False):
+        """
+        Партиції, застарілі для snapshot-у транзакції, - в post-commit перерахунок
+        (_recompute_stale_partitions). open_only=True - лише відкритий баланс (звірки).
+        ODOO-834
+        """
+        if not partitions:
+            return
+        postcommit = self.env.cr.postcommit
+        if STALE_PARTITIONS_KEY not in postcommit.data:
+            stale = postcommit.data[STALE_PARTITIONS_KEY] = {'full': {}, 'open': {}}
+            registry = self.env.registry
+
+            def recompute():
+                self._recompute_stale_partitions(registry, stale['full'], stale['open'])
+            postcommit.add(recompute)
+        stale = postcommit.data[STALE_PARTITIONS_KEY]
+        self._merge_partitions(stale['open' if open_only else 'full'], partitions)
+        _logger.info("bio_account_balance: %s partitions changed after the transaction snapshot, "
+                     "recomputing them after commit", len(partitions))
+
+    @api.model
+    def _without_stale_partitions(self, partitions):
+        """
+        partitions без партицій, відданих post-commit перерахунку в цій транзакції:
+        snapshot транзакції для них застарів до її кінця.
+        ODOO-834
+        """
+        stale = self.env.cr.postcommit.data.get(STALE_PARTITIONS_KEY)
+        if not stale or not partitions:
+            return partitions
+        return {key: min_date for key, min_date in partitions.items() if (key[0], key[1] or 0) not in stale['full']}
+
+    @api.model
+    def _recompute_stale_partitions(self, registry, partitions, open_partitions):
+        """
+        Post-commit перерахунок застарілих партицій на новому курсорі.
+        READ COMMITTED: snapshot кожного запиту береться після advisory lock-ів,
+        тому перерахунок бачить рядки всіх закомічених транзакцій і сам не буває застарілим.
+        Помилка - партиції йдуть в чергу bio.account.move.line.balance.queue (cron).
+        ODOO-834
+        """
+        open_partitions = {key: min_date for key, min_date in open_partitions.items() if key not in partitions}
+        with registry.cursor() as cr:
+            cr.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+            env = api.Environment(cr, SUPERUSER_ID, {'bio_balance_caller': 'stale'})
+            balance_model = env['bio.account.move.line.balance']
+            try:
+                with cr.savepoint():
+                    balance_model._recompute_partitions(partitions)
+                    balance_model._recompute_open_partitions(open_partitions)
+            except Exception:
+                _logger.exception("bio_account_balance: post-commit recompute of %s partitions failed, "
+                                  "queueing them", len(partitions) + len(open_partitions))
+                env['bio.account.move.line.balance.queue']._enqueue(
+                    balance_model._merge_partitions(dict(partitions), open_partitions))
+
+    @api.model
+    def _lock_accounts(self, company_id, account_from=None, account_to=None):
+        """
+        Ексклюзивні advisory lock-и (account_id, -1) рахунків компанії в діапазоні
+        (None - без обмеження) для повної перебудови їх балансів: чекає завершення
+        перерахунків партицій цих рахунків і не пускає нові до кінця транзакції.
+
+        Далі - перевірка snapshot-у: якщо перерахунок партиції цих рахунків закомічено
+        після snapshot-у транзакції, перебудова не бачить його рядків -
+        serialization failure (40001), викликач повторює з новим snapshot-ом.
+        Нарешті партиції рахунків позначаються txid перебудови: перерахунок
+        зі старішим snapshot-ом після неї віддасть їх post-commit перерахунку.
+        ODOO-834
+        """
+        params = {'company_id': company_id, 'account_from': account_from, 'account_to': account_to}
+        accounts_sql = """
+            SELECT id FROM account_account
+            WHERE company_id = %(company_id)s
+              AND (%(account_from)s::int IS NULL OR id >= %(account_from)s)
+              AND (%(account_to)s::int IS NULL OR id <= %(account_to)s)
+        """
+        self.env.cr.execute(f"""
+            SELECT pg_advisory_xact_lock(a.id, -1)
+            FROM ({accounts_sql} ORDER BY id OFFSET 0) a
+        """, params)
+        # RAISE з SQLSTATE можливий лише в PL/pgSQL; DO не приймає параметрів - цілі числа підставляються літералами
+        literal_accounts_sql = accounts_sql % {
+            key: 'NULL' if value is None else int(value) for key, value in params.items()
+        }
+        self.env.cr.execute(f"""
+            DO $guard$
+            BEGIN
+                IF EXISTS (
+                    SELECT 1 FROM {GUARD_TABLE} g
+                    WHERE g.account_id IN ({literal_accounts_sql})
+                      AND g.txid != txid_current()
+                      AND NOT txid_visible_in_snapshot(g.txid, txid_current_snapshot())
+                ) THEN
+                    RAISE EXCEPTION 'bio_account_balance: balances of company % changed after the rebuild snapshot', {int(company_id)}
+                        USING ERRCODE = 'serialization_failure';
+                END IF;
+            END
+            $guard$;
+        """)
+        self.env.cr.execute(f"""
+            INSERT INTO {GUARD_TABLE} (account_id, partner_key, txid)
+            SELECT DISTINCT aml.account_id, COALESCE(aml.partner_id, 0), txid_current()
+            FROM account_move_line aml
+            WHERE aml.account_id IN ({accounts_sql})
+              AND aml.parent_state = 'posted'
+            ON CONFLICT (account_id, partner_key) DO UPDATE
+            SET txid = EXCLUDED.txid
+        """, params)
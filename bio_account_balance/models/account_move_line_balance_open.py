@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+import time
+
+from odoo import api, models
+
+from .account_move_line_balance_cache import OPEN_SCOPE
+
+# Ключ буфера партицій, яким потрібен лише перерахунок відкритого балансу, cr.precommit.data
+OPEN_DIRTY_PARTITIONS_KEY = 'bio_account_balance.open_dirty_partitions'
+# Типи рахунків з відкритими позиціями (amount_residual)
+OPEN_ITEM_ACCOUNT_TYPES = ('asset_receivable', 'liability_payable')
+
+
+class AccountMoveLineBalance(models.Model):
+    """
+    Відкритий (open-item) running balance (ODOO-834).
+
+    account_move_line.bio_open_balance - running sum amount_residual проведених рядків
+    партиції (account + partner) в порядку (date, id), лише для рахунків дебіторів /
+    кредиторів. Звірені рядки мають amount_residual = 0, тому сума = сума відкритих позицій.
+
+    Рахується тим же механізмом, що й bio_end_balance: ті ж партиції, буфер транзакції,
+    advisory lock-и, перерахунок хвоста від останнього рядка до min_date.
+    На відміну від bio_end_balance не використовує якорі, checkpoint-и і стиснення:
+    залишок заблокованого рядка змінюється при звірці з новою оплатою.
+    Тому значення зберігається лише в account_move_line, без bio_account_move_line_balance.
+
+    Зміна звірок (account.partial.reconcile) позначає партиції лише для цього перерахунку
+    (_enqueue_open_partitions) - хвіст bio_end_balance не переписується.
+    """
+    _inherit = 'bio.account.move.line.balance'
+
+    @api.model
+    def _open_partitions_sql(self):
+        """
+        SQL перерахунку bio_open_balance хвостів партицій від min_date.
+        Партиції інших типів рахунків (рядок перенесено з рахунку дебітора) очищуються.
+        Параметри: %(account_ids)s, %(partner_keys)s, %(dates)s - як у _recompute_partitions_sql;
+        той самий текст - в PL/pgSQL функціях trigger-бекенду, тому без символів '%' крім параметрів.
+        ODOO-834
+        """
+        return """
+            WITH dirty AS (
+                SELECT d.account_id, d.partner_key, d.min_date,
+                       acc.account_type IN ('asset_receivable', 'liability_payable') AS is_open
+                FROM unnest(%(account_ids)s::int[], %(partner_keys)s::int[], %(dates)s::date[]) AS d(account_id, partner_key, min_date)
+                JOIN account_account acc ON acc.id = d.account_id
+            ),
+            cleared AS (
+                UPDATE account_move_line aml
+                SET bio_open_balance = NULL
+                FROM dirty d
+                WHERE NOT d.is_open
+                  AND aml.parent_state = 'posted'
+                  AND aml.account_id = d.account_id
+                  AND COALESCE(aml.partner_id, 0) = d.partner_key
+                  AND aml.date >= d.min_date
+                  AND aml.bio_open_balance IS NOT NULL
+            ),
+            anchor AS (
+                SELECT d.account_id, d.partner_key, d.min_date,
+                       COALESCE(prev.bio_open_balance, 0) AS opening
+                FROM dirty d
+                LEFT JOIN LATERAL (
+                    SELECT aml.bio_open_balance
+                    FROM account_move_line aml
+                    WHERE aml.parent_state = 'posted'
+                      AND aml.account_id = d.account_id
+                      AND COALESCE(aml.partner_id, 0) = d.partner_key
+                      AND aml.date < d.min_date
+                    ORDER BY aml.date DESC, aml.id DESC
+                    LIMIT 1
+                ) prev ON TRUE
+                WHERE d.is_open
+            ),
+            tail AS (
+                SELECT
+                    aml.id,
+                    a.opening + SUM(aml.amount_residual) OVER (
+                        PARTITION BY aml.account_id, COALESCE(aml.partner_id, 0)
+                        ORDER BY aml.date, aml.id
+                        ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+                    ) AS open_balance
+                FROM anchor a
+                JOIN account_move_line aml
+                  ON aml.parent_state = 'posted'
+                 AND aml.account_id = a.account_id
+                 AND COALESCE(aml.partner_id, 0) = a.partner_key
+                 AND aml.date >= a.min_date
+            )
+            UPDATE account_move_line aml
+            SET bio_open_balance = t.open_balance
+            FROM tail t
+            WHERE aml.id = t.id
+              AND aml.bio_open_balance IS DISTINCT FROM t.open_balance
+        """
+
+    @api.model
+    def _update_open_balances(self, partitions):
+        """
+        Виконує _open_partitions_sql() для партицій {(account_id, partner_key): min_date}.
+        Advisory lock-и партицій бере викликач. Повертає id змінених рядків.
+        ODOO-834
+        """
+        if not partitions:
+            return []
+        account_ids, partner_keys, dates = [], [], []
+        for (account_id, partner_key), min_date in partitions.items():
+            account_ids.append(account_id)
+            partner_keys.append(partner_key or 0)
+            dates.append(min_date)
+        self.env['account.move.line'].flush_model([
+            'account_id', 'partner_id', 'date', 'parent_state', 'amount_residual',
+        ])
+        with self._without_balance_triggers():
+            self.env.cr.execute(self._open_partitions_sql() + "\nRETURNING aml.id;", {
+                'account_ids': account_ids, 'partner_keys': partner_keys, 'dates': dates,
+            })
+            line_ids = [row[0] for row in self.env.cr.fetchall()]
+        self.env['account.move.line'].browse(line_ids).invalidate_recordset(['bio_open_balance'])
+        return line_ids
+
+    @api.model
+    def _recompute_partitions(self, partitions):
+        # Відкритий баланс - тим же викликом, під тими ж advisory lock-ами партицій,
+        # крім партицій, відданих post-commit перерахунку (він рахує і відкритий баланс)
+        line_ids = super()._recompute_partitions(partitions)
+        open_partitions = self._without_stale_partitions(partitions)
+        if self._update_open_balances(open_partitions):
+            self._bump_ledger_version(account_ids={key[0] for key in open_partitions}, scopes=(OPEN_SCOPE,))
+        return line_ids
+
+    @api.model
+    def _recompute_open_partitions(self, partitions):
+        """
+        Перерахунок лише bio_open_balance партицій (зміна звірок):
+        bio_end_balance і checkpoint-и не змінюються.
+        ODOO-834
+        """
+        if not partitions:
+            return []
+        started = time.perf_counter()
+        keys = sorted(partitions, key=lambda key: (key[0], key[1] or 0))
+        params = {
+            'account_ids': [key[0] for key in keys],
+            'partner_keys': [key[1] or 0 for key in keys],
+        }
+        self.env.cr.execute("SELECT " + self._lock_partitions_sql(), params)
+        partitions, params = self._guard_partitions(partitions, params, open_only=True)
+        line_ids = self._update_open_balances(partitions)
+        if line_ids:
+            # Змінилась лише міра відкритого балансу - opening/closing в кеші pivot лишаються дійсними
+            self._bump_ledger_version(account_ids={key[0] for key in partitions}, scopes=(OPEN_SCOPE,))
+        self._record_balance_stat('recompute_open', started, time.perf_counter() - started, row_count=len(line_ids))
+        return line_ids
+
+    @api.model
+    def _enqueue_open_partitions(self, partitions):
+        """
+        Відкладений перерахунок bio_open_balance: як _enqueue_partitions(),
+        окремий буфер - партиції з повним перерахунком у ньому не дублюються.
+        ODOO-834
+        """
+        if not partitions:
+            return
+        precommit = self.env.cr.precommit
+        if OPEN_DIRTY_PARTITIONS_KEY not in precommit.data:
+            precommit.data[OPEN_DIRTY_PARTITIONS_KEY] = {}
+            precommit.add(self.sudo()._flush_open_partitions)
+        self._merge_partitions(precommit.data[OPEN_DIRTY_PARTITIONS_KEY], partitions)
+
+    @api.model
+    def _flush_open_partitions(self):
+        partitions = self.env.cr.precommit.data.pop(OPEN_DIRTY_PARTITIONS_KEY, None)
+        # Незаповнені рахунки - в чергу повного перерахунку (він рахує і відкритий баланс)
+        partitions = self._defer_unfilled_partitions(partitions)
+        if partitions:
+            self.with_context(bio_balance_caller='reconcile')._recompute_open_partitions(partitions)
+
+    @api.model
+    def _flush_dirty_partitions(self):
+        # Читання балансів (read_group, книга партнера) бачить і змінені звірки транзакції
+        res = super()._flush_dirty_partitions()
+        self._flush_open_partitions()
+        return res
+
+    @api.model
+    def _rebuild_open_balances(self, company_id=None, account_from=None, account_to=None):
+        """
+        Повний розрахунок bio_open_balance window function по компанії / діапазону
+        рахунків (None - без обмеження); пишуться лише змінені значення.
+        Повертає кількість змінених рядків.
+        ODOO-834
+        """
+        params = {
+            'company_id': company_id, 'account_from': account_from, 'account_to': account_to,
+            'account_types': list(OPEN_ITEM_ACCOUNT_TYPES),
+        }
+        range_sql = """
+            (%(company_id)s::int IS NULL OR aml.company_id = %(company_id)s)
+            AND (%(account_from)s::int IS NULL OR aml.account_id >= %(account_from)s)
+            AND (%(account_to)s::int IS NULL OR aml.account_id <= %(account_to)s)
+        """
+        with self._without_balance_triggers():
+            self.env.cr.execute(f"""
+                UPDATE account_move_line aml
+                SET bio_open_balance = w.open_balance
+                FROM (
+                    SELECT
+                        aml.id,
+                        SUM(aml.amount_residual) OVER (
+                            PARTITION BY aml.account_id, COALESCE(aml.partner_id, 0)
+                            ORDER BY aml.date, aml.id
+                            ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+                        ) AS open_balance
+                    FROM account_move_line aml
+                    JOIN account_account acc ON acc.id = aml.account_id
+                    WHERE aml.parent_state = 'posted'
+                      AND acc.account_type = ANY(%(account_types)s)
+                      AND {range_sql}
+                ) w
+                WHERE aml.id = w.id
+                  AND aml.bio_open_balance IS DISTINCT FROM w.open_balance
+            """, params)
+            line_count = self.env.cr.rowcount
+            self.env.cr.execute(f"""
+                UPDATE account_move_line aml
+                SET bio_open_balance = NULL
+                FROM account_account acc
+                WHERE acc.id = aml.account_id
+                  AND aml.bio_open_balance IS NOT NULL
+                  AND (aml.parent_state != 'posted' OR acc.account_type != ALL(%(account_types)s))
+                  AND {range_sql}
+            """, params)
+            line_count += self.env.cr.rowcount
+        return line_count
+
+    @api.model
+    def _rebuild_chunk(self, company_id, account_from, account_to):
+        line_count = super()._rebuild_chunk(company_id, account_from, account_to)
+        line_count += self._rebuild_open_balances(company_id, account_from, account_to)
+        self.env['account.move.line'].invalidate_model(['bio_open_balance'])
+        return line_count
+
+    @api.model
+    def _rebuild_shadow(self, auto_commit=True):
+        swapped = super()._rebuild_shadow(auto_commit=auto_commit)
+        if swapped:
+            self._rebuild_open_balances()
+            self.env['account.move.line'].invalidate_model(['bio_open_balance'])
+            if auto_commit:
+                self.env.cr.commit()
+        return swapped
+
+    @api.model
+    def _clear_balances(self, line_ids):
+        super()._clear_balances(line_ids)
+        if not line_ids:
+            return
+        with self._without_balance_triggers():
+            self.env.cr.execute("""
+                UPDATE account_move_line SET bio_open_balance = NULL
+                WHERE id IN %s AND bio_open_balance IS NOT NULL;
+            """, (tuple(line_ids),))
+        self.env['account.move.line'].browse(line_ids).invalidate_recordset(['bio_open_balance'])
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from odoo import api, models, _
+
+from .account_move_line import BALANCE_INDEX_NAME
+
+_logger = logging.getLogger(__name__)
+
+# На меншій таблиці планувальник обґрунтовано обирає Seq Scan - попередження не логуються
+PLAN_CHECK_MIN_ROWS = 10000
+
+
+class AccountMoveLineBalance(models.Model):
+    """
+    Перевірка планів запитів балансів (ODOO-834).
+
+    EXPLAIN запитів модуля, які мають іти по покриваючому індексу
+    bio_aml_balance_partition_idx: баланси груп pivot по рядках (DISTINCT ON),
+    баланси на дату (checkpoint + range-sum) та перерахунок хвостів партицій.
+    Seq Scan по account_move_line або план без індексу - попередження в лог.
+    """
+    _inherit = 'bio.account.move.line.balance'
+
+    @api.model
+    def _check_query_plans(self):
+        """
+        Виконує EXPLAIN (без ANALYZE - запити не виконуються) і повертає
+        список проблем [(назва запиту, опис)].
+        ODOO-834
+        """
+        cr = self.env.cr
+        cr.execute("SELECT reltuples FROM pg_class WHERE oid = 'account_move_line'::regclass")
+        row_estimate = cr.fetchone()[0]
+        cr.execute("""
+            SELECT account_id, COALESCE(partner_id, 0), date
+            FROM account_move_line
+            WHERE parent_state = 'posted' AND account_id IS NOT NULL
+            ORDER BY id DESC
+            LIMIT 1
+        """)
+        sample = cr.fetchone()
+        if not sample:
+            _logger.info("bio_account_balance: query plan check skipped, no posted journal items")
+            return []
+
+        account_id, partner_key, date = sample
+        aml = self.env['account.move.line']
+        queries = [
+            ('balances_by_groups', *aml._balances_by_groups_sql([], ['partner_id'])[:2]),
+            ('balances_at', aml._balances_at_sql("SELECT %s::int AS account_id, %s::int AS partner_key"),
+             [account_id, partner_key, [date]]),
+            ('recompute_partitions', self._recompute_partitions_sql(),
+             {'account_ids': [account_id], 'partner_keys': [partner_key], 'dates': [date]}),
+        ]
+        issues = []
+        for name, query, params in queries:
+            cr.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            plan = cr.fetchone()[0][0]['Plan']
+            nodes = list(self._iter_plan_nodes(plan))
+            if any(node['Node Type'] == 'Seq Scan' and node.get('Relation Name') == 'account_move_line'
+                   for node in nodes):
+                issues.append((name, "sequential scan on account_move_line"))
+            if not any(node.get('Index Name') == BALANCE_INDEX_NAME for node in nodes):
+                issues.append((name, "index %s is not used" % BALANCE_INDEX_NAME))
+
+        if aml._balance_index_outdated():
+            issues.append(('index', "index %s has an outdated format, run Rebuild Partition Index" % BALANCE_INDEX_NAME))
+
+        log = _logger.warning if row_estimate >= PLAN_CHECK_MIN_ROWS else _logger.info
+        for name, issue in issues:
+            log("bio_account_balance: query plan of %s: %s (~%d journal items)", name, issue, row_estimate)
+        if not issues:
+            _logger.info("bio_account_balance: query plans use %s", BALANCE_INDEX_NAME)
+        return issues
+
+    @api.model
+    def _iter_plan_nodes(self, plan):
+        yield plan
+        for child in plan.get('Plans', []):
+            yield from self._iter_plan_nodes(child)
+
+    @api.model
+    def action_check_query_plans(self):
+        """
+        Server action: перевірка планів з результатом у повідомленні.
+        ODOO-834
+        """
+        issues = self._check_query_plans()
+        if issues:
+            message = "\n".join("%s: %s" % issue for issue in issues)
+        else:
+            message = _("All balance queries use the index %s.", BALANCE_INDEX_NAME)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _("Balance Query Plans"),
+                'message': message,
+                'type': 'warning' if issues else 'success',
+                'sticky': bool(issues),
+            },
+        }
+
+    @api.model
+    def action_rebuild_partition_index(self):
+        """
+        Server action: перебудова bio_aml_balance_partition_idx без блокування запису
+        (account.move.line._rebuild_balance_index). Комітить поточну транзакцію.
+        ODOO-834
+        """
+        rebuilt = self.env['account.move.line']._rebuild_balance_index()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _("Balance Partition Index"),
+                'message': _("Index %s rebuilt.", BALANCE_INDEX_NAME) if rebuilt
+                else _("Index %s is up to date.", BALANCE_INDEX_NAME),
+                'type': 'success',
+                'sticky': False,
+            },
+        }
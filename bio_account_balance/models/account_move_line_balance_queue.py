@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from odoo import api, fields, models
+from odoo.tools import index_exists
+
+_logger = logging.getLogger(__name__)
+
+
+class AccountMoveLineBalanceQueue(models.Model):
+    """
+    Черга відкладеного перерахунку балансів (ODOO-834).
+
+    Один запис = одна партиція (account_id, partner_id) з найранішою датою,
+    з якої треба перерахувати хвіст. Повторні записи для тієї ж партиції
+    зливаються в один (date_from = LEAST). Черга наповнюється, коли транзакція
+    зачіпає занадто багато партицій для pre-commit перерахунку,
+    і обробляється cron-ом.
+    """
+    _name = 'bio.account.move.line.balance.queue'
+    _description = 'Pending balance recomputations'
+    _order = 'id'
+
+    account_id = fields.Many2one(
+        comodel_name='account.account',
+        string='Account',
+        required=True,
+        ondelete='cascade',
+    )
+    partner_id = fields.Many2one(
+        comodel_name='res.partner',
+        string='Partner',
+        ondelete='cascade',
+    )
+    date_from = fields.Date(
+        string='Recompute From',
+        required=True,
+    )
+
+    def _auto_init(self):
+        res = super()._auto_init()
+        # Унікальність партиції з урахуванням NULL partner_id - потрібна для ON CONFLICT в _enqueue()
+        if not index_exists(self._cr, 'bio_account_move_line_balance_queue_partition_uniq'):
+            self._cr.execute("""
+                CREATE UNIQUE INDEX bio_account_move_line_balance_queue_partition_uniq
+                ON bio_account_move_line_balance_queue (account_id, (COALESCE(partner_id, 0)))
+            """)
+        return res
+
+    @api.model
+    def _enqueue(self, partitions):
+        """
+        Додає партиції в чергу, зливаючи з уже існуючими (найраніша дата виграє).
+        partitions: {(account_id, partner_key): min_date}
+        ODOO-834
+        """
+        if not partitions:
+            return
+        account_ids, partner_keys, dates = [], [], []
+        for (account_id, partner_key), min_date in partitions.items():
+            account_ids.append(account_id)
+            partner_keys.append(partner_key or 0)
+            dates.append(min_date)
+        self.env.cr.execute(self._enqueue_sql(), {
+            'account_ids': account_ids, 'partner_keys': partner_keys, 'dates': dates,
+        })
+        self.invalidate_model()
+        _logger.info("bio_account_balance: %s partitions queued for balance recompute", len(account_ids))
+
+    @api.model
+    def _enqueue_sql(self):
+        """
+        Upsert партицій в чергу. Параметри: %(account_ids)s, %(partner_keys)s, %(dates)s;
+        той самий текст - в PL/pgSQL функції trigger-бекенду, тому без символів '%' крім параметрів.
+        ODOO-834
+        """
+        return """
+            INSERT INTO bio_account_move_line_balance_queue (account_id, partner_id, date_from, create_date, write_date)
+            SELECT account_id, NULLIF(partner_key, 0), min_date, now() AT TIME ZONE 'UTC', now() AT TIME ZONE 'UTC'
+            FROM unnest(%(account_ids)s::int[], %(partner_keys)s::int[], %(dates)s::date[]) AS d(account_id, partner_key, min_date)
+            ON CONFLICT (account_id, (COALESCE(partner_id, 0))) DO UPDATE
+            SET date_from = LEAST(bio_account_move_line_balance_queue.date_from, EXCLUDED.date_from),
+                write_date = EXCLUDED.write_date
+        """
+
+    @api.model
+    def _process(self, batch_size=1000, auto_commit=False):
+        """
+        Забирає партиції з черги пачками (FOR UPDATE SKIP LOCKED - паралельні
+        воркери не беруть одні й ті ж партиції) і перераховує їх.
+        Партиції рахунків, ще не заповнених початковим заповненням, лишаються в черзі
+        до його завершення (_unfilled_accounts_sql).
+        Повертає кількість оброблених партицій.
+        ODOO-834
+        """
+        balance_model = self.env['bio.account.move.line.balance']
+        balance_model._flush_fill_state()
+        unfilled = balance_model._unfilled_accounts_sql('q')
+        processed = 0
+        while True:
+            self.env.cr.execute(f"""
+                DELETE FROM bio_account_move_line_balance_queue
+                WHERE id IN (
+                    SELECT id FROM bio_account_move_line_balance_queue q
+                    WHERE NOT {unfilled}
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING account_id, COALESCE(partner_id, 0), date_from;
+            """, (batch_size,))
+            rows = self.env.cr.fetchall()
+            if not rows:
+                break
+            partitions = {(account_id, partner_key): date_from for account_id, partner_key, date_from in rows}
+            self.env['bio.account.move.line.balance'].with_context(bio_balance_caller='cron')._recompute_partitions(partitions)
+            processed += len(partitions)
+            if auto_commit:
+                self.env.cr.commit()
+        self.invalidate_model()
+        return processed
+
+    @api.model
+    def _cron_process_queue(self, batch_size=1000):
+        """
+        Cron: обробка черги відкладеного перерахунку балансів
+        і злиття журналу версій книги (_compact_ledger_versions).
+        ODOO-834
+        """
+        processed = self._process(batch_size=batch_size, auto_commit=True)
+        if processed:
+            _logger.info("bio_account_balance: recomputed %s queued partitions", processed)
+        # Журнал версій книги кешу pivot росте з кожною транзакцією - злиття рядків
+        self.env['bio.account.move.line.balance']._compact_ledger_versions()
+        return processed
@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from odoo import api, fields, models, SUPERUSER_ID
+from odoo.service.model import PG_CONCURRENCY_ERRORS_TO_RETRY
+
+_logger = logging.getLogger(__name__)
+
+# Параметри повної перебудови (ir.config_parameter)
+REBUILD_WORKERS_PARAM = 'bio_account_balance.rebuild_workers'
+REBUILD_WORKERS_DEFAULT = 4
+REBUILD_CHUNK_SIZE_PARAM = 'bio_account_balance.rebuild_chunk_size'
+REBUILD_CHUNK_SIZE_DEFAULT = 500000
+# Початкове заповнення (post_init hook): до скількох рядків - одразу в транзакції встановлення,
+# більше - відкладено, cron-ом chunk-ами з commit-ом кожного
+INIT_INLINE_THRESHOLD_PARAM = 'bio_account_balance.init_inline_threshold'
+INIT_INLINE_THRESHOLD_DEFAULT = 200000
+# Бюджет часу одного запуску cron-у початкового заповнення (секунди)
+INIT_TIME_BUDGET_PARAM = 'bio_account_balance.init_time_budget'
+INIT_TIME_BUDGET_DEFAULT = 1800
+INIT_CRON_XMLID = 'bio_account_balance.bio_ir_cron_initialize_balances'
+# Повтори chunk-а після конфлікту з конкурентним перерахунком: спроб до 'failed',
+# пауза перед повтором (секунди, подвоюється з кожною спробою)
+CHUNK_MAX_ATTEMPTS = 5
+CHUNK_RETRY_DELAY = 2
+QUEUE_CRON_XMLID = 'bio_account_balance.bio_ir_cron_process_balance_queue'
+
+
+class AccountMoveLineBalanceRebuild(models.Model):
+    """
+    Запуск повної перебудови балансів (ODOO-834).
+
+    Робота ділиться на chunk-и (компанія + діапазон account_id, ~rebuild_chunk_size рядків).
+    Партиція (account_id + partner_id) завжди цілком в одному chunk-у, тому chunk-и незалежні
+    і виконуються паралельно на окремих курсорах, кожен комітиться окремо.
+    Стан chunk-ів зберігається - перерваний запуск продовжується з незавершених.
+
+    Початкове заповнення (is_initial, post_init hook) на великій базі обробляється
+    cron-ом Account Balance: Initialize Balances; поки воно не завершене,
+    баланси мають статус 'initializing' (get_balance_status()).
+    """
+    _name = 'bio.account.move.line.balance.rebuild'
+    _description = 'Balance rebuild run'
+    _order = 'id desc'
+
+    state = fields.Selection(
+        selection=[
+            ('running', 'Running'),
+            ('done', 'Done'),
+            ('failed', 'Failed'),
+        ],
+        string='Status',
+        default='running',
+        required=True,
+    )
+    chunk_ids = fields.One2many(
+        comodel_name='bio.account.move.line.balance.rebuild.chunk',
+        inverse_name='rebuild_id',
+        string='Chunks',
+    )
+    chunk_count = fields.Integer(string='Chunks', compute='_compute_progress')
+    chunk_done_count = fields.Integer(string='Chunks Done', compute='_compute_progress')
+    line_count = fields.Integer(string='Lines Rebuilt', compute='_compute_progress')
+    date_done = fields.Datetime(string='Finished On', readonly=True)
+    is_initial = fields.Boolean(
+        string='Initial Fill',
+        readonly=True,
+        help="Initial fill after installation: balances are incomplete until it is done.",
+    )
+    progress = fields.Float(
+        string='Progress (%)',
+        compute='_compute_progress',
+        help="Share of the estimated lines of the done chunks.",
+    )
+
+    @api.depends('chunk_ids.state', 'chunk_ids.line_count', 'chunk_ids.line_estimate')
+    def _compute_progress(self):
+        for rebuild in self:
+            done = rebuild.chunk_ids.filtered(lambda c: c.state == 'done')
+            rebuild.chunk_count = len(rebuild.chunk_ids)
+            rebuild.chunk_done_count = len(done)
+            rebuild.line_count = sum(done.mapped('line_count'))
+            estimate = sum(rebuild.chunk_ids.mapped('line_estimate'))
+            if estimate:
+                rebuild.progress = 100.0 * sum(done.mapped('line_estimate')) / estimate
+            else:
+                rebuild.progress = 100.0 * len(done) / len(rebuild.chunk_ids) if rebuild.chunk_ids else 100.0
+
+    @api.model
+    def _get_or_create_run(self, initial=False):
+        """
+        Повертає незавершений запуск (для продовження) або створює новий з розбивкою на chunk-и.
+        initial=True - початкове заповнення (post_init hook).
+        ODOO-834
+        """
+        rebuild = self.search([('state', 'in', ('running', 'failed'))], limit=1)
+        if rebuild:
+            rebuild.chunk_ids.filtered(lambda c: c.state == 'failed').write({
+                'state': 'pending', 'error': False, 'attempt_count': 0, 'next_attempt': False,
+            })
+            rebuild.state = 'running'
+            _logger.info("bio_account_balance: resuming rebuild %s (%s/%s chunks done)",
+                         rebuild.id, rebuild.chunk_done_count, rebuild.chunk_count)
+            return rebuild
+        return self.create({'is_initial': initial, 'chunk_ids': [(0, 0, vals) for vals in self._plan_chunks()]})
+
+    @api.model
+    def _plan_chunks(self):
+        """
+        Розбиває рахунки кожної компанії на послідовні діапазони account_id
+        з приблизно rebuild_chunk_size рядків у кожному.
+        Враховуються і рахунки без проведених рядків - щоб прибрати застарілі баланси.
+        Рядки заблокованої історії (до межі якорів компанії) не перебудовуються і не рахуються.
+        ODOO-834
+        """
+        chunk_size = int(self.env['ir.config_parameter'].sudo().get_param(
+            REBUILD_CHUNK_SIZE_PARAM, REBUILD_CHUNK_SIZE_DEFAULT)) or REBUILD_CHUNK_SIZE_DEFAULT
+        self.env.cr.execute("""
+            SELECT aml.company_id, aml.account_id,
+                   COUNT(*) FILTER (WHERE aml.parent_state = 'posted'
+                                      AND (rc.bio_balance_anchor_date IS NULL OR aml.date > rc.bio_balance_anchor_date))
+            FROM account_move_line aml
+            JOIN res_company rc ON rc.id = aml.company_id
+            WHERE aml.account_id IS NOT NULL
+            GROUP BY aml.company_id, aml.account_id
+            ORDER BY aml.company_id, aml.account_id;
+        """)
+        chunks = []
+        current = None
+        for company_id, account_id, line_count in self.env.cr.fetchall():
+            if current and (current['company_id'] != company_id or current['line_count'] >= chunk_size):
+                chunks.append(current)
+                current = None
+            if not current:
+                current = {'company_id': company_id, 'account_from': account_id, 'account_to': account_id, 'line_count': 0}
+            current['account_to'] = account_id
+            current['line_count'] += line_count
+        if current:
+            chunks.append(current)
+        return [{
+            'company_id': chunk['company_id'],
+            'account_from': chunk['account_from'],
+            'account_to': chunk['account_to'],
+            'line_estimate': chunk['line_count'],
+        } for chunk in chunks]
+
+    def _run(self, workers=None, auto_commit=False):
+        """
+        Виконує незавершені chunk-и запуску.
+
+        auto_commit=False (типово) - chunk-и обробляються послідовно в поточній транзакції
+        (тести, post_init hook), нічого не комітиться.
+        auto_commit=True - УВАГА: комітить транзакцію викликача (щоб запуск і chunk-и
+        були видимі воркерам), далі chunk-и обробляються паралельно workers потоками,
+        кожен на власному курсорі з commit-ом кожного chunk-а. Лише для викликачів,
+        які володіють транзакцією (server action, odoo shell).
+        Повертає True якщо всі chunk-и завершені.
+        ODOO-834
+        """
+        self.ensure_one()
+        if workers is None:
+            workers = int(self.env['ir.config_parameter'].sudo().get_param(
+                REBUILD_WORKERS_PARAM, REBUILD_WORKERS_DEFAULT)) or 1
+
+        started = time.time()
+        _logger.info("bio_account_balance: rebuild %s started (%s chunks, %s workers)",
+                     self.id, self.chunk_count, workers if auto_commit else 1)
+
+        if auto_commit:
+            self.env.cr.commit()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for future in [executor.submit(self._run_worker, self.id) for _i in range(workers)]:
+                    future.result()
+            self.env.invalidate_all()
+        else:
+            self._process_chunks(auto_commit=False)
+        return self._finish(started)
+
+    def _finish(self, started):
+        """
+        Завершує запуск після обробки chunk-ів: стан 'done' / 'failed'.
+        Якщо лишились pending chunk-и (вичерпано бюджет часу) - запуск лишається 'running'.
+        Повертає True якщо всі chunk-и завершені.
+        ODOO-834
+        """
+        self.ensure_one()
+        # Стан chunk-ів могли змінити інші курсори (воркери)
+        self.chunk_ids.invalidate_recordset()
+        if self.chunk_ids.filtered(lambda c: c.state == 'pending'):
+            _logger.info("bio_account_balance: rebuild %s paused after %.1fs: %s/%s chunks done (%.1f%%)",
+                         self.id, time.time() - started, self.chunk_done_count, self.chunk_count, self.progress)
+            return False
+        failed = self.chunk_ids.filtered(lambda c: c.state != 'done')
+        self.write({
+            'state': 'failed' if failed else 'done',
+            'date_done': False if failed else fields.Datetime.now(),
+        })
+        _logger.info("bio_account_balance: rebuild %s finished in %.1fs: %s/%s chunks done, %s lines",
+                     self.id, time.time() - started, self.chunk_done_count, self.chunk_count, self.line_count)
+        if not failed:
+            # Межа якорів - на поточний fiscalyear_lock_date (перша перебудова - з початку історії)
+            self.env['bio.account.move.line.balance.anchor']._sync_lock_dates()
+            # Після перебудови - чи йдуть запити балансів по індексу
+            self.env['bio.account.move.line.balance']._check_query_plans()
+            if self.is_initial:
+                # Перерахунки, відкладені на час заповнення (_defer_unfilled_partitions)
+                self.env.ref(QUEUE_CRON_XMLID)._trigger()
+        return not failed
+
+    @api.model
+    def _initial_fill(self):
+        """
+        Незавершене початкове заповнення (або порожній recordset).
+        Поки воно є, баланси частини рядків ще не розраховані: якорі, стиснення
+        і перевірка розбіжностей не запускаються.
+        ODOO-834
+        """
+        return self.sudo().search([('is_initial', '=', True), ('state', '!=', 'done')], limit=1)
+
+    @api.model
+    def _cron_initialize_balances(self):
+        """
+        Cron: відкладене початкове заповнення балансів. Chunk-и обробляються
+        на курсорі cron-у з commit-ом кожного в межах bio_account_balance.init_time_budget;
+        якщо роботу не завершено - cron запускається знову одразу.
+        ODOO-834
+        """
+        rebuild = self._initial_fill()
+        if not rebuild:
+            return
+        rebuild.chunk_ids.filtered(lambda c: c.state == 'failed').write({
+            'state': 'pending', 'error': False, 'attempt_count': 0, 'next_attempt': False,
+        })
+        rebuild.state = 'running'
+        self.env.cr.commit()
+
+        started = time.time()
+        time_budget = int(self.env['ir.config_parameter'].sudo().get_param(
+            INIT_TIME_BUDGET_PARAM, INIT_TIME_BUDGET_DEFAULT))
+        rebuild._process_chunks(auto_commit=True, deadline=time_budget and started + time_budget)
+        if not rebuild._finish(started) and rebuild.state == 'running':
+            self.env.ref(INIT_CRON_XMLID)._trigger()
+
+    @api.model
+    def _schedule_initial_fill(self):
+        """
+        Початкове заповнення після встановлення: невелика база - одразу в поточній
+        транзакції, велика (більше bio_account_balance.init_inline_threshold рядків) -
+        лише план chunk-ів, заповнення виконує cron (з commit-ом кожного chunk-а).
+        Повертає True якщо баланси заповнені одразу.
+        ODOO-834
+        """
+        rebuild = self._get_or_create_run(initial=True)
+        threshold = int(self.env['ir.config_parameter'].sudo().get_param(
+            INIT_INLINE_THRESHOLD_PARAM, INIT_INLINE_THRESHOLD_DEFAULT))
+        line_estimate = sum(rebuild.chunk_ids.mapped('line_estimate'))
+        if line_estimate <= threshold:
+            return rebuild._run()
+        _logger.info("bio_account_balance: initial fill of ~%s lines deferred to cron (rebuild %s, %s chunks)",
+                     line_estimate, rebuild.id, rebuild.chunk_count)
+        self.env.ref(INIT_CRON_XMLID)._trigger()
+        return False
+
+    def _run_worker(self, rebuild_id):
+        """
+        Потік-воркер: власний курсор, обробляє chunk-и поки є вільні.
+        ODOO-834
+        """
+        with self.env.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            env[self._name].browse(rebuild_id)._process_chunks(auto_commit=True)
+
+    def _process_chunks(self, auto_commit=False, deadline=None):
+        """
+        Забирає pending chunk-и по одному (FOR UPDATE SKIP LOCKED - воркери,
+        в тому числі з інших процесів, не беруть один і той самий chunk) і перебудовує їх.
+        Chunk, відкладений після конфлікту (next_attempt), береться лише коли настав
+        його час - до того обробляються інші; якщо лишились тільки відкладені - пауза до найближчого.
+        deadline - time.time(), після якого нові chunk-и не беруться.
+        ODOO-834
+        """
+        self.ensure_one()
+        chunk_model = self.env['bio.account.move.line.balance.rebuild.chunk']
+        total = len(self.chunk_ids)
+        while not deadline or time.time() < deadline:
+            now = fields.Datetime.now()
+            self.env.cr.execute("""
+                SELECT id FROM bio_account_move_line_balance_rebuild_chunk
+                WHERE rebuild_id = %s AND state = 'pending'
+                  AND (next_attempt IS NULL OR next_attempt <= %s)
+                ORDER BY id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED;
+            """, (self.id, now))
+            row = self.env.cr.fetchone()
+            if not row:
+                self.env.cr.execute("""
+                    SELECT MIN(next_attempt) FROM bio_account_move_line_balance_rebuild_chunk
+                    WHERE rebuild_id = %s AND state = 'pending' AND next_attempt > %s;
+                """, (self.id, now))
+                next_attempt = self.env.cr.fetchone()[0]
+                if not next_attempt:
+                    break
+                wait = (next_attempt - now).total_seconds()
+                if deadline and time.time() + wait >= deadline:
+                    break
+                if auto_commit:
+                    # Не тримати snapshot під час паузи
+                    self.env.cr.commit()
+                time.sleep(wait)
+                continue
+            chunk = chunk_model.browse(row[0])
+            chunk._process(auto_commit=auto_commit)
+            self.env.cr.execute("""
+                SELECT COUNT(*) FROM bio_account_move_line_balance_rebuild_chunk
+                WHERE rebuild_id = %s AND state = 'done';
+            """, (self.id,))
+            _logger.info("bio_account_balance: rebuild %s progress: %s/%s chunks done",
+                         self.id, self.env.cr.fetchone()[0], total)
+
+
+class AccountMoveLineBalanceRebuildChunk(models.Model):
+    _name = 'bio.account.move.line.balance.rebuild.chunk'
+    _description = 'Balance rebuild chunk'
+    _order = 'id'
+
+    rebuild_id = fields.Many2one(
+        comodel_name='bio.account.move.line.balance.rebuild',
+        string='Rebuild',
+        required=True,
+        ondelete='cascade',
+        index=True,
+    )
+    company_id = fields.Many2one(
+        comodel_name='res.company',
+        string='Company',
+        required=True,
+        ondelete='cascade',
+    )
+    account_from = fields.Integer(string='Account ID From', required=True)
+    account_to = fields.Integer(string='Account ID To', required=True)
+    line_estimate = fields.Integer(string='Estimated Lines')
+    line_count = fields.Integer(string='Lines Rebuilt', readonly=True)
+    duration = fields.Float(string='Duration (s)', readonly=True)
+    state = fields.Selection(
+        selection=[
+            ('pending', 'Pending'),
+            ('done', 'Done'),
+            ('failed', 'Failed'),
+        ],
+        string='Status',
+        default='pending',
+        required=True,
+    )
+    error = fields.Text(string='Error', readonly=True)
+    attempt_count = fields.Integer(
+        string='Attempts',
+        readonly=True,
+        help="Attempts so far. A conflict with a concurrent recompute of the same accounts "
+             "is retried after a pause, up to a limit.",
+    )
+    next_attempt = fields.Datetime(string='Next Attempt', readonly=True)
+
+    def _process(self, auto_commit=False):
+        """
+        Перебудовує баланси chunk-а. При auto_commit=True результат і стан
+        chunk-а комітяться разом, помилка - відкат і стан 'failed'.
+        Конфлікт з конкурентним перерахунком (auto_commit=True) - chunk лишається
+        'pending' з паузою CHUNK_RETRY_DELAY * 2^(спроба - 1) секунд,
+        після CHUNK_MAX_ATTEMPTS спроб - 'failed'.
+        ODOO-834
+        """
+        self.ensure_one()
+        started = time.time()
+        attempt = self.attempt_count + 1
+        balance_model = self.env['bio.account.move.line.balance'].with_context(bio_balance_caller='rebuild')
+        try:
+            if auto_commit:
+                line_count = balance_model._rebuild_chunk(self.company_id.id, self.account_from, self.account_to)
+            else:
+                with self.env.cr.savepoint():
+                    line_count = balance_model._rebuild_chunk(self.company_id.id, self.account_from, self.account_to)
+            self.write({'state': 'done', 'line_count': line_count, 'duration': time.time() - started})
+            if auto_commit:
+                self.env.cr.commit()
+        except Exception as e:
+            if auto_commit and getattr(e, 'pgcode', None) in PG_CONCURRENCY_ERRORS_TO_RETRY \
+                    and attempt < CHUNK_MAX_ATTEMPTS:
+                # Конкурентний перерахунок партиції (_lock_accounts) - chunk лишається 'pending',
+                # _process_chunks() візьме його знову з новим snapshot-ом після паузи
+                delay = CHUNK_RETRY_DELAY * 2 ** (attempt - 1)
+                _logger.info("bio_account_balance: rebuild chunk %s (company %s, accounts %s-%s) "
+                             "conflicts with a concurrent recompute, attempt %s/%s, retrying in %ss: %s",
+                             self.id, self.company_id.id, self.account_from, self.account_to,
+                             attempt, CHUNK_MAX_ATTEMPTS, delay, e)
+                self.env.cr.rollback()
+                self.write({
+                    'attempt_count': attempt,
+                    'next_attempt': fields.Datetime.now() + timedelta(seconds=delay),
+                })
+                self.env.cr.commit()
+                return
+            _logger.error("bio_account_balance: rebuild chunk %s (company %s, accounts %s-%s) failed: %s",
+                          self.id, self.company_id.id, self.account_from, self.account_to, e, exc_info=True)
+            if auto_commit:
+                self.env.cr.rollback()
+            self.write({'state': 'failed', 'error': str(e), 'attempt_count': attempt})
+            if auto_commit:
+                self.env.cr.commit()
+
+
+class AccountMoveLineBalance(models.Model):
+    """
+    Перерахунки під час відкладеного початкового заповнення (ODOO-834).
+
+    Поки chunk початкового заповнення не завершений, баланси його рахунків ще не
+    розраховані: перерахунок хвоста стартував би від NULL і змагався б з chunk-ом.
+    Тому партиції таких рахунків ідуть в чергу bio.account.move.line.balance.queue,
+    а черга не обробляє їх до завершення заповнення. Рахунки, створені після
+    планування chunk-ів, перераховуються як звичайно.
+    """
+    _inherit = 'bio.account.move.line.balance'
+
+    @api.model
+    def _unfilled_accounts_sql(self, alias):
+        """
+        Умова "рахунок {alias}.account_id - в незавершеному chunk-у початкового заповнення".
+        Без символів '%' - вставляється в запити з параметрами і в PL/pgSQL trigger-бекенду.
+        ODOO-834
+        """
+        return f"""
+            EXISTS (
+                SELECT 1
+                FROM bio_account_move_line_balance_rebuild_chunk c
+                JOIN bio_account_move_line_balance_rebuild r ON r.id = c.rebuild_id
+                JOIN account_account acc ON acc.company_id = c.company_id
+                WHERE r.is_initial
+                  AND r.state != 'done'
+                  AND c.state != 'done'
+                  AND acc.id = {alias}.account_id
+                  AND {alias}.account_id BETWEEN c.account_from AND c.account_to
+            )
+        """
+
+    @api.model
+    def _flush_fill_state(self):
+        """Стан запусків і chunk-ів з кешу ORM - в базу, для _unfilled_accounts_sql()."""
+        self.env['bio.account.move.line.balance.rebuild'].flush_model(['state', 'is_initial'])
+        self.env['bio.account.move.line.balance.rebuild.chunk'].flush_model()
+
+    @api.model
+    def _defer_unfilled_partitions(self, partitions):
+        """
+        Віддає в чергу партиції рахунків, які ще заповнює початкове заповнення.
+        partitions: {(account_id, partner_key): min_date}. Повертає решту партицій.
+        ODOO-834
+        """
+        if not partitions:
+            return partitions
+        self._flush_fill_state()
+        self.env.cr.execute(f"""
+            SELECT d.account_id, d.partner_key
+            FROM unnest(%(account_ids)s::int[], %(partner_keys)s::int[]) AS d(account_id, partner_key)
+            WHERE {self._unfilled_accounts_sql('d')}
+        """, {
+            'account_ids': [key[0] for key in partitions],
+            'partner_keys': [key[1] or 0 for key in partitions],
+        })
+        unfilled = set(self.env.cr.fetchall())
+        if not unfilled:
+            return partitions
+        deferred, live = {}, {}
+        for key, min_date in partitions.items():
+            target = deferred if (key[0], key[1] or 0) in unfilled else live
+            target[key] = min_date
+        self.env['bio.account.move.line.balance.queue']._enqueue(deferred)
+        return live
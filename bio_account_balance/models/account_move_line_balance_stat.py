@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import logging
+import random
+import time
+
+from odoo import api, fields, models, tools
+
+_logger = logging.getLogger(__name__)
+
+# Частка операцій, які записуються в статистику (0 - вимкнено, 1 - всі), ir.config_parameter
+STATS_SAMPLE_RATE_PARAM = 'bio_account_balance.stats_sample_rate'
+# Скільки днів зберігається статистика
+STATS_RETENTION_DAYS_PARAM = 'bio_account_balance.stats_retention_days'
+STATS_RETENTION_DAYS_DEFAULT = 30
+# Скільки найбільших партицій операції зберігається
+STATS_PARTITIONS_LIMIT = 20
+# Ключ контексту: хто викликав перерахунок (create / write / unlink / move_state / cron ...)
+CALLER_CONTEXT_KEY = 'bio_balance_caller'
+
+
+class AccountMoveLineBalanceStat(models.Model):
+    """
+    Статистика операцій з балансами (ODOO-834).
+
+    Один запис = одна операція (перерахунок партицій, chunk повної перебудови,
+    shadow-перебудова): час, час SQL, кількість партицій і переписаних рядків, хто викликав.
+    Записується з ймовірністю bio_account_balance.stats_sample_rate сирим SQL
+    (працює і в pre-commit hook, після flush ORM).
+    """
+    _name = 'bio.account.move.line.balance.stat'
+    _description = 'Balance operation statistics'
+    _order = 'id desc'
+
+    date = fields.Datetime(string='Date', readonly=True)
+    operation = fields.Selection(
+        selection=[
+            ('recompute', 'Partition Recompute'),
+            ('recompute_open', 'Open Balance Recompute'),
+            ('rebuild_chunk', 'Rebuild Chunk'),
+            ('shadow', 'Shadow Rebuild'),
+        ],
+        string='Operation',
+        readonly=True,
+    )
+    caller = fields.Char(string='Caller', readonly=True)
+    wall_time = fields.Float(string='Wall Time (s)', readonly=True, digits=(16, 4), group_operator='sum')
+    sql_time = fields.Float(string='SQL Time (s)', readonly=True, digits=(16, 4), group_operator='sum')
+    partition_count = fields.Integer(string='Partitions', readonly=True)
+    row_count = fields.Integer(string='Rows Rewritten', readonly=True)
+    partition_ids = fields.One2many(
+        comodel_name='bio.account.move.line.balance.stat.partition',
+        inverse_name='stat_id',
+        string='Largest Partitions',
+        readonly=True,
+    )
+
+    @api.autovacuum
+    def _gc_stats(self):
+        days = int(self.env['ir.config_parameter'].sudo().get_param(
+            STATS_RETENTION_DAYS_PARAM, STATS_RETENTION_DAYS_DEFAULT))
+        self.env.cr.execute("""
+            DELETE FROM bio_account_move_line_balance_stat
+            WHERE date < (now() AT TIME ZONE 'UTC') - make_interval(days => %s)
+        """, (days,))
+
+
+class AccountMoveLineBalanceStatPartition(models.Model):
+    _name = 'bio.account.move.line.balance.stat.partition'
+    _description = 'Balance operation statistics per partition'
+    _order = 'duration desc'
+
+    stat_id = fields.Many2one(
+        comodel_name='bio.account.move.line.balance.stat',
+        string='Operation',
+        required=True,
+        ondelete='cascade',
+        index=True,
+    )
+    account_id = fields.Many2one(comodel_name='account.account', string='Account', readonly=True)
+    partner_id = fields.Many2one(comodel_name='res.partner', string='Partner', readonly=True)
+    row_count = fields.Integer(string='Rows Rewritten', readonly=True)
+    duration = fields.Float(
+        string='Duration (s)',
+        readonly=True,
+        digits=(16, 4),
+        help="Wall time of the operation attributed to the partition by its share of rewritten rows.",
+    )
+
+
+class AccountMoveLineBalanceStatSlowest(models.Model):
+    """
+    Найповільніші партиції за зібраною статистикою (SQL view).
+    ODOO-834
+    """
+    _name = 'bio.account.move.line.balance.stat.slowest'
+    _description = 'Slowest balance partitions'
+    _auto = False
+    _order = 'duration desc'
+
+    account_id = fields.Many2one(comodel_name='account.account', string='Account', readonly=True)
+    partner_id = fields.Many2one(comodel_name='res.partner', string='Partner', readonly=True)
+    call_count = fields.Integer(string='Operations', readonly=True)
+    row_count = fields.Integer(string='Rows Rewritten', readonly=True)
+    duration = fields.Float(string='Total Duration (s)', readonly=True, digits=(16, 4))
+    max_duration = fields.Float(string='Max Duration (s)', readonly=True, digits=(16, 4), group_operator='max')
+    avg_rows = fields.Float(string='Avg Rows per Operation', readonly=True, group_operator='avg')
+
+    def init(self):
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute(f"""
+            CREATE VIEW {self._table} AS (
+                SELECT
+                    MIN(p.id) AS id,
+                    p.account_id,
+                    p.partner_id,
+                    COUNT(*) AS call_count,
+                    SUM(p.row_count) AS row_count,
+                    SUM(p.duration) AS duration,
+                    MAX(p.duration) AS max_duration,
+                    AVG(p.row_count) AS avg_rows
+                FROM bio_account_move_line_balance_stat_partition p
+                GROUP BY p.account_id, p.partner_id
+            )
+        """)
+
+
+class AccountMoveLineBalance(models.Model):
+    _inherit = 'bio.account.move.line.balance'
+
+    @api.model
+    def _stats_sampled(self):
+        rate = float(self.env['ir.config_parameter'].sudo().get_param(STATS_SAMPLE_RATE_PARAM, 0) or 0)
+        return rate > 0 and random.random() < rate
+
+    @api.model
+    def _record_balance_stat(self, operation, started, sql_time, partition_rows=None, row_count=0):
+        """
+        Записує статистику операції (якщо вона потрапила у вибірку).
+        started - time.perf_counter() початку операції,
+        partition_rows - {(account_id, partner_key): переписаних рядків}.
+        ODOO-834
+        """
+        wall_time = time.perf_counter() - started
+        caller = self.env.context.get(CALLER_CONTEXT_KEY) or 'direct'
+        partition_count = len(partition_rows) if partition_rows is not None else 0
+        _logger.debug("bio_account_balance: %s (%s): %.4fs wall, %.4fs sql, %s partitions, %s rows",
+                      operation, caller, wall_time, sql_time, partition_count, row_count)
+        if not self._stats_sampled():
+            return
+        _logger.info("bio_account_balance: %s (%s): %.4fs wall, %.4fs sql, %s partitions, %s rows",
+                     operation, caller, wall_time, sql_time, partition_count, row_count)
+        self.env.cr.execute("""
+            INSERT INTO bio_account_move_line_balance_stat
+                (date, operation, caller, wall_time, sql_time, partition_count, row_count,
+                 create_uid, write_uid, create_date, write_date)
+            VALUES (now() AT TIME ZONE 'UTC', %s, %s, %s, %s, %s, %s,
+                    %s, %s, now() AT TIME ZONE 'UTC', now() AT TIME ZONE 'UTC')
+            RETURNING id
+        """, (operation, caller, wall_time, sql_time, partition_count, row_count, self.env.uid, self.env.uid))
+        stat_id = self.env.cr.fetchone()[0]
+        if not partition_rows or not row_count:
+            return
+        largest = sorted(partition_rows.items(), key=lambda item: item[1], reverse=True)[:STATS_PARTITIONS_LIMIT]
+        self.env.cr.execute("""
+            INSERT INTO bio_account_move_line_balance_stat_partition
+                (stat_id, account_id, partner_id, row_count, duration,
+                 create_uid, write_uid, create_date, write_date)
+            SELECT %s, account_id, NULLIF(partner_key, 0), row_count, %s * row_count / %s,
+                   %s, %s, now() AT TIME ZONE 'UTC', now() AT TIME ZONE 'UTC'
+            FROM unnest(%s::int[], %s::int[], %s::int[]) AS d(account_id, partner_key, row_count)
+        """, (
+            stat_id, wall_time, float(row_count), self.env.uid, self.env.uid,
+            [account_id for (account_id, _partner_key), _rows in largest],
+            [partner_key or 0 for (_account_id, partner_key), _rows in largest],
+            [rows for _key, rows in largest],
+        ))
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+import os
+import tempfile
+import uuid
+
+import xlsxwriter
+
+from odoo import api, models, _
+
+# Розмір пачки рядків, які читаються з серверного курсора за раз (ir.config_parameter)
+EXPORT_CHUNK_SIZE_PARAM = 'bio_account_balance.export_chunk_size'
+EXPORT_CHUNK_SIZE_DEFAULT = 5000
+# Розмір блоку файлу при віддачі xlsx
+EXPORT_BLOCK_SIZE = 64 * 1024
+# Максимум рядків аркуша XLSX - далі новий аркуш
+XLSX_MAX_ROWS = 1048576
+
+
+class AccountMoveLine(models.Model):
+    """
+    Потокове вивантаження книги з running balance (ODOO-834).
+
+    Рядки читаються named (серверним) курсором PostgreSQL пачками по export_chunk_size
+    в порядку (account, partner, date, id) - по індексу bio_aml_balance_partition_idx.
+    Пам'ять не залежить від кількості рядків: recordset-и не створюються,
+    CSV віддається пачками, XLSX пишеться xlsxwriter-ом в режимі constant_memory
+    у тимчасовий файл і віддається блоками.
+    """
+    _inherit = 'account.move.line'
+
+    @api.model
+    def _ledger_export_headers(self):
+        # Мовою користувача - як і назви рахунків у вивантаженні
+        return [
+            _('Account'), _('Account Name'), _('Partner'), _('Date'), _('Journal Entry'), _('Label'),
+            _('Initial Balance'), _('Debit'), _('Credit'), _('End Balance'),
+            _('Currency'), _('Amount in Currency'), _('End Balance in Currency'),
+        ]
+
+    @api.model
+    def _ledger_export_account_name_sql(self):
+        """
+        Вираз назви рахунку (alias acc) і його параметри. В 16.0 account_account.name -
+        varchar; jsonb перекладів - лише якщо поле перекладне (l10n_multilang).
+        ODOO-834
+        """
+        if self.env['account.account']._fields['name'].translate:
+            return "COALESCE(acc.name->>%s, acc.name->>'en_US')", [self.env.lang or 'en_US']
+        return "acc.name", []
+
+    @api.model
+    def _ledger_export_query(self, domain):
+        """
+        SQL вивантаження: (query, params). Домен і правила доступу (ir.rule)
+        застосовуються як у search(). Баланси стиснених рядків рахуються на вимогу.
+        ODOO-834
+        """
+        query_obj = self._where_calc(domain)
+        self._apply_ir_rules(query_obj, 'read')
+        from_clause, where_clause, where_params = query_obj.get_sql()
+        if not where_clause:
+            where_clause = "1=1"
+        account_name_sql, account_name_params = self._ledger_export_account_name_sql()
+        query = f"""
+            SELECT
+                acc.code,
+                {account_name_sql},
+                rp.name,
+                "{self._table}".date,
+                m.name,
+                "{self._table}".name,
+                {self._balance_column_sql(f'"{self._table}"', 'bio_initial_balance')},
+                "{self._table}".debit,
+                "{self._table}".credit,
+                {self._balance_column_sql(f'"{self._table}"', 'bio_end_balance')},
+                cur.name,
+                "{self._table}".amount_currency,
+                {self._balance_column_sql(f'"{self._table}"', 'bio_end_balance_currency')}
+            FROM {from_clause}
+            JOIN account_move m ON m.id = "{self._table}".move_id
+            JOIN account_account acc ON acc.id = "{self._table}".account_id
+            LEFT JOIN res_partner rp ON rp.id = "{self._table}".partner_id
+            LEFT JOIN res_currency cur ON cur.id = "{self._table}".currency_id
+            WHERE ({where_clause})
+            ORDER BY "{self._table}".account_id, COALESCE("{self._table}".partner_id, 0),
+                     "{self._table}".date, "{self._table}".id
+        """
+        return query, account_name_params + list(where_params)
+
+    @api.model
+    def _iter_ledger_export_rows(self, domain):
+        """
+        Генератор пачок рядків (списків tuple) з named cursor-а поточної транзакції.
+        ODOO-834
+        """
+        chunk_size = int(self.env['ir.config_parameter'].sudo().get_param(
+            EXPORT_CHUNK_SIZE_PARAM, EXPORT_CHUNK_SIZE_DEFAULT)) or EXPORT_CHUNK_SIZE_DEFAULT
+        self.env['bio.account.move.line.balance']._flush_dirty_partitions()
+        self.env.flush_all()
+        query, params = self._ledger_export_query(domain)
+        with self.env.cr._cnx.cursor(name='bio_ledger_export_%s' % uuid.uuid4().hex) as named:
+            named.itersize = chunk_size
+            named.execute(query, params)
+            while True:
+                rows = named.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+
+    @api.model
+    def _ledger_export_csv(self, domain):
+        """
+        Генератор байтів CSV (UTF-8), одна пачка рядків - один блок.
+        ODOO-834
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self._ledger_export_headers())
+        for rows in self._iter_ledger_export_rows(domain):
+            writer.writerows(rows)
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode('utf-8')
+
+    @api.model
+    def _ledger_export_xlsx(self, domain):
+        """
+        Генератор байтів XLSX: файл пишеться в тимчасовий файл (constant_memory),
+        потім віддається блоками. Понад XLSX_MAX_ROWS рядків - наступний аркуш.
+        ODOO-834
+        """
+        fd, path = tempfile.mkstemp(suffix='.xlsx', prefix='bio_ledger_export_')
+        os.close(fd)
+        try:
+            workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+            bold = workbook.add_format({'bold': True})
+            date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+            sheet, row_index = None, XLSX_MAX_ROWS
+            for rows in self._iter_ledger_export_rows(domain):
+                for row in rows:
+                    if row_index >= XLSX_MAX_ROWS:
+                        sheet = workbook.add_worksheet()
+                        sheet.write_row(0, 0, self._ledger_export_headers(), bold)
+                        row_index = 1
+                    for col, value in enumerate(row):
+                        if col == 3 and value:
+                            sheet.write_datetime(row_index, col, value, date_format)
+                        elif value is not None:
+                            sheet.write(row_index, col, value)
+                    row_index += 1
+            if sheet is None:
+                workbook.add_worksheet().write_row(0, 0, self._ledger_export_headers(), bold)
+            workbook.close()
+            with open(path, 'rb') as f:
+                while True:
+                    block = f.read(EXPORT_BLOCK_SIZE)
+                    if not block:
+                        break
+                    yield block
+        finally:
+            os.unlink(path)
+
+    @api.model
+    def _ledger_export_stream(self, domain, file_format='csv'):
+        if file_format == 'xlsx':
+            return self._ledger_export_xlsx(domain)
+        return self._ledger_export_csv(domain)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import base64
+import binascii
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+
+from .account_move_line_balance_compaction import BALANCE_ON_DEMAND
+
+# Розмір сторінки за замовчуванням і максимальний
+LEDGER_PAGE_LIMIT_DEFAULT = 100
+LEDGER_PAGE_LIMIT_MAX = 1000
+
+
+class AccountMoveLine(models.Model):
+    """
+    Keyset-пагінація книги партнера по збережених балансах (ODOO-834).
+
+    Сторінка = рядки партиції (account + partner) після (date, id) попередньої сторінки:
+    seek по індексу bio_aml_balance_partition_idx замість OFFSET - вартість сторінки
+    не залежить від її номера.
+    """
+    _inherit = 'account.move.line'
+
+    @api.model
+    def get_ledger_page(self, account_id, partner_id=False, date_from=None, date_to=None,
+                        limit=LEDGER_PAGE_LIMIT_DEFAULT, cursor=None):
+        """
+        Сторінка книги партнера: проведені рядки рахунку account_id і партнера partner_id
+        (False - рядки без партнера) в [date_from, date_to] в порядку (date, id).
+
+        cursor - токен next_cursor попередньої сторінки.
+        Повертає {'lines': [...], 'next_cursor': токен або None, 'initializing': bool};
+        кожен рядок містить збережені bio_initial_balance / bio_end_balance
+        (стиснених рядків - розраховані на вимогу). initializing=True - початкове
+        заповнення ще триває, баланси можуть бути неповними (див. get_balance_status).
+        ODOO-834
+        """
+        self.check_access_rights('read')
+        limit = min(int(limit or LEDGER_PAGE_LIMIT_DEFAULT), LEDGER_PAGE_LIMIT_MAX)
+        self.env['bio.account.move.line.balance']._flush_dirty_partitions()
+        self.flush_model()
+
+        domain = [('parent_state', '=', 'posted')]
+        if date_from:
+            domain.append(('date', '>=', fields.Date.to_date(date_from)))
+        if date_to:
+            domain.append(('date', '<=', fields.Date.to_date(date_to)))
+        query = self._where_calc(domain)
+        self._apply_ir_rules(query, 'read')
+        # Умови партиції - тими ж виразами, що й ключ індексу
+        query.add_where(f'"{self._table}".account_id = %s', [account_id])
+        query.add_where(f'COALESCE("{self._table}".partner_id, 0) = %s', [partner_id or 0])
+        if cursor:
+            query.add_where(f'("{self._table}".date, "{self._table}".id) > (%s, %s)', self._decode_ledger_cursor(cursor))
+        query.order = f'"{self._table}".date, "{self._table}".id'
+        query.limit = limit + 1
+
+        columns = [
+            'id', 'date', 'move_id', 'move_name', 'ref', 'name',
+            'debit', 'credit', 'bio_initial_balance', 'bio_end_balance',
+            'currency_id', 'amount_currency', 'bio_end_balance_currency', 'bio_open_balance',
+        ]
+        # Баланси стиснених рядків (закриті роки) - на вимогу
+        query_str, params = query.select(*(
+            self._balance_column_sql(f'"{self._table}"', column) if column in BALANCE_ON_DEMAND
+            else f'"{self._table}".{column}'
+            for column in columns))
+        self.env.cr.execute(query_str, params)
+        rows = self.env.cr.fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self._encode_ledger_cursor(rows[-1][1], rows[-1][0])
+        lines = []
+        for row in rows:
+            line = dict(zip(columns, row))
+            line['date'] = fields.Date.to_string(line['date'])
+            lines.append(line)
+        return {'lines': lines, 'next_cursor': next_cursor,
+                'initializing': bool(self.env['bio.account.move.line.balance.rebuild']._initial_fill())}
+
+    @api.model
+    def get_balance_status(self):
+        """
+        Стан балансів: {'status': 'ready' | 'initializing', 'progress': % виконаного
+        початкового заповнення, 'chunk_count', 'chunk_done_count'}.
+        Поки status = 'initializing', баланси частини рядків ще не розраховані.
+        ODOO-834
+        """
+        self.check_access_rights('read')
+        rebuild = self.env['bio.account.move.line.balance.rebuild']._initial_fill()
+        if not rebuild:
+            return {'status': 'ready', 'progress': 100.0, 'chunk_count': 0, 'chunk_done_count': 0}
+        return {
+            'status': 'initializing',
+            'progress': round(rebuild.progress, 1),
+            'chunk_count': rebuild.chunk_count,
+            'chunk_done_count': rebuild.chunk_done_count,
+        }
+
+    @api.model
+    def _encode_ledger_cursor(self, date, line_id):
+        return base64.urlsafe_b64encode(('%s,%s' % (fields.Date.to_string(date), line_id)).encode()).decode()
+
+    @api.model
+    def _decode_ledger_cursor(self, cursor):
+        try:
+            date, line_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(',')
+            return [fields.Date.to_date(date), int(line_id)]
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+            raise UserError(_("Invalid ledger cursor: %s", cursor))
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from odoo import api, models
+
+
+class AccountPartialReconcile(models.Model):
+    _inherit = 'account.partial.reconcile'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """
+        Звірка змінює amount_residual рядків, а його перерахунок (flush обчислюваного поля)
+        не проходить через AccountMoveLine.write(). Тому партиції звірених рядків
+        позначаються для перерахунку відкритого балансу (bio_open_balance) тут.
+        ODOO-834
+        """
+        partials = super().create(vals_list)
+        (partials.debit_move_id | partials.credit_move_id) \
+            .with_context(bio_balance_caller='reconcile')._schedule_open_balance_update()
+        return partials
+
+    def unlink(self):
+        """
+        Роззвірка: партиції рядків зчитуються ДО видалення (рядки можуть видалятись
+        разом зі звіркою), відкритий баланс перераховується відкладено.
+        ODOO-834
+        """
+        lines = self.debit_move_id | self.credit_move_id
+        partitions = lines._get_balance_partitions(posted_only=True)
+        res = super().unlink()
+        if partitions and not lines._skip_balance_hooks():
+            self.env['bio.account.move.line.balance']._enqueue_open_partitions(partitions)
+        return res
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from odoo import fields, models
+
+
+class ResCompany(models.Model):
+    _inherit = 'res.company'
+
+    # Межа якорів балансів (ODOO-834): рядки з date <= цієї дати не переписуються
+    bio_balance_anchor_date = fields.Date(
+        string='Balance Anchor Date',
+        readonly=True,
+        copy=False,
+        help="Fiscal lock date the stored balance anchors were computed at. "
+             "Balances of journal items up to this date are frozen and never rewritten.",
+    )
+
+    # Межа стиснення (ODOO-834): у рядків з date <= цієї дати збережених балансів немає
+    bio_balance_compacted_date = fields.Date(
+        string='Balance Compacted Until',
+        readonly=True,
+        copy=False,
+        help="Stored balances of journal items up to this date (closed fiscal years) were compacted "
+             "into the balance anchors and are computed on demand.",
+    )
+
+    def write(self, vals):
+        res = super().write(vals)
+        if 'fiscalyear_lock_date' in vals:
+            self.env['bio.account.move.line.balance.anchor'].sudo()._refresh_companies(self)
+        return res
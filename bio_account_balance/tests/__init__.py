@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+from . import test_balances_at
+from . import test_cache
+from . import test_check
+from . import test_compaction
+from . import test_concurrency
+from . import test_incremental
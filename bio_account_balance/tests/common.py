@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+
+
+class BioAccountBalanceCommon(AccountTestInvoicingCommon):
+    """
+    Спільні дані тестів балансів (ODOO-834): проведення в рахунок дебіторів
+    з партнером, перерахунок брудних партицій, очікувані running balance.
+    """
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.receivable = cls.company_data['default_account_receivable']
+        cls.revenue = cls.company_data['default_account_revenue']
+        cls.journal = cls.company_data['default_journal_misc']
+        cls.balance_model = cls.env['bio.account.move.line.balance']
+
+    def _post_entry(self, date, amount, partner=None):
+        """Проведений запис: дебет рахунку дебіторів партнера на amount (від'ємний - кредит)."""
+        partner = partner or self.partner_a
+        move = self.env['account.move'].create({
+            'move_type': 'entry',
+            'journal_id': self.journal.id,
+            'date': date,
+            'line_ids': [
+                (0, 0, {'account_id': self.receivable.id, 'partner_id': partner.id,
+                        'debit': max(amount, 0.0), 'credit': max(-amount, 0.0)}),
+                (0, 0, {'account_id': self.revenue.id, 'partner_id': partner.id,
+                        'debit': max(-amount, 0.0), 'credit': max(amount, 0.0)}),
+            ],
+        })
+        move.action_post()
+        return move
+
+    def _flush_balances(self):
+        """Перерахунок партицій транзакції - як у pre-commit hook."""
+        self.env.flush_all()
+        self.balance_model._flush_dirty_partitions()
+
+    def _partition_lines(self, partner=None, account=None):
+        return self.env['account.move.line'].search([
+            ('account_id', '=', (account or self.receivable).id),
+            ('partner_id', '=', (partner or self.partner_a).id),
+            ('parent_state', '=', 'posted'),
+        ], order='date, id')
+
+    def _stored_balances(self, lines):
+        """{move_line_id: (initial, end)} з bio_account_move_line_balance."""
+        self.env.cr.execute("""
+            SELECT move_line_id, bio_initial_balance, bio_end_balance
+            FROM bio_account_move_line_balance
+            WHERE move_line_id IN %s
+        """, (tuple(lines.ids) or (0,),))
+        return {line_id: (initial, end) for line_id, initial, end in self.env.cr.fetchall()}
+
+    def _assert_running_balances(self, lines):
+        """Баланси рядків партиції = running sum debit - credit в порядку (date, id)."""
+        running = 0.0
+        stored = self._stored_balances(lines)
+        for line in lines:
+            self.assertAlmostEqual(line.bio_initial_balance, running, places=2)
+            self.assertAlmostEqual(stored[line.id][0], running, places=2)
+            running += line.debit - line.credit
+            self.assertAlmostEqual(line.bio_end_balance, running, places=2)
+            self.assertAlmostEqual(stored[line.id][1], running, places=2)
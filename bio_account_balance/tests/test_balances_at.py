@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from datetime import date
+
+from odoo.tests import tagged
+
+from .common import BioAccountBalanceCommon
+
+
+@tagged('post_install', '-at_install')
+class TestBalancesAt(BioAccountBalanceCommon):
+    """Баланси партицій на дати через checkpoint-и - get_balances_at() (ODOO-834)."""
+
+    def setUp(self):
+        super().setUp()
+        for day, amount in (('2022-03-10', 100.0), ('2022-11-05', -40.0), ('2023-02-01', 15.0),
+                            ('2023-02-20', 5.0)):
+            self._post_entry(day, amount)
+        self._flush_balances()
+        self.key = (self.receivable.id, self.partner_a.id)
+
+    def test_several_dates(self):
+        balances = self.env['account.move.line'].get_balances_at(
+            ['2023-02-10', '2022-06-30', '2023-12-31', '2023-02-10'], keys=[self.key])
+        self.assertEqual(sorted(balances), [date(2022, 6, 30), date(2023, 2, 10), date(2023, 12, 31)])
+        self.assertEqual(balances[date(2022, 6, 30)], {self.key: 100.0})
+        # Середина місяця: checkpoint січня + рядки до дати
+        self.assertEqual(balances[date(2023, 2, 10)], {self.key: 75.0})
+        self.assertEqual(balances[date(2023, 12, 31)], {self.key: 80.0})
+
+    def test_date_before_first_checkpoint(self):
+        aml = self.env['account.move.line']
+        self.assertEqual(aml.get_balances_at('2022-03-09', keys=[self.key]), {self.key: 0.0})
+        # День першого рядка - вже з ним, хоча checkpoint-у березня на цю дату ще немає
+        self.assertEqual(aml.get_balances_at('2022-03-10', keys=[self.key]), {self.key: 100.0})
+
+    def test_date_in_compacted_year(self):
+        aml = self.env['account.move.line']
+        dates = ['2022-06-30', '2022-11-04', '2022-11-05', '2023-02-10']
+        before = aml.get_balances_at(dates, keys=[self.key])
+        self.assertTrue(self.balance_model._compact_period(self.env.company, date(2022, 1, 1), date(2022, 12, 31)))
+        self.assertEqual(aml.get_balances_at(dates, keys=[self.key]), before)
+        self.assertEqual(before[date(2022, 11, 4)], {self.key: 100.0})
+        self.assertEqual(before[date(2022, 11, 5)], {self.key: 60.0})
+
+    def test_partition_without_partner(self):
+        self.env['account.move'].create({
+            'move_type': 'entry',
+            'journal_id': self.journal.id,
+            'date': '2023-03-01',
+            'line_ids': [
+                (0, 0, {'account_id': self.receivable.id, 'debit': 25.0}),
+                (0, 0, {'account_id': self.revenue.id, 'credit': 25.0}),
+            ],
+        }).action_post()
+        aml = self.env['account.move.line']
+        no_partner = (self.receivable.id, False)
+        # Партнер 0 в SQL - False в ключі результату; None в ключі запиту - та сама партиція
+        self.assertEqual(aml.get_balances_at('2023-03-31', keys=[(self.receivable.id, None), self.key]),
+                         {no_partner: 25.0, self.key: 80.0})
+        self.assertEqual(aml.get_balances_at('2023-03-31', domain=[('account_id', '=', self.receivable.id)]),
+                         {no_partner: 25.0, self.key: 80.0})
+        self.assertEqual(aml.get_balances_at('2023-02-28', keys=[no_partner]), {no_partner: 0.0})
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import tagged
+
+from .common import BioAccountBalanceCommon
+from ..models import account_move_line_balance_cache
+
+
+@tagged('post_install', '-at_install')
+class TestPivotCache(BioAccountBalanceCommon):
+    """Кеш opening/closing груп pivot і версії книги по рахунках та полях (ODOO-834)."""
+
+    def _read_pivot(self, groupby='partner_id'):
+        # Домен стандартного pivot Journal Items
+        return self.env['account.move.line'].read_group(
+            [('display_type', 'not in', ('line_section', 'line_note')), ('parent_state', '=', 'posted'),
+             ('account_id', '=', self.receivable.id)],
+            ['bio_opening_by_partner', 'bio_closing_by_partner'], [groupby], lazy=False)
+
+    def _stats(self):
+        return dict(account_move_line_balance_cache._pivot_cache_stats)
+
+    def _commit_versions(self):
+        """Перерахунок і журнал версій транзакції тесту - як у pre-commit hook."""
+        self._flush_balances()
+        self.balance_model._flush_ledger_versions()
+
+    def test_draft_edit_and_label_write_keep_cache(self):
+        move = self._post_entry('2024-06-05', 100.0)
+        self._commit_versions()
+        expected = self._read_pivot()
+        before = self._stats()
+        self.assertEqual(self._read_pivot(), expected)
+        self.assertEqual(self._stats()['hits'], before['hits'] + 1)
+
+        # Чернетка рахунку домену: ні перерахунку, ні версії
+        draft = self.env['account.move'].create({
+            'move_type': 'entry',
+            'journal_id': self.journal.id,
+            'date': '2024-06-10',
+            'line_ids': [
+                (0, 0, {'account_id': self.receivable.id, 'partner_id': self.partner_a.id, 'debit': 10.0}),
+                (0, 0, {'account_id': self.revenue.id, 'partner_id': self.partner_a.id, 'credit': 10.0}),
+            ],
+        })
+        draft.line_ids[0].debit = 20.0
+        draft.line_ids[1].credit = 20.0
+        # Підпис проведеного рядка: версія лише поля name
+        move.line_ids[0].name = 'Renamed'
+        self.env.flush_all()
+        before = self._stats()
+        self.assertEqual(self._read_pivot(), expected)
+        self.assertEqual(self._stats()['hits'], before['hits'] + 1)
+
+        # Pivot з групуванням по підпису не бере кеш, поки зміна не закомічена
+        self._read_pivot(groupby='name')
+        self.assertEqual(self._stats()['bypassed'], before['bypassed'] + 1)
+
+    def test_posting_changes_version(self):
+        self._post_entry('2024-07-05', 100.0)
+        self._commit_versions()
+        self._read_pivot()
+        self._post_entry('2024-07-10', 50.0)
+        self._commit_versions()
+        before = self._stats()
+        groups = self._read_pivot()
+        self.assertEqual(self._stats()['misses'], before['misses'] + 1)
+        closing = sum(group['bio_closing_by_partner'] for group in groups)
+        self.assertAlmostEqual(closing, 150.0, places=2)
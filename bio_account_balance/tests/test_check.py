@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from datetime import date
+
+from odoo.tests import tagged
+
+from .common import BioAccountBalanceCommon
+
+
+@tagged('post_install', '-at_install')
+class TestDriftCheck(BioAccountBalanceCommon):
+    """Перевірка розбіжностей і виправлення партицій (ODOO-834)."""
+
+    def _drifted(self, key):
+        # Пачка з однієї партиції - key
+        _batch_keys, drifted = self.env['bio.account.move.line.balance.check']._find_drifted(
+            (key[0], key[1] - 1), 1)
+        return drifted
+
+    def test_drift_in_locked_history_is_repaired(self):
+        for day, amount in (('2023-03-01', 100.0), ('2023-06-01', -30.0), ('2024-02-01', 50.0)):
+            self._post_entry(day, amount)
+        self._flush_balances()
+        self.env.company.fiscalyear_lock_date = date(2023, 12, 31)
+        self.assertEqual(self.env.company.bio_balance_anchor_date, date(2023, 12, 31))
+        key = (self.receivable.id, self.partner_a.id)
+        self.assertFalse(self._drifted(key))
+
+        # Розбіжність в заблокованій історії: збережені баланси і якір партиції
+        lines = self._partition_lines()
+        self.env.cr.execute("""
+            UPDATE bio_account_move_line_balance SET bio_end_balance = bio_end_balance + 5
+            WHERE move_line_id IN %s
+        """, (tuple(lines.ids),))
+        self.env.cr.execute("""
+            UPDATE account_move_line SET bio_end_balance = bio_end_balance + 5 WHERE id IN %s
+        """, (tuple(lines.ids),))
+        self.env.cr.execute("""
+            UPDATE bio_account_move_line_balance_anchor SET balance = balance + 5
+            WHERE account_id = %s AND partner_id = %s
+        """, key)
+        self.env.invalidate_all()
+        self.assertEqual(self._drifted(key), [key])
+
+        self.env['ir.config_parameter'].sudo().set_param('bio_account_balance.drift_cursor', '')
+        check = self.env['bio.account.move.line.balance.check']._check_and_repair()
+        self.assertIn('account %s, partner %s' % key, check.repaired_partitions)
+        self.env.invalidate_all()
+        self._assert_running_balances(self._partition_lines())
+        self.env.cr.execute("""
+            SELECT SUM(balance) FROM bio_account_move_line_balance_anchor
+            WHERE account_id = %s AND partner_id = %s
+        """, key)
+        self.assertAlmostEqual(self.env.cr.fetchone()[0], 70.0, places=2)
+        # Виправлена партиція більше не знаходиться
+        self.assertFalse(self._drifted(key))
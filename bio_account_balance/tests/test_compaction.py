@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from datetime import date
+
+from odoo.tests import tagged
+
+from .common import BioAccountBalanceCommon
+
+
+@tagged('post_install', '-at_install')
+class TestCompactedPivot(BioAccountBalanceCommon):
+    """Pivot opening/closing по рядках стиснених років (ODOO-834)."""
+
+    def _pivot_balances(self):
+        # journal_id в домені - розрахунок по рядках, не через checkpoint-и
+        groups = self.env['account.move.line'].read_group(
+            [('account_id', '=', self.receivable.id), ('journal_id', '=', self.journal.id)],
+            ['bio_opening_by_partner', 'bio_closing_by_partner'], ['date:year'], lazy=False)
+        return [(group['date:year'], group['bio_opening_by_partner'], group['bio_closing_by_partner'])
+                for group in groups]
+
+    def test_pivot_after_compaction(self):
+        for day, amount in (('2022-03-10', 100.0), ('2022-11-05', -40.0), ('2023-02-01', 15.0)):
+            self._post_entry(day, amount)
+        self._flush_balances()
+        before = self._pivot_balances()
+        self.assertEqual([(opening, closing) for _year, opening, closing in before],
+                         [(0.0, 60.0), (60.0, 75.0)])
+
+        line_count = self.balance_model._compact_period(self.env.company, date(2022, 1, 1), date(2022, 12, 31))
+        self.assertTrue(line_count)
+        compacted = self._partition_lines().filtered(lambda line: line.date.year == 2022)
+        self.assertFalse(self._stored_balances(compacted))
+
+        self.assertEqual(self._pivot_balances(), before)
+
+    def test_currency_balances_after_compaction(self):
+        currency = self.currency_data['currency']
+        for day, amount, amount_currency in (('2022-03-10', 100.0, 300.0), ('2022-11-05', -40.0, -120.0),
+                                             ('2023-02-01', 15.0, 45.0)):
+            self.env['account.move'].create({
+                'move_type': 'entry',
+                'journal_id': self.journal.id,
+                'date': day,
+                'line_ids': [
+                    (0, 0, {'account_id': self.receivable.id, 'partner_id': self.partner_a.id,
+                            'currency_id': currency.id, 'amount_currency': amount_currency,
+                            'debit': max(amount, 0.0), 'credit': max(-amount, 0.0)}),
+                    (0, 0, {'account_id': self.revenue.id, 'partner_id': self.partner_a.id,
+                            'currency_id': currency.id, 'amount_currency': -amount_currency,
+                            'debit': max(-amount, 0.0), 'credit': max(amount, 0.0)}),
+                ],
+            }).action_post()
+        self._flush_balances()
+        lines = self._partition_lines()
+        before = lines._get_line_balances()
+        self.assertEqual([before[line.id]['bio_end_balance_currency'] for line in lines], [300.0, 180.0, 225.0])
+
+        # Баланс у валюті стисненого рядка - від якоря на межі блокування
+        self.env.company.fiscalyear_lock_date = date(2022, 12, 31)
+        self.assertTrue(self.balance_model._compact_period(self.env.company, date(2022, 1, 1), date(2022, 12, 31)))
+        compacted = lines.filtered(lambda line: line.date.year == 2022)
+        self.assertFalse(self._stored_balances(compacted))
+        self.assertEqual(lines._get_line_balances(), before)
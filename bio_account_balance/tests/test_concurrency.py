@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+from contextlib import closing
+
+from psycopg2 import errorcodes, OperationalError
+
+from odoo import fields
+from odoo.sql_db import db_connect
+from odoo.tests import tagged
+from odoo.tools import mute_logger
+
+from .common import BioAccountBalanceCommon
+from ..models.account_move_line_balance_guard import GUARD_TABLE, STALE_PARTITIONS_KEY
+
+
+@tagged('post_install', '-at_install')
+class TestConcurrentRecompute(BioAccountBalanceCommon):
+    """
+    Перерахунок після конкурентної транзакції (ODOO-834): snapshot транзакції тесту
+    старший за перерахунок, закомічений з другого з'єднання, - партиція віддається
+    post-commit перерахунку, а не перераховується без рядків другої транзакції.
+    Повна перебудова рахунку в такому випадку завершується serialization failure.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # Партиція, якої транзакція тесту ще не торкалась: інакше друге з'єднання чекало б її lock-у
+        self.partner = self.env['res.partner'].create({'name': 'Concurrent Partner'})
+        self.key = (self.receivable.id, self.partner.id)
+        self.date = fields.Date.to_date('2024-01-01')
+
+    def _guard_cursor(self):
+        cr = db_connect(self.env.cr.dbname).cursor()
+        # Не зависати на lock-у транзакції тесту, якщо перевірка не спрацювала
+        cr.execute("SET lock_timeout = '5s'")
+        return closing(cr)
+
+    def _commit_concurrent_recompute(self):
+        """Друге з'єднання позначає партицію так, як це робить закомічений перерахунок."""
+        with self._guard_cursor() as cr:
+            cr.execute(self.balance_model._guard_partitions_sql(), {
+                'account_ids': [self.key[0]], 'partner_keys': [self.key[1]],
+            })
+            cr.commit()
+        self.addCleanup(self._delete_guard)
+
+    def _delete_guard(self):
+        with self._guard_cursor() as cr:
+            cr.execute(f"DELETE FROM {GUARD_TABLE} WHERE account_id = %s AND partner_key = %s", self.key)
+            cr.commit()
+
+    def _assert_serialization_failure(self, func, *args):
+        with mute_logger('odoo.sql_db'), self.assertRaises(OperationalError) as catcher, self.env.cr.savepoint():
+            func(*args)
+        self.assertEqual(catcher.exception.pgcode, errorcodes.SERIALIZATION_FAILURE)
+
+    def _stale_partitions(self, kind):
+        return self.env.cr.postcommit.data.get(STALE_PARTITIONS_KEY, {}).get(kind)
+
+    def test_recompute_with_stale_snapshot(self):
+        self._commit_concurrent_recompute()
+        self.assertEqual(self.balance_model._recompute_partitions({self.key: self.date}), [])
+        self.assertEqual(self._stale_partitions('full'), {self.key: self.date})
+
+    def test_open_recompute_with_stale_snapshot(self):
+        self._commit_concurrent_recompute()
+        self.assertEqual(self.balance_model._recompute_open_partitions({self.key: self.date}), [])
+        self.assertEqual(self._stale_partitions('open'), {self.key: self.date})
+
+    def test_stale_partition_does_not_hold_back_others(self):
+        self._post_entry('2024-01-05', 100.0)
+        self._post_entry('2024-01-10', -40.0)
+        self._commit_concurrent_recompute()
+        fresh_key = (self.receivable.id, self.partner_a.id)
+        self.env.flush_all()
+        line_ids = self.balance_model._recompute_partitions({self.key: self.date, fresh_key: self.date})
+        self.assertTrue(line_ids)
+        self._assert_running_balances(self._partition_lines())
+        self.assertEqual(self._stale_partitions('full'), {self.key: self.date})
+
+    def test_rebuild_chunk_with_stale_snapshot(self):
+        self._commit_concurrent_recompute()
+        self._assert_serialization_failure(
+            self.balance_model._rebuild_chunk, self.env.company.id, self.receivable.id, self.receivable.id)
+
+    def test_recompute_with_current_snapshot(self):
+        # Власний попередній перерахунок транзакції видимий - партиція не відкладається
+        self._post_entry('2024-01-05', 100.0, partner=self.partner)
+        self._flush_balances()
+        self.balance_model._recompute_partitions({self.key: self.date})
+        self._assert_running_balances(self._partition_lines(partner=self.partner))
+        self.assertFalse(self._stale_partitions('full'))
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+import time
+
+from odoo.tests import tagged
+
+from .common import BioAccountBalanceCommon
+from ..models.account_move_line_balance import DIRTY_PARTITIONS_KEY
+
+
+@tagged('post_install', '-at_install')
+class TestIncrementalBalances(BioAccountBalanceCommon):
+    """Інкрементальний перерахунок хвоста партиції (ODOO-834)."""
+
+    def test_post_into_middle_of_partition(self):
+        for day, amount in (('2024-01-05', 100.0), ('2024-01-10', 50.0),
+                            ('2024-01-20', -30.0), ('2024-01-25', 70.0)):
+            self._post_entry(day, amount)
+        self._flush_balances()
+        self._assert_running_balances(self._partition_lines())
+
+        # Рядок в середину партиції: хвіст перераховується від попереднього рядка
+        self._post_entry('2024-01-15', 25.0)
+        self._flush_balances()
+        lines = self._partition_lines()
+        self.assertEqual(len(lines), 5)
+        self._assert_running_balances(lines)
+
+        # Інкрементальний результат = повний перерахунок window function
+        incremental = self._stored_balances(lines)
+        self.balance_model.update_balances_sql(company_id=self.env.company.id)
+        self.assertEqual(self._stored_balances(lines), incremental)
+
+    def test_unpost_middle_line(self):
+        moves = [self._post_entry(day, amount) for day, amount in (
+            ('2024-02-01', 10.0), ('2024-02-10', 20.0), ('2024-02-20', 40.0))]
+        self._flush_balances()
+
+        moves[1].button_draft()
+        self._flush_balances()
+        lines = self._partition_lines()
+        self.assertEqual(len(lines), 2)
+        self._assert_running_balances(lines)
+        draft_line = moves[1].line_ids.filtered(lambda l: l.account_id == self.receivable)
+        self.assertFalse(self._stored_balances(draft_line))
+        self.assertFalse(draft_line.bio_end_balance)
+
+    def test_defer_during_initial_fill(self):
+        # Незавершений chunk початкового заповнення рахунку дебіторів
+        rebuild = self.env['bio.account.move.line.balance.rebuild'].create({
+            'is_initial': True,
+            'chunk_ids': [(0, 0, {'company_id': self.env.company.id,
+                                  'account_from': self.receivable.id, 'account_to': self.receivable.id})],
+        })
+        self._post_entry('2024-03-05', 100.0)
+        self._post_entry('2024-03-10', -40.0)
+        self._flush_balances()
+        lines = self._partition_lines()
+        self.assertFalse(self._stored_balances(lines))
+        queue = self.env['bio.account.move.line.balance.queue']
+        self.assertTrue(queue.search([('account_id', '=', self.receivable.id), ('partner_id', '=', self.partner_a.id)]))
+
+        # Поки chunk не завершений, черга його партицій не обробляє
+        self.assertEqual(queue._process(), 0)
+        self.assertFalse(self._stored_balances(lines))
+
+        rebuild._process_chunks()
+        self.assertTrue(rebuild._finish(time.time()))
+        self.assertTrue(queue._process())
+        self._assert_running_balances(lines)
+
+    def test_shadow_rebuild_keeps_indexes(self):
+        self._post_entry('2024-04-05', 100.0)
+        self._post_entry('2024-04-10', -40.0)
+        self._flush_balances()
+        # Індекс, доданий поза моделлю (інший модуль, DBA), переживає заміну таблиці
+        self.env.cr.execute("CREATE INDEX bio_test_balance_end_idx ON bio_account_move_line_balance (bio_end_balance)")
+        self.env.cr.execute("""
+            SELECT indexname FROM pg_indexes WHERE tablename = 'bio_account_move_line_balance' ORDER BY indexname
+        """)
+        indexes = self.env.cr.fetchall()
+
+        self.assertTrue(self.balance_model._rebuild_shadow(auto_commit=False))
+        self.env.cr.execute("""
+            SELECT indexname FROM pg_indexes WHERE tablename = 'bio_account_move_line_balance' ORDER BY indexname
+        """)
+        self.assertEqual(self.env.cr.fetchall(), indexes)
+        self._assert_running_balances(self._partition_lines())
+
+    def test_draft_line_queues_nothing(self):
+        self._flush_balances()
+        move = self.env['account.move'].create({
+            'move_type': 'entry',
+            'journal_id': self.journal.id,
+            'date': '2024-05-05',
+            'line_ids': [
+                (0, 0, {'account_id': self.receivable.id, 'partner_id': self.partner_a.id, 'debit': 10.0}),
+                (0, 0, {'account_id': self.revenue.id, 'partner_id': self.partner_a.id, 'credit': 10.0}),
+            ],
+        })
+        move.line_ids[0].debit = 15.0
+        move.line_ids[1].credit = 15.0
+        self.env.flush_all()
+        self.assertFalse(self.env.cr.precommit.data.get(DIRTY_PARTITIONS_KEY))
+
+        # Проведення позначає партиції, повернення в чернетку - ті самі партиції до зміни стану
+        move.action_post()
+        self.assertEqual(set(self.env.cr.precommit.data[DIRTY_PARTITIONS_KEY]), {
+            (self.receivable.id, self.partner_a.id), (self.revenue.id, self.partner_a.id),
+        })
+        self._flush_balances()
+        move.button_draft()
+        self.assertEqual(len(self.env.cr.precommit.data[DIRTY_PARTITIONS_KEY]), 2)
+        self._flush_balances()
+        self.assertFalse(self._stored_balances(move.line_ids))
+
+    def test_journal_items_pivot_uses_checkpoints(self):
+        for day, amount in (('2024-08-05', 100.0), ('2024-08-20', -30.0), ('2024-09-10', 50.0)):
+            self._post_entry(day, amount)
+        self._flush_balances()
+        # Домен стандартного pivot Journal Items (фільтр Posted) з періодом
+        domain = [
+            ('display_type', 'not in', ('line_section', 'line_note')),
+            ('parent_state', '=', 'posted'),
+            ('account_id', '=', self.receivable.id),
+            ('date', '>=', '2024-08-10'), ('date', '<=', '2024-09-30'),
+        ]
+        aml = self.env['account.move.line']
+        self.assertIsNotNone(aml._split_checkpoint_domain(domain))
+        by_checkpoints = aml._calc_balances_by_checkpoints(domain, ['partner_id'])
+        self.assertEqual(by_checkpoints, {(self.partner_a.id,): (100.0, 120.0, 0.0)})
+        # Той самий результат по рядках
+        by_lines = aml._calc_balances_by_groups(domain, ['partner_id'], with_open=True)
+        self.assertEqual({key: value[:2] for key, value in by_lines.items()}, {(self.partner_a.id,): (100.0, 120.0)})
+        # Виключення рядків з сумами checkpoint-и не обробляють
+        self.assertIsNone(aml._split_checkpoint_domain(
+            [('display_type', 'not in', ('line_section', 'payment_term'))] + domain[1:]))
+
+    def _pivot(self, domain, groupby):
+        groups = self.env['account.move.line'].read_group(
+            domain, ['bio_opening_by_partner', 'bio_closing_by_partner'], groupby, lazy=False)
+        return {
+            tuple(group[gb][0] if isinstance(group[gb], tuple) else group[gb] for gb in groupby):
+                (group['bio_opening_by_partner'], group['bio_closing_by_partner'])
+            for group in groups
+        }
+
+    def test_pivot_multi_level_groupby(self):
+        for day, amount, partner in (('2024-10-05', 100.0, self.partner_a), ('2024-10-20', 40.0, self.partner_b),
+                                     ('2024-11-10', -30.0, self.partner_a), ('2024-11-15', 10.0, self.partner_b)):
+            self._post_entry(day, amount, partner=partner)
+        self._flush_balances()
+        domain = [('account_id', 'in', (self.receivable.id, self.revenue.id)), ('date', '>=', '2024-11-01')]
+        expected = {
+            (self.receivable.id, self.partner_a.id): (100.0, 70.0),
+            (self.receivable.id, self.partner_b.id): (40.0, 50.0),
+            (self.revenue.id, self.partner_a.id): (-100.0, -70.0),
+            (self.revenue.id, self.partner_b.id): (-40.0, -50.0),
+        }
+        self.assertEqual(self._pivot(domain, ['account_id', 'partner_id']), expected)
+        # Checkpoint-и і рядки дають ті самі групи
+        aml = self.env['account.move.line']
+        by_lines = aml._calc_balances_by_groups(domain, ['account_id', 'partner_id'], with_open=True)
+        self.assertEqual({key: value[:2] for key, value in by_lines.items()}, expected)
+        self.assertEqual(aml._calc_balances_by_checkpoints(domain, ['account_id', 'partner_id']),
+                         {key: value + (0.0,) for key, value in expected.items()})
+
+    def test_pivot_group_without_partner(self):
+        self._post_entry('2024-10-05', 100.0)
+        self.env['account.move'].create({
+            'move_type': 'entry',
+            'journal_id': self.journal.id,
+            'date': '2024-10-10',
+            'line_ids': [
+                (0, 0, {'account_id': self.receivable.id, 'debit': 25.0}),
+                (0, 0, {'account_id': self.revenue.id, 'credit': 25.0}),
+            ],
+        }).action_post()
+        self._flush_balances()
+        domain = [('account_id', '=', self.receivable.id)]
+        # Група False (партнер 0) - окрема партиція, не зливається з іншими групами
+        self.assertEqual(self._pivot(domain, ['partner_id']), {
+            (self.partner_a.id,): (0.0, 100.0),
+            (False,): (0.0, 25.0),
+        })
+        # journal_id в домені - той самий результат по рядках
+        self.assertEqual(self._pivot(domain + [('journal_id', '=', self.journal.id)], ['partner_id']), {
+            (self.partner_a.id,): (0.0, 100.0),
+            (False,): (0.0, 25.0),
+        })
+
+    def test_pivot_date_granularity_uses_lines(self):
+        for day, amount in (('2024-10-05', 100.0), ('2024-10-20', -30.0), ('2024-11-10', 50.0)):
+            self._post_entry(day, amount)
+        self._flush_balances()
+        domain = [('account_id', '=', self.receivable.id), ('partner_id', '=', self.partner_a.id)]
+        aml = self.env['account.move.line']
+        # Групування по місяцях checkpoint-и не обробляють - розрахунок по рядках
+        self.assertIsNone(aml._calc_balances_by_checkpoints(domain, ['date:month']))
+        groups = aml.read_group(domain, ['bio_opening_by_partner', 'bio_closing_by_partner'],
+                                ['date:month'], lazy=False, orderby='date:month')
+        self.assertEqual([(group['bio_opening_by_partner'], group['bio_closing_by_partner']) for group in groups],
+                         [(0.0, 70.0), (70.0, 120.0)])
+        # Рівень партнера під місяцем
+        self.assertEqual(self._pivot(domain, ['partner_id', 'date:month'])[(self.partner_a.id, 'November 2024')],
+                         (70.0, 120.0))
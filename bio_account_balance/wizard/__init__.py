@@ -0,0 +1 @@
+from . import account_move_line_balance_export
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from odoo import fields, models
+
+
+class AccountMoveLineBalanceExport(models.TransientModel):
+    """
+    Wizard потокового вивантаження книги з running balance (ODOO-834).
+    Файл формує HTTP route /bio_account_balance/ledger_export/<id>
+    (див. account.move.line._ledger_export_stream).
+    """
+    _name = 'bio.account.move.line.balance.export'
+    _description = 'Running balance ledger export'
+
+    date_from = fields.Date(string='Date From')
+    date_to = fields.Date(string='Date To')
+    account_ids = fields.Many2many(
+        comodel_name='account.account',
+        string='Accounts',
+        help="Leave empty to export all accounts.",
+    )
+    partner_ids = fields.Many2many(
+        comodel_name='res.partner',
+        string='Partners',
+        help="Leave empty to export all partners.",
+    )
+    file_format = fields.Selection(
+        selection=[
+            ('csv', 'CSV'),
+            ('xlsx', 'XLSX'),
+        ],
+        string='Format',
+        default='csv',
+        required=True,
+    )
+
+    def _get_domain(self):
+        self.ensure_one()
+        domain = [('parent_state', '=', 'posted')]
+        if self.date_from:
+            domain.append(('date', '>=', self.date_from))
+        if self.date_to:
+            domain.append(('date', '<=', self.date_to))
+        if self.account_ids:
+            domain.append(('account_id', 'in', self.account_ids.ids))
+        if self.partner_ids:
+            domain.append(('partner_id', 'in', self.partner_ids.ids))
+        return domain
+
+    def _get_filename(self):
+        self.ensure_one()
+        period = '_'.join(str(d) for d in (self.date_from, self.date_to) if d)
+        return 'ledger%s.%s' % (period and '_' + period, self.file_format)
+
+    def action_export(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_url',
+            'url': '/bio_account_balance/ledger_export/%s' % self.id,
+            'target': 'self',
+        }